@@ -0,0 +1,75 @@
+"""
+Compares two pipeline benchmark result files and reports regressions.
+
+Usage:
+
+    python -m benchmark.compare benchmark/results/<base>.json benchmark/results/<new>.json
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return {scenario["file_num"]: scenario for scenario in report["scenarios"]}, report
+
+
+def scenario_metrics(scenario):
+    """
+    Flattens one scenario into {metric: (value, higher_is_better)}.
+    """
+    metrics = {
+        "files_per_sec": (scenario["files_per_sec"], True),
+        "peak_rss_mb": (scenario["peak_rss_mb"], False),
+    }
+    for stage, summary in scenario["stages"].items():
+        for key in ["p50_ms", "p95_ms", "p99_ms"]:
+            metrics[f"{stage}.{key}"] = (summary[key], False)
+    for service, value in scenario["calls_per_file"].items():
+        metrics[f"{service}_calls_per_file"] = (value, False)
+    return metrics
+
+
+def compare(base_path, new_path, threshold=0.1):
+    base, base_report = load(base_path)
+    new, new_report = load(new_path)
+    regressions = []
+    print(f"base {base_report['revision']}  ->  new {new_report['revision']}")
+    for file_num in sorted(set(base) & set(new)):
+        print(f"\n{file_num} files")
+        base_metrics = scenario_metrics(base[file_num])
+        new_metrics = scenario_metrics(new[file_num])
+        for name in sorted(set(base_metrics) & set(new_metrics)):
+            old_value, higher_is_better = base_metrics[name]
+            new_value, _ = new_metrics[name]
+            if old_value:
+                change = (new_value - old_value) / old_value
+            else:
+                change = 0.0 if not new_value else float("inf")
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > threshold else ""
+            if flag:
+                regressions.append((file_num, name, old_value, new_value))
+            print(f"  {name:<32} {old_value:>12} {new_value:>12} {change:>+8.1%} {flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare pipeline benchmark results")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change counted as a regression (default 0.1 = 10%%)",
+    )
+    args = parser.parse_args(argv)
+    regressions = compare(args.base, args.new, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""In-process stand-ins for the services moto does not cover.
+
+S3, SQS and DynamoDB are served by moto; GitLab, Bedrock and the async
+Lambda invoke used by api_post_code_review are faked here, and completion
+callbacks go to a local HTTP server, so the whole pipeline can run on one
+machine without network access.
+"""
+import hashlib
+import hmac
+import io
+import json
+import sys
+import threading
+import time
+import types
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def synthetic_file_content(index, size=2048):
+    """
+    Returns deterministic python source of roughly ``size`` bytes.
+    """
+    lines = [f"# synthetic module {index}", "import os", ""]
+    n = 0
+    while sum(len(line) + 1 for line in lines) < size:
+        lines.append(f"def func_{index}_{n}(value):")
+        lines.append(f"    return os.path.join(str(value), 'part_{n}')")
+        lines.append("")
+        n += 1
+    return "\n".join(lines)
+
+
+class SyntheticRepo:
+    """
+    A GitLab repository with ``file_num`` reviewable files spread over
+    ``dir_num`` directories and one changed-files diff covering all of them.
+    """
+
+    def __init__(self, file_num, dir_num=20, file_size=2048):
+        self.file_num = file_num
+        self.file_size = file_size
+        self.paths = [
+            f"src/pkg_{i % dir_num}/module_{i}.py" for i in range(file_num)
+        ]
+        self._index = {path: i for i, path in enumerate(self.paths)}
+
+    def content(self, path):
+        return synthetic_file_content(self._index[path], self.file_size)
+
+    def tree(self):
+        return [{"type": "blob", "path": path} for path in self.paths]
+
+    def diff(self):
+        return [
+            {
+                "new_path": path,
+                "diff": f"@@ -1,1 +1,2 @@\n+# change in {path}\n",
+            }
+            for path in self.paths
+        ]
+
+
+class _FakeFile:
+    def __init__(self, content):
+        self._content = content
+
+    def decode(self):
+        return self._content.encode("utf-8")
+
+
+class _FakeFiles:
+    def __init__(self, gitlab, repo):
+        self._gitlab = gitlab
+        self._repo = repo
+
+    def get(self, file_path, ref="main"):
+        self._gitlab.count("files.get")
+        return _FakeFile(self._repo.content(file_path))
+
+
+class _FakeCommit:
+    def __init__(self, gitlab, repo):
+        self._gitlab = gitlab
+        self._repo = repo
+
+    def diff(self, **kwargs):
+        self._gitlab.count("commit.diff")
+        return self._repo.diff()
+
+
+class _FakeCommits:
+    def __init__(self, gitlab, repo):
+        self._gitlab = gitlab
+        self._repo = repo
+
+    def get(self, commit_id):
+        self._gitlab.count("commits.get")
+        return _FakeCommit(self._gitlab, self._repo)
+
+
+class _FakeProject:
+    def __init__(self, gitlab, repo):
+        self._gitlab = gitlab
+        self._repo = repo
+        self.files = _FakeFiles(gitlab, repo)
+        self.commits = _FakeCommits(gitlab, repo)
+
+    def repository_tree(self, path="", **kwargs):
+        self._gitlab.count("repository_tree")
+        return self._repo.tree()
+
+
+class _FakeProjects:
+    def __init__(self, gitlab):
+        self._gitlab = gitlab
+
+    def get(self, project_idorpath):
+        self._gitlab.count("projects.get")
+        return _FakeProject(self._gitlab, self._gitlab.repos[project_idorpath])
+
+
+class FakeGitlabServer:
+    """
+    Holds the synthetic repositories and counts every GitLab API call.
+    ``install()`` replaces the ``gitlab`` module so lambda code that does
+    ``gitlab.Gitlab(url, private_token=...)`` talks to this server.
+    """
+
+    def __init__(self):
+        self.repos = {}
+        self.calls = {}
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def add_repo(self, project, repo):
+        self.repos[project] = repo
+
+    def install(self):
+        server = self
+
+        class Gitlab:
+            def __init__(self, url=None, private_token=None, **kwargs):
+                self.projects = _FakeProjects(server)
+
+        module = types.ModuleType("gitlab")
+        module.Gitlab = Gitlab
+        sys.modules["gitlab"] = module
+        return module
+
+
+class FakeBedrockClient:
+    """
+    bedrock-runtime stand-in returning a fixed Claude 3 style reply after an
+    optional simulated model latency.
+    """
+
+    def __init__(self, latency_ms=0, score=85, output_tokens=200):
+        self.latency_ms = latency_ms
+        self.score = score
+        self.output_tokens = output_tokens
+        self.calls = {}
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self.calls["InvokeModel"] = self.calls.get("InvokeModel", 0) + 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        request = json.loads(body)
+        text = (
+            f"<review_score>{self.score}</review_score>"
+            "<review_result>synthetic review result</review_result>"
+        )
+        response_body = {
+            "content": [{"type": "text", "text": text}],
+            "usage": {
+                "input_tokens": len(request["messages"][0]["content"]) // 4,
+                "output_tokens": self.output_tokens,
+            },
+        }
+        return {"body": io.BytesIO(json.dumps(response_body).encode("utf-8"))}
+
+
+class FakeLambdaClient:
+    """
+    Lambda stand-in that records ``Event`` invocations so the harness can
+    run the target handler in-process afterwards.
+    """
+
+    def __init__(self):
+        self.pending = deque()
+        self.calls = {}
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"", **kwargs):
+        self.calls["Invoke"] = self.calls.get("Invoke", 0) + 1
+        if isinstance(Payload, bytes):
+            Payload = Payload.decode("utf-8")
+        self.pending.append((FunctionName, json.loads(Payload)))
+        return {"StatusCode": 202}
+
+
+class CallbackServer:
+    """
+    Local HTTP server receiving review_notifier callbacks. Every request is
+    kept with whether its X-CodeReview-Signature matches ``secret``.
+    ``fail_first`` requests are answered with 503 to exercise the retries.
+    """
+
+    def __init__(self, secret="", fail_first=0):
+        self.secret = secret
+        self.fail_first = fail_first
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+                timestamp = self.headers.get("X-CodeReview-Timestamp", "")
+                expected = hmac.new(
+                    server.secret.encode("utf-8"),
+                    f"{timestamp}.{body}".encode("utf-8"),
+                    hashlib.sha256,
+                ).hexdigest()
+                server.requests.append(
+                    {
+                        "payload": json.loads(body),
+                        "signed": self.headers.get("X-CodeReview-Signature")
+                        == f"sha256={expected}",
+                        "received_at": time.perf_counter(),
+                    }
+                )
+                status = 503 if len(server.requests) <= server.fail_first else 200
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/callback"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
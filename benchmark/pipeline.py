@@ -0,0 +1,725 @@
+"""
+End-to-end pipeline benchmark.
+
+Drives api_post_code_review -> split_task -> code_review -> api_get_result
+in-process against moto (S3, SQS, DynamoDB) plus the fakes in
+``benchmark/fakes.py`` (GitLab, Bedrock, Lambda invoke) for synthetic
+repositories of different sizes, and writes the results as JSON so two
+commits can be compared with ``python -m benchmark.compare``.
+
+Usage (from the repository root):
+
+    pip install -r benchmark/requirements.txt
+    python -m benchmark.pipeline --sizes 10 100 1000 5000
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT_DIR, "codereview", "lambda_function")
+# the common Lambda layer, mounted at /opt/python in AWS
+COMMON_LAYER_DIR = os.path.join(ROOT_DIR, "codereview", "lambda_common", "python")
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmark", "results")
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+REGION = "us-east-1"
+ENV_NAME = "bench"
+PROJECT = "bench/project"
+BRANCH = "main"
+COMMIT_ID = "0123456789abcdef0123456789abcdef01234567"
+
+REPO_CODE_REVIEW_TABLE_NAME = f"repo_code_review_table_{ENV_NAME}"
+REPO_CODE_REVIEW_SCORE_TABLE_NAME = f"repo_code_review_score_{ENV_NAME}"
+REPO_CODE_REVIEW_COUNTER_TABLE_NAME = f"repo_code_review_counter_{ENV_NAME}"
+REPO_CODE_REVIEW_CACHE_TABLE_NAME = f"repo_code_review_cache_{ENV_NAME}"
+REPO_CODE_REVIEW_FILE_TABLE_NAME = f"repo_code_review_file_{ENV_NAME}"
+BUCKET_NAME = f"code-review-result-{ENV_NAME}"
+LAMBDA_LOG_BUCKET_NAME = f"lambda-log-{ENV_NAME}"
+TASK_QUEUE_NAME = f"codereview_task_queue_{ENV_NAME}"
+INTERACTIVE_QUEUE_NAME = f"codereview_interactive_queue_{ENV_NAME}"
+MERGE_QUEUE_NAME = f"codereview_merge_queue_{ENV_NAME}"
+SUMMARY_QUEUE_NAME = f"codereview_summary_queue_{ENV_NAME}"
+TASK_DLQ_NAME = f"codereview_task_dlq_{ENV_NAME}"
+# review_dlq triage 默认最多读取 1000 条
+MAX_DEAD_LETTERS = 1000
+SPLIT_TASK_LAMBDA_NAME = f"split_task_{ENV_NAME}"
+REVIEW_NOTIFIER_LAMBDA_NAME = f"review_notifier_{ENV_NAME}"
+CALLBACK_SECRET = "benchmark-callback-secret"
+
+# Mirrors codereview/database/stack.py
+TABLE_DEFINITIONS = [
+    {
+        "TableName": REPO_CODE_REVIEW_TABLE_NAME,
+        "KeySchema": [("review_id", "S", "HASH")],
+        "GlobalSecondaryIndexes": {
+            "project_created_at_gsi": [("project", "S"), ("created_at", "S")],
+            "branch_created_at_gsi": [("branch", "S"), ("created_at", "S")],
+            "scan_scope_created_at_gsi": [("scan_scope", "S"), ("created_at", "S")],
+            "commit_id_created_at_gsi": [("commit_id", "S"), ("created_at", "S")],
+            "repo_url_created_at_gsi": [("repo_url", "S"), ("created_at", "S")],
+            "project_branch_created_at_gsi": [("project_branch", "S"), ("created_at", "S")],
+            "year_month-created_at-index": [("year_month", "S"), ("created_at", "S")],
+        },
+    },
+    {
+        "TableName": REPO_CODE_REVIEW_SCORE_TABLE_NAME,
+        "KeySchema": [("project_branch_file", "S", "HASH"), ("version", "N", "RANGE")],
+        "GlobalSecondaryIndexes": {
+            "version_file_index": [("version", "N"), ("project_branch_file", "S")],
+            "file_review_at_gsi": [("project_branch_file", "S"), ("review_at", "S")],
+            "review_id_gsi": [("review_id", "S")],
+            "year_month-review_at-index": [("year_month", "S"), ("review_at", "S")],
+        },
+    },
+    {
+        "TableName": REPO_CODE_REVIEW_COUNTER_TABLE_NAME,
+        "KeySchema": [("counter_key", "S", "HASH")],
+        "GlobalSecondaryIndexes": {},
+        "Stream": False,
+    },
+    {
+        "TableName": REPO_CODE_REVIEW_CACHE_TABLE_NAME,
+        "KeySchema": [("cache_key", "S", "HASH")],
+        "GlobalSecondaryIndexes": {},
+        "Stream": False,
+    },
+    {
+        "TableName": REPO_CODE_REVIEW_FILE_TABLE_NAME,
+        "KeySchema": [("review_id", "S", "HASH"), ("file_key", "S", "RANGE")],
+        "GlobalSecondaryIndexes": {},
+        "Stream": False,
+    },
+]
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of ``values`` (milliseconds), 0 when empty.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "total_ms": round(sum(values), 3),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def read_proc_status_mb(field):
+    # Linux only: VmRSS is the current and VmHWM the peak resident set size
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def reset_peak_rss():
+    """
+    Resets VmHWM to the current RSS, so the peak of one handler invocation
+    can be read from /proc/self/status. Returns False where unsupported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def set_lambda_environment(
+    queue_url, file_num_limit, interactive_queue_url="", merge_queue_url="", summary_queue_url=""
+):
+    os.environ.update(
+        {
+            "AWS_DEFAULT_REGION": REGION,
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "REPO_CODE_REVIEW_TABLE_NAME": REPO_CODE_REVIEW_TABLE_NAME,
+            "REPO_CODE_REVIEW_SCORE_TABLE_NAME": REPO_CODE_REVIEW_SCORE_TABLE_NAME,
+            "REPO_CODE_REVIEW_COUNTER_TABLE_NAME": REPO_CODE_REVIEW_COUNTER_TABLE_NAME,
+            "REPO_CODE_REVIEW_CACHE_TABLE_NAME": REPO_CODE_REVIEW_CACHE_TABLE_NAME,
+            "REPO_CODE_REVIEW_FILE_TABLE_NAME": REPO_CODE_REVIEW_FILE_TABLE_NAME,
+            "BUCKET_NAME": BUCKET_NAME,
+            "LAMBDA_LOG_BUCKET_NAME": LAMBDA_LOG_BUCKET_NAME,
+            "TASK_SQS_URL": queue_url,
+            "INTERACTIVE_SQS_URL": interactive_queue_url or queue_url,
+            "MERGE_SQS_URL": merge_queue_url or interactive_queue_url or queue_url,
+            "SUMMARY_SQS_URL": summary_queue_url or interactive_queue_url or queue_url,
+            "SPLIT_TASK_LAMBDA_NAME": SPLIT_TASK_LAMBDA_NAME,
+            "REVIEW_NOTIFIER_LAMBDA_NAME": REVIEW_NOTIFIER_LAMBDA_NAME,
+            "FILE_NUM_LIMIT": str(file_num_limit),
+            "CALLBACK_SECRET": CALLBACK_SECRET,
+            "CALLBACK_RETRY_DELAY": "0.01",
+            # CallbackServer listens on localhost, which is not a public address
+            "CALLBACK_ALLOWED_HOSTS": "127.0.0.1",
+        }
+    )
+
+
+def create_tables(dynamodb):
+    for definition in TABLE_DEFINITIONS:
+        attributes = {}
+        key_schema = []
+        for name, attr_type, key_type in definition["KeySchema"]:
+            attributes[name] = attr_type
+            key_schema.append({"AttributeName": name, "KeyType": key_type})
+        indexes = []
+        for index_name, keys in definition["GlobalSecondaryIndexes"].items():
+            index_schema = []
+            for (name, attr_type), key_type in zip(keys, ["HASH", "RANGE"]):
+                attributes[name] = attr_type
+                index_schema.append({"AttributeName": name, "KeyType": key_type})
+            indexes.append(
+                {
+                    "IndexName": index_name,
+                    "KeySchema": index_schema,
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            )
+        params = {}
+        if indexes:
+            params["GlobalSecondaryIndexes"] = indexes
+        if definition.get("Stream", True):
+            params["StreamSpecification"] = {
+                "StreamEnabled": True,
+                "StreamViewType": "NEW_IMAGE",
+            }
+        dynamodb.create_table(
+            TableName=definition["TableName"],
+            KeySchema=key_schema,
+            AttributeDefinitions=[
+                {"AttributeName": name, "AttributeType": attr_type}
+                for name, attr_type in attributes.items()
+            ],
+            BillingMode="PAY_PER_REQUEST",
+            **params,
+        )
+
+
+def load_lambda(name):
+    """
+    Imports codereview/lambda_function/<name>/lambda_function.py under a
+    unique module name, the same way the Lambda runtime would load it. The
+    common layer is imported again as well, every function gets its own
+    copy of its module state and reads the current environment.
+    """
+    function_dir = os.path.join(LAMBDA_DIR, name)
+    spec = importlib.util.spec_from_file_location(
+        f"bench_{name}", os.path.join(function_dir, "lambda_function.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    for loaded in [m for m in sys.modules if m.split(".")[0] == "codereview_common"]:
+        del sys.modules[loaded]
+    sys.path[:0] = [function_dir, COMMON_LAYER_DIR]
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(function_dir)
+        sys.path.remove(COMMON_LAYER_DIR)
+    return module
+
+
+class CallCounter:
+    """
+    Counts AWS API calls per service/operation through botocore events.
+    """
+
+    # stream reads are done by the harness, the Lambda service delivers them in AWS
+    IGNORED_SERVICES = {"dynamodb-streams"}
+
+    def __init__(self):
+        self.calls = {}
+
+    def __call__(self, event_name=None, **kwargs):
+        _, service, operation = event_name.split(".", 2)
+        if service in self.IGNORED_SERVICES:
+            return
+        key = f"{service}.{operation}"
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+    def by_service(self):
+        services = {}
+        for key, count in self.calls.items():
+            service = key.split(".", 1)[0]
+            services[service] = services.get(service, 0) + count
+        return services
+
+
+class AwsCallClock:
+    """
+    CPU time spent inside AWS API calls through botocore events. With moto
+    this is the simulated service, which is I/O for a real Lambda.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cpu_ms = 0.0
+
+    def register(self, session):
+        session.events.register("before-call.*.*", self.before)
+        session.events.register("after-call.*.*", self.after)
+
+    def before(self, **kwargs):
+        self.local.start = time.thread_time()
+
+    def after(self, **kwargs):
+        start = getattr(self.local, "start", None)
+        if start is None:
+            return
+        self.local.start = None
+        with self.lock:
+            self.cpu_ms += (time.thread_time() - start) * 1000.0
+
+
+class Timer:
+    """
+    Wall time per stage invocation. With ``aws_clock`` it also records, per
+    invocation, the CPU time of the handler itself (process CPU time minus
+    the CPU time inside AWS calls) and the peak RSS growth (Linux only).
+    """
+
+    def __init__(self, aws_clock=None):
+        self.stages = {}
+        self.aws_clock = aws_clock
+        self.track_memory = aws_clock is not None and reset_peak_rss()
+        self.samples = {}
+        self.rss_growth = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.track_memory:
+            rss_before = read_proc_status_mb("VmRSS")
+            reset_peak_rss()
+        if self.aws_clock is not None:
+            aws_start = self.aws_clock.cpu_ms
+            cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            self.stages.setdefault(name, []).append(elapsed)
+            if self.aws_clock is not None:
+                cpu_ms = (time.process_time() - cpu_start) * 1000.0
+                cpu_ms -= self.aws_clock.cpu_ms - aws_start
+                cpu_ms = min(max(cpu_ms, 0.0), elapsed)
+                self.samples.setdefault(name, []).append([round(elapsed, 3), round(cpu_ms, 3)])
+            if self.track_memory:
+                growth = read_proc_status_mb("VmHWM") - rss_before
+                self.rss_growth.setdefault(name, []).append(max(growth, 0.0))
+
+    def summary(self):
+        stages = {name: summarize(values) for name, values in self.stages.items()}
+        for name, samples in self.samples.items():
+            # [wall_ms, handler_cpu_ms] per invocation
+            stages[name]["samples"] = samples
+        for name, growth in self.rss_growth.items():
+            stages[name]["peak_rss_growth_mb"] = round(max(growth), 1)
+        return stages
+
+
+class TableStream:
+    """
+    Reads a moto DynamoDB stream from the start, remembering the shard
+    iterators so every call only returns new records.
+    """
+
+    def __init__(self, dynamodb, streams, table_name):
+        self.streams = streams
+        self.stream_arn = dynamodb.describe_table(TableName=table_name)["Table"][
+            "LatestStreamArn"
+        ]
+        self.iterators = {}
+
+    def read(self):
+        shards = self.streams.describe_stream(StreamArn=self.stream_arn)[
+            "StreamDescription"
+        ]["Shards"]
+        records = []
+        for shard in shards:
+            shard_id = shard["ShardId"]
+            if shard_id not in self.iterators:
+                self.iterators[shard_id] = self.streams.get_shard_iterator(
+                    StreamArn=self.stream_arn,
+                    ShardId=shard_id,
+                    ShardIteratorType="TRIM_HORIZON",
+                )["ShardIterator"]
+            response = self.streams.get_records(ShardIterator=self.iterators[shard_id])
+            self.iterators[shard_id] = response["NextShardIterator"]
+            records.extend(response["Records"])
+        return records
+
+
+def deliver_stream(stream, handlers, timer, batch_size=100):
+    """
+    Feeds the new stream records to every stream consumer lambda in batches.
+
+    ``handlers`` maps the timer stage of each consumer to its handler.
+    """
+    records = stream.read()
+    for stage, handler in handlers.items():
+        for start in range(0, len(records), batch_size):
+            with timer.stage(stage):
+                handler({"Records": records[start : start + batch_size]}, None)
+
+
+def api_event(path, body):
+    return {"path": path, "body": json.dumps(body)}
+
+
+def drain_task_queue(sqs, queue_urls, code_review, timer, max_idle_polls=3, received=None):
+    """
+    Feeds every message of the review, merge and summary queues to
+    code_review one record at a time, like the batch_size=1 SQS event sources
+    of code_review, review_merge and review_summary do. Each round polls the
+    queues in the given order, so list the interactive queue first. Records
+    not reported in batchItemFailures are deleted, as the event source does.
+    The bodies of the file review messages are appended to ``received``.
+    """
+    idle_polls = 0
+    while idle_polls < max_idle_polls:
+        messages = []
+        for queue_url in queue_urls:
+            response = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=0,
+                AttributeNames=["ApproximateReceiveCount"],
+            )
+            messages.extend((queue_url, message) for message in response.get("Messages", []))
+        if not messages:
+            idle_polls += 1
+            continue
+        idle_polls = 0
+        for queue_url, message in messages:
+            record = {
+                "messageId": message["MessageId"],
+                "body": message["Body"],
+                "receiptHandle": message["ReceiptHandle"],
+                "attributes": message.get("Attributes", {}),
+                "eventSourceARN": f"arn:aws:sqs:{REGION}:123456789012:{queue_url.rsplit('/', 1)[-1]}",
+            }
+            msg_type = json.loads(message["Body"]).get("msg_type", "")
+            if received is not None and msg_type == "file review":
+                received.append(message["Body"])
+            stage = {"file review": "review", "merge check": "merge"}.get(msg_type, "summary")
+            with timer.stage(stage):
+                response = code_review.lambda_handler({"Records": [record]}, None)
+            if not response["batchItemFailures"]:
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"])
+
+
+def run_maintenance(sqs, review_id, dead_letters, timer):
+    """
+    Runs the functions invoked by operators after the review: dead-letter
+    triage and replay of the review (its file review messages stand in for
+    dead letters, replay drops them as they are done) and the rebuild of
+    the record counters.
+    """
+    dlq_url = sqs.create_queue(QueueName=TASK_DLQ_NAME)["QueueUrl"]
+    os.environ["TASK_DLQ_URL"] = dlq_url
+    for start in range(0, len(dead_letters), 10):
+        sqs.send_message_batch(
+            QueueUrl=dlq_url,
+            Entries=[
+                {"Id": str(i), "MessageBody": body}
+                for i, body in enumerate(dead_letters[start : start + 10])
+            ],
+        )
+    review_dlq = load_lambda("review_dlq")
+    modify_dynamodb = load_lambda("modify_dynamodb")
+    with timer.stage("dlq_triage"):
+        review_dlq.lambda_handler({"action": "triage"}, None)
+    with timer.stage("dlq_replay"):
+        review_dlq.lambda_handler({"action": "replay", "review_id": review_id}, None)
+    with timer.stage("rebuild_counters"):
+        modify_dynamodb.lambda_handler({"action": "rebuild_counters"}, None)
+
+
+def run_scenario(
+    file_num, scan_scope="ALL", bedrock_latency_ms=0, track_resources=False, maintenance=False
+):
+    """
+    Runs one synthetic review of ``file_num`` files through the whole
+    pipeline and returns its metrics. Meant to be called in a fresh process
+    so that peak RSS belongs to this scenario only.
+
+    Parameters:
+    track_resources (bool): Also record the handler CPU time and the peak
+    RSS growth of every stage invocation, see Timer.
+    maintenance (bool): Also run the operator functions, see run_maintenance.
+    """
+    import boto3
+    from moto import mock_aws
+
+    from benchmark.fakes import (
+        CallbackServer,
+        FakeBedrockClient,
+        FakeGitlabServer,
+        FakeLambdaClient,
+        SyntheticRepo,
+    )
+
+    rss_before = peak_rss_mb()
+    logging.disable(logging.CRITICAL)
+    gitlab_server = FakeGitlabServer()
+    gitlab_server.add_repo(PROJECT, SyntheticRepo(file_num))
+    gitlab_server.install()
+    bedrock = FakeBedrockClient(latency_ms=bedrock_latency_ms)
+    lambda_client = FakeLambdaClient()
+
+    with mock_aws():
+        set_lambda_environment("", file_num_limit=max(file_num, 3000))
+        boto3.setup_default_session(region_name=REGION)
+        session = boto3.DEFAULT_SESSION
+        counter = CallCounter()
+        session.events.register("before-call.*.*", counter)
+        aws_clock = None
+        if track_resources:
+            aws_clock = AwsCallClock()
+            aws_clock.register(session)
+
+        real_client = session.client
+
+        def client(*args, **kwargs):
+            service_name = kwargs.get("service_name", args[0] if args else None)
+            if service_name == "bedrock-runtime":
+                return bedrock
+            if service_name == "lambda":
+                return lambda_client
+            return real_client(*args, **kwargs)
+
+        boto3.client = client
+        session.client = client
+
+        s3 = real_client("s3")
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.create_bucket(Bucket=LAMBDA_LOG_BUCKET_NAME)
+        sqs = real_client("sqs")
+        queue_url = sqs.create_queue(QueueName=TASK_QUEUE_NAME)["QueueUrl"]
+        interactive_queue_url = sqs.create_queue(QueueName=INTERACTIVE_QUEUE_NAME)["QueueUrl"]
+        merge_queue_url = sqs.create_queue(QueueName=MERGE_QUEUE_NAME)["QueueUrl"]
+        summary_queue_url = sqs.create_queue(QueueName=SUMMARY_QUEUE_NAME)["QueueUrl"]
+        create_tables(real_client("dynamodb"))
+        set_lambda_environment(
+            queue_url,
+            file_num_limit=max(file_num, 3000),
+            interactive_queue_url=interactive_queue_url,
+            merge_queue_url=merge_queue_url,
+            summary_queue_url=summary_queue_url,
+        )
+        request_stream = TableStream(
+            real_client("dynamodb"),
+            real_client("dynamodbstreams"),
+            REPO_CODE_REVIEW_TABLE_NAME,
+        )
+
+        modules = {
+            name: load_lambda(name)
+            for name in [
+                "api_post_code_review",
+                "split_task",
+                "code_review",
+                "api_get_result",
+                "codereview_get_score_file",
+                "record_counter",
+                "review_cache_invalidator",
+                "review_notifier",
+            ]
+        }
+        counter.calls.clear()
+
+        timer = Timer(aws_clock)
+        callback_server = CallbackServer(secret=CALLBACK_SECRET)
+        request = {
+            "commitid": COMMIT_ID,
+            "repo_url": "https://gitlab.example.com",
+            "access_token": "token",
+            "project": PROJECT,
+            "branch": BRANCH,
+            "scan_scope": scan_scope,
+            "callback_url": callback_server.url,
+        }
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+            devnull
+        ), callback_server:
+            start = time.perf_counter()
+            with timer.stage("post"):
+                post_response = modules["api_post_code_review"].lambda_handler(
+                    {"body": json.dumps(request)}, None
+                )
+            review_id = json.loads(post_response["body"]).get("review_id")
+
+            while lambda_client.pending:
+                _, payload = lambda_client.pending.popleft()
+                with timer.stage("split"):
+                    modules["split_task"].lambda_handler(payload, None)
+
+            dead_letters = [] if maintenance else None
+            drain_task_queue(
+                sqs,
+                [interactive_queue_url, merge_queue_url, summary_queue_url, queue_url],
+                modules["code_review"],
+                timer,
+                received=dead_letters,
+            )
+            pipeline_seconds = time.perf_counter() - start
+            deliver_stream(
+                request_stream,
+                {
+                    "stream": modules["record_counter"].lambda_handler,
+                    "invalidate": modules["review_cache_invalidator"].lambda_handler,
+                },
+                timer,
+            )
+            # review_cache_invalidator invokes review_notifier asynchronously
+            while lambda_client.pending:
+                _, payload = lambda_client.pending.popleft()
+                with timer.stage("notify"):
+                    modules["review_notifier"].lambda_handler(payload, None)
+
+            with timer.stage("get_result"):
+                result = modules["api_get_result"].lambda_handler(
+                    api_event("/getReviewResult", {"review_id": review_id}), None
+                )
+            with timer.stage("get_records"):
+                modules["api_get_result"].lambda_handler(
+                    api_event(
+                        "/getReviewRecords",
+                        {"page_index": 1, "page_size": 10, "project": PROJECT},
+                    ),
+                    None,
+                )
+            with timer.stage("get_score_file"):
+                modules["codereview_get_score_file"].lambda_handler(
+                    api_event("/getScoreFile", {"score": 100, "project": PROJECT}), None
+                )
+            with timer.stage("get_review_files"):
+                modules["codereview_get_score_file"].lambda_handler(
+                    api_event("/getReviewFiles", {"reviewid": review_id}), None
+                )
+            if maintenance:
+                run_maintenance(sqs, review_id, dead_letters[:MAX_DEAD_LETTERS], timer)
+
+        logging.disable(logging.NOTSET)
+        review_status = json.loads(result["body"]).get("status")
+        callbacks = callback_server.requests
+        reviewed = len(timer.stages.get("review", []))
+
+    calls = dict(sorted(counter.calls.items()))
+    calls.update({f"bedrock-runtime.{k}": v for k, v in bedrock.calls.items()})
+    calls.update({f"lambda.{k}": v for k, v in lambda_client.calls.items()})
+    calls.update({f"gitlab.{k}": v for k, v in gitlab_server.calls.items()})
+    services = counter.by_service()
+    per_file = max(file_num, 1)
+    return {
+        "file_num": file_num,
+        "scan_scope": scan_scope,
+        "reviewed_files": reviewed,
+        "review_status": review_status,
+        "callbacks": len(callbacks),
+        "callbacks_signed": sum(1 for callback in callbacks if callback["signed"]),
+        "pipeline_seconds": round(pipeline_seconds, 3),
+        "files_per_sec": round(reviewed / pipeline_seconds, 3) if pipeline_seconds else 0.0,
+        "stages": timer.summary(),
+        "calls": calls,
+        "calls_per_file": {
+            service: round(services.get(service, 0) / per_file, 3)
+            for service in ["dynamodb", "s3", "sqs"]
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": rss_before,
+    }
+
+
+def run_isolated(file_num, scan_scope, bedrock_latency_ms):
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_scenario, (file_num, scan_scope, bedrock_latency_ms))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--scan-scope", choices=["ALL", "DIFF"], default="ALL")
+    parser.add_argument(
+        "--bedrock-latency-ms",
+        type=float,
+        default=0,
+        help="simulated model latency per Bedrock call",
+    )
+    parser.add_argument(
+        "--output",
+        help="result file, defaults to benchmark/results/<git revision>.json",
+    )
+    args = parser.parse_args(argv)
+
+    revision = git_revision()
+    scenarios = []
+    for file_num in args.sizes:
+        result = run_isolated(file_num, args.scan_scope, args.bedrock_latency_ms)
+        scenarios.append(result)
+        print(
+            f"{file_num:>6} files  {result['files_per_sec']:>9.2f} files/s  "
+            f"review p95 {result['stages'].get('review', {}).get('p95_ms', 0):>8.2f} ms  "
+            f"peak rss {result['peak_rss_mb']:>7.1f} MB"
+        )
+
+    report = {
+        "revision": revision,
+        "created_at": str(datetime.now()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scan_scope": args.scan_scope,
+        "bedrock_latency_ms": args.bedrock_latency_ms,
+        "scenarios": scenarios,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
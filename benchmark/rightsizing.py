@@ -0,0 +1,292 @@
+"""
+Memory right-sizing harness.
+
+Replays the synthetic review pipeline of ``benchmark/pipeline.py`` through
+every handler, records the wall time, the handler CPU time and the peak RSS
+of each invocation, then simulates every memory size with the CPU share
+Lambda gives it (1769 MB is one vCPU, smaller sizes get a proportional
+share): the CPU part of an invocation is stretched by 1 / share, the rest
+(AWS calls, Bedrock, GitLab) is unchanged. It recommends the cheapest
+memory size that fits the peak RSS and keeps the p95 duration within a
+tolerance of the fastest one. The operator functions (review_dlq triage
+and replay, modify_dynamodb rebuild_counters) run once after the review,
+the default modify_dynamodb migration scales with the tables rather than
+with the review and is represented by rebuild_counters, which scans the
+request table the same way.
+
+Usage (from the repository root, Linux only):
+
+    pip install -r benchmark/requirements.txt
+    python -m benchmark.rightsizing --files 20
+    python -m benchmark.rightsizing --memory 256 512 1024 1769 --tolerance 0.1 --slack-ms 50
+
+The recommendation is printed as a ``lambda_config`` context for cdk.json
+(see FUNCTION_CONFIG in codereview/lambda_function/stack.py). moto runs in
+the same process as the handlers, the CPU time spent inside AWS calls is
+left out of the handler CPU time, see AwsCallClock.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from benchmark.pipeline import (
+    RESULTS_DIR,
+    ROOT_DIR,
+    git_revision,
+    load_lambda,
+    percentile,
+    read_proc_status_mb,
+    run_scenario,
+    set_lambda_environment,
+)
+
+# Lambda allocates one vCPU at 1769 MB, CPU share is proportional below it
+ONE_VCPU_MEMORY = 1769
+DEFAULT_MEMORY_SIZES = [128, 256, 512, 1024, 1769, 3008]
+DEFAULT_BEDROCK_LATENCY_MS = 1000
+DEFAULT_SLACK_MS = 100
+# pipeline stage -> function, review_merge and review_summary run the code_review code
+STAGE_FUNCTIONS = {
+    "post": "api_post_code_review",
+    "split": "split_task",
+    "review": "code_review",
+    "merge": "review_merge",
+    "summary": "review_summary",
+    "get_result": "api_get_result",
+    "get_records": "api_get_result",
+    "get_score_file": "codereview_get_score_file",
+    "get_review_files": "codereview_get_score_file",
+    "stream": "record_counter",
+    "invalidate": "review_cache_invalidator",
+    "notify": "review_notifier",
+    "dlq_triage": "review_dlq",
+    "dlq_replay": "review_dlq",
+    "rebuild_counters": "modify_dynamodb",
+}
+FUNCTION_CODE = {"review_merge": "code_review", "review_summary": "code_review"}
+
+
+def cpu_share(memory_size):
+    return min(memory_size / ONE_VCPU_MEMORY, 1.0)
+
+
+def simulate_duration(wall_ms, cpu_ms, memory_size):
+    """
+    Duration of an invocation measured with a full CPU at ``memory_size``.
+    """
+    return wall_ms - cpu_ms + cpu_ms / cpu_share(memory_size)
+
+
+def run_child(args, options=()):
+    """
+    Runs ``--child args`` in a fresh interpreter and returns its JSON result.
+    """
+    command = [sys.executable, "-m", "benchmark.rightsizing", *options, "--child", *args]
+    completed = subprocess.run(command, cwd=ROOT_DIR, capture_output=True, text=True, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure_baseline(function):
+    """
+    Child side: RSS of a fresh interpreter after loading the function, the
+    memory a sandbox holds before its first event.
+    """
+    set_lambda_environment("", file_num_limit=3000)
+    load_lambda(FUNCTION_CODE.get(function, function))
+    return {"rss_mb": round(read_proc_status_mb("VmRSS"), 1)}
+
+
+def measure_pipeline(file_num, scan_scope, bedrock_latency_ms):
+    """
+    Child side: one pipeline run with per-invocation handler CPU time and
+    per-stage peak RSS growth.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return run_scenario(
+            file_num, scan_scope, bedrock_latency_ms, track_resources=True, maintenance=True
+        )
+
+
+def function_metrics(stages):
+    """
+    Folds the pipeline stages into {function: {"samples", "rss_growth_mb"}}.
+    """
+    functions = {}
+    for stage, summary in stages.items():
+        function = STAGE_FUNCTIONS.get(stage)
+        if function is None:
+            continue
+        metrics = functions.setdefault(function, {"samples": [], "rss_growth_mb": 0.0})
+        metrics["samples"] += summary.get("samples", [])
+        metrics["rss_growth_mb"] = max(
+            metrics["rss_growth_mb"], summary.get("peak_rss_growth_mb", 0.0)
+        )
+    return functions
+
+
+def recommend(function, metrics, baseline_mb, memory_sizes, tolerance, slack_ms, headroom):
+    """
+    Picks the memory size with the lowest cost (memory x mean duration)
+    among those that fit the peak RSS with headroom and keep the p95
+    duration within tolerance (or slack_ms) of the fastest size.
+
+    Parameters:
+    metrics (dict): The samples and RSS growth of the function, see function_metrics
+
+    Returns:
+    dict: The required memory, the metrics per memory size and the recommendation.
+    """
+    samples = metrics["samples"]
+    if not samples:
+        return None
+    wall_total = sum(wall_ms for wall_ms, _ in samples)
+    cpu_total = sum(cpu_ms for _, cpu_ms in samples)
+    sizes = {}
+    for memory_size in memory_sizes:
+        durations = [
+            simulate_duration(wall_ms, cpu_ms, memory_size) for wall_ms, cpu_ms in samples
+        ]
+        mean_ms = sum(durations) / len(durations)
+        sizes[memory_size] = {
+            "p95_ms": round(percentile(durations, 95), 3),
+            "mean_ms": round(mean_ms, 3),
+            "cost_gb_ms": round(memory_size / 1024.0 * mean_ms, 3),
+        }
+    required_mb = round((baseline_mb + metrics["rss_growth_mb"]) * headroom, 1)
+    fastest = min(size["p95_ms"] for size in sizes.values())
+    limit = max(fastest * (1 + tolerance), fastest + slack_ms)
+    eligible = [
+        memory_size
+        for memory_size, size in sizes.items()
+        if memory_size >= required_mb and size["p95_ms"] <= limit
+    ]
+    if not eligible:
+        # 没有满足延迟要求的配置时选择最快且内存足够的
+        eligible = [memory_size for memory_size in sizes if memory_size >= required_mb] or [
+            max(sizes)
+        ]
+    recommended = min(eligible, key=lambda memory_size: (sizes[memory_size]["cost_gb_ms"], memory_size))
+    return {
+        "function": function,
+        "invocations": len(samples),
+        "cpu_ratio": round(cpu_total / wall_total, 3) if wall_total else 0.0,
+        "baseline_rss_mb": baseline_mb,
+        "peak_rss_growth_mb": metrics["rss_growth_mb"],
+        "required_mb": required_mb,
+        "memory_sizes": sizes,
+        "recommended_memory_size": recommended,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=20, help="files of the synthetic review")
+    parser.add_argument("--scan-scope", choices=["ALL", "DIFF"], default="ALL")
+    parser.add_argument(
+        "--bedrock-latency-ms",
+        type=float,
+        default=DEFAULT_BEDROCK_LATENCY_MS,
+        help="simulated Bedrock latency, the I/O part of a review",
+    )
+    parser.add_argument("--memory", type=int, nargs="+", default=DEFAULT_MEMORY_SIZES)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="accepted p95 slowdown against the fastest memory size",
+    )
+    parser.add_argument(
+        "--slack-ms",
+        type=float,
+        default=DEFAULT_SLACK_MS,
+        help="accepted p95 slowdown in ms, for short invocations",
+    )
+    parser.add_argument(
+        "--headroom", type=float, default=1.5, help="required memory = peak RSS x headroom"
+    )
+    parser.add_argument(
+        "--output",
+        help="result file, defaults to benchmark/results/rightsizing-<git revision>.json",
+    )
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        if args.child[0] == "baseline":
+            result = measure_baseline(args.child[1])
+        else:
+            result = measure_pipeline(args.files, args.scan_scope, args.bedrock_latency_ms)
+        print(json.dumps(result))
+        return 0
+
+    memory_sizes = sorted(set(args.memory))
+    options = [
+        "--files",
+        str(args.files),
+        "--scan-scope",
+        args.scan_scope,
+        "--bedrock-latency-ms",
+        str(args.bedrock_latency_ms),
+    ]
+    result = run_child(["pipeline"], options)
+    functions = function_metrics(result["stages"])
+    print(f"pipeline {result['pipeline_seconds']:.1f} s")
+
+    recommendations = []
+    lambda_config = {}
+    for function in sorted(functions):
+        baseline_mb = run_child(["baseline", function])["rss_mb"]
+        recommendation = recommend(
+            function,
+            functions[function],
+            baseline_mb,
+            memory_sizes,
+            args.tolerance,
+            args.slack_ms,
+            args.headroom,
+        )
+        if recommendation is None:
+            continue
+        recommendations.append(recommendation)
+        lambda_config[function] = {"memory_size": recommendation["recommended_memory_size"]}
+        p95 = "  ".join(
+            f"{memory_size}:{size['p95_ms']:.0f}"
+            for memory_size, size in recommendation["memory_sizes"].items()
+        )
+        print(
+            f"{function:<22} needs {recommendation['required_mb']:>7.1f} MB  "
+            f"-> {recommendation['recommended_memory_size']:>5} MB  p95 ms [{p95}]"
+        )
+
+    report = {
+        "revision": git_revision(),
+        "created_at": str(datetime.now()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": args.files,
+        "scan_scope": args.scan_scope,
+        "bedrock_latency_ms": args.bedrock_latency_ms,
+        "tolerance": args.tolerance,
+        "slack_ms": args.slack_ms,
+        "headroom": args.headroom,
+        "recommendations": recommendations,
+        "lambda_config": lambda_config,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"rightsizing-{report['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+    print(json.dumps({"lambda_config": lambda_config}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
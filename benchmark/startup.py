@@ -0,0 +1,323 @@
+"""
+Cold-start benchmark.
+
+Measures, for every Lambda function, the module init time (imports plus
+module level client construction, with the ``python -X importtime`` tree of
+the heaviest imports) and the latency of the first invocation in a fresh
+interpreter, then checks them against a budget.
+
+Usage (from the repository root):
+
+    pip install -r benchmark/requirements.txt
+    python -m benchmark.startup --runs 3
+    python -m benchmark.startup --budget-ms 300 --output /tmp/startup.json
+
+Exits with status 1 when a function exceeds the init budget or imports a
+module that should only be loaded on first use.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmark.pipeline import (
+    BRANCH,
+    COMMIT_ID,
+    INTERACTIVE_QUEUE_NAME,
+    LAMBDA_DIR,
+    LAMBDA_LOG_BUCKET_NAME,
+    PROJECT,
+    REGION,
+    RESULTS_DIR,
+    ROOT_DIR,
+    BUCKET_NAME,
+    TASK_QUEUE_NAME,
+    api_event,
+    create_tables,
+    git_revision,
+    load_lambda,
+    set_lambda_environment,
+)
+
+# functions whose first invocation is measured, in pipeline order
+INVOKED_FUNCTIONS = ["api_post_code_review", "split_task", "code_review", "api_get_result"]
+# heavy libraries a cold start must not import, they are loaded on first use
+DEFERRED_IMPORTS = {
+    "code_review": ["jinja2", "pygments"],
+    "split_task": ["gitlab"],
+}
+DEFAULT_BUDGET_MS = 500
+SYNTHETIC_FILES = 10
+TOP_IMPORTS = 5
+MARKER = "-- lambda init --"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def list_functions():
+    return sorted(
+        name
+        for name in os.listdir(LAMBDA_DIR)
+        if os.path.isfile(os.path.join(LAMBDA_DIR, name, "lambda_function.py"))
+    )
+
+
+def parse_importtime(stderr):
+    """
+    Returns the top level imports done after MARKER as
+    [(module, cumulative_ms)], heaviest first.
+    """
+    lines = stderr.split(MARKER, 1)[-1].splitlines()
+    imports = []
+    for line in lines:
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            imports.append((match.group(4), int(match.group(2)) / 1000.0))
+    return sorted(imports, key=lambda item: item[1], reverse=True)
+
+
+def measure_init(name):
+    """
+    Child side: loads one function and reports its init time and which of
+    the deferred libraries it imported.
+    """
+    set_lambda_environment("", file_num_limit=3000)
+    sys.stderr.write(MARKER + "\n")
+    sys.stderr.flush()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        load_lambda(name)
+    init_ms = (time.perf_counter() - start) * 1000.0
+    return {
+        "init_ms": round(init_ms, 3),
+        "deferred_imported": [
+            module for module in DEFERRED_IMPORTS.get(name, []) if module in sys.modules
+        ],
+    }
+
+
+def measure_invoke(name):
+    """
+    Child side: runs the pipeline up to ``name`` against moto and the fakes,
+    loading ``name`` last so its init and first invocation are both cold.
+    """
+    import logging
+
+    import boto3
+    from moto import mock_aws
+
+    from benchmark.fakes import (
+        FakeBedrockClient,
+        FakeGitlabServer,
+        FakeLambdaClient,
+        SyntheticRepo,
+    )
+
+    logging.disable(logging.CRITICAL)
+    gitlab_server = FakeGitlabServer()
+    gitlab_server.add_repo(PROJECT, SyntheticRepo(SYNTHETIC_FILES))
+    gitlab_server.install()
+    bedrock = FakeBedrockClient()
+    lambda_client = FakeLambdaClient()
+
+    with mock_aws(), open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        set_lambda_environment("", file_num_limit=3000)
+        boto3.setup_default_session(region_name=REGION)
+        session = boto3.DEFAULT_SESSION
+        real_client = session.client
+
+        def client(*args, **kwargs):
+            service_name = kwargs.get("service_name", args[0] if args else None)
+            if service_name == "bedrock-runtime":
+                return bedrock
+            if service_name == "lambda":
+                return lambda_client
+            return real_client(*args, **kwargs)
+
+        boto3.client = client
+        session.client = client
+
+        s3 = real_client("s3")
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.create_bucket(Bucket=LAMBDA_LOG_BUCKET_NAME)
+        sqs = real_client("sqs")
+        queue_url = sqs.create_queue(QueueName=TASK_QUEUE_NAME)["QueueUrl"]
+        interactive_queue_url = sqs.create_queue(QueueName=INTERACTIVE_QUEUE_NAME)["QueueUrl"]
+        create_tables(real_client("dynamodb"))
+        set_lambda_environment(
+            queue_url, file_num_limit=3000, interactive_queue_url=interactive_queue_url
+        )
+
+        request = {
+            "commitid": COMMIT_ID,
+            "repo_url": "https://gitlab.example.com",
+            "access_token": "token",
+            "project": PROJECT,
+            "branch": BRANCH,
+            "scan_scope": "ALL",
+        }
+        review_id = None
+        events = {
+            "api_post_code_review": lambda: {"body": json.dumps(request)},
+            "split_task": lambda: lambda_client.pending.popleft()[1],
+            "code_review": lambda: {
+                "Records": [
+                    {
+                        "messageId": message["MessageId"],
+                        "body": message["Body"],
+                        "receiptHandle": message["ReceiptHandle"],
+                        "attributes": message.get("Attributes", {}),
+                    }
+                    for message in sqs.receive_message(
+                        QueueUrl=queue_url,
+                        MaxNumberOfMessages=1,
+                        AttributeNames=["ApproximateReceiveCount"],
+                    )["Messages"]
+                ]
+            },
+            "api_get_result": lambda: api_event("/getReviewResult", {"review_id": review_id}),
+        }
+        for function in INVOKED_FUNCTIONS[: INVOKED_FUNCTIONS.index(name) + 1]:
+            event = events[function]()
+            start = time.perf_counter()
+            module = load_lambda(function)
+            loaded = time.perf_counter()
+            response = module.lambda_handler(event, None)
+            invoked = time.perf_counter()
+            if function == "api_post_code_review":
+                review_id = json.loads(response["body"]).get("review_id")
+
+    return {
+        "init_ms": round((loaded - start) * 1000.0, 3),
+        "first_invoke_ms": round((invoked - loaded) * 1000.0, 3),
+    }
+
+
+def run_child(mode, name):
+    """
+    Runs ``mode`` for one function in a fresh interpreter, the init mode with
+    ``-X importtime``, and returns (result, stderr).
+    """
+    command = [sys.executable]
+    if mode == "init":
+        command += ["-X", "importtime"]
+    command += ["-m", "benchmark.startup", "--child", mode, name]
+    completed = subprocess.run(
+        command, cwd=ROOT_DIR, capture_output=True, text=True, check=False
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{mode} {name} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def measure(name, runs):
+    """
+    Median of ``runs`` fresh processes for one function.
+    """
+    init_runs = []
+    invoke_runs = []
+    imports = []
+    deferred_imported = []
+    for _ in range(runs):
+        result, stderr = run_child("init", name)
+        init_runs.append(result["init_ms"])
+        deferred_imported = result["deferred_imported"]
+        imports = parse_importtime(stderr)
+        if name in INVOKED_FUNCTIONS:
+            invoke_runs.append(run_child("invoke", name)[0])
+    result = {
+        "function": name,
+        "init_ms": round(statistics.median(init_runs), 3),
+        "import_ms": round(sum(ms for _, ms in imports), 3),
+        "top_imports": [
+            {"module": module, "cumulative_ms": ms} for module, ms in imports[:TOP_IMPORTS]
+        ],
+        "deferred_imported": deferred_imported,
+    }
+    if invoke_runs:
+        first_invoke_ms = statistics.median(run["first_invoke_ms"] for run in invoke_runs)
+        result["first_invoke_ms"] = round(first_invoke_ms, 3)
+        result["cold_start_ms"] = round(result["init_ms"] + first_invoke_ms, 3)
+    return result
+
+
+def check_budget(results, budget_ms):
+    """
+    Returns the list of budget violations.
+    """
+    violations = []
+    for result in results:
+        if result["init_ms"] > budget_ms:
+            violations.append(
+                f"{result['function']}: init {result['init_ms']:.1f} ms > {budget_ms} ms"
+            )
+        for module in result["deferred_imported"]:
+            violations.append(f"{result['function']}: imports {module} during init")
+    return violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--functions", nargs="+", help="defaults to every function")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per function")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help="maximum module init time of a function",
+    )
+    parser.add_argument(
+        "--output",
+        help="result file, defaults to benchmark/results/startup-<git revision>.json",
+    )
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "FUNCTION"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        mode, name = args.child
+        result = measure_init(name) if mode == "init" else measure_invoke(name)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for name in args.functions or list_functions():
+        result = measure(name, args.runs)
+        results.append(result)
+        first_invoke = result.get("first_invoke_ms")
+        heaviest = ", ".join(
+            f"{item['module']} {item['cumulative_ms']:.0f}" for item in result["top_imports"][:3]
+        )
+        print(
+            f"{name:<28} init {result['init_ms']:>8.1f} ms  "
+            f"first invoke {first_invoke if first_invoke is not None else '-':>8} ms  "
+            f"[{heaviest}]"
+        )
+
+    violations = check_budget(results, args.budget_ms)
+    report = {
+        "revision": git_revision(),
+        "created_at": str(datetime.now()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "budget_ms": args.budget_ms,
+        "functions": results,
+        "violations": violations,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"startup-{report['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+    for violation in violations:
+        print(f"BUDGET {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,7 +10,9 @@ from aws_cdk import (
     aws_apigateway,
     Aws,
     aws_iam,
+    aws_lambda,
     aws_lambda_event_sources as source,
+    aws_secretsmanager,
 )
 from constructs import Construct
 from codereview.database.stack import Database
@@ -21,6 +23,13 @@ from codereview.bucket.stack import Bucket
 
 # from cdk_nag import AwsSolutionsChecks, NagSuppressions
 
+# code_review concurrency per task queue, full scans share Bedrock with the interactive reviews
+BATCH_REVIEW_CONCURRENCY = 10
+INTERACTIVE_REVIEW_CONCURRENCY = 20
+# review_merge / review_summary concurrency, merges are memory heavy and summaries call Bedrock
+MERGE_CONCURRENCY = 5
+SUMMARY_CONCURRENCY = 5
+
 
 class CodeReview(Stack):
 
@@ -74,9 +83,13 @@ class CodeReview(Stack):
 
         bucket.bucket.grant_write(lambda_functions.api_post_codereview)
         bucket.bucket.grant_read_write(lambda_functions.code_review)
+        bucket.bucket.grant_read_write(lambda_functions.review_merge)
+        bucket.bucket.grant_read_write(lambda_functions.review_summary)
         bucket.bucket.grant_read_write(lambda_functions.api_get_result)
         bucket.lambda_log_bucket.grant_write(lambda_functions.api_post_codereview)
         bucket.lambda_log_bucket.grant_write(lambda_functions.code_review)
+        bucket.lambda_log_bucket.grant_write(lambda_functions.review_merge)
+        bucket.lambda_log_bucket.grant_write(lambda_functions.review_summary)
         bucket.lambda_log_bucket.grant_write(lambda_functions.api_get_result)
         bucket.lambda_log_bucket.grant_write(lambda_functions.split_task)
         bucket.lambda_log_bucket.grant_write(lambda_functions.codereview_get_score_file)
@@ -86,6 +99,12 @@ class CodeReview(Stack):
         lambda_functions.code_review.add_environment(
             "LAMBDA_LOG_BUCKET_NAME", bucket.lambda_log_bucket.bucket_name
         )
+        lambda_functions.review_merge.add_environment(
+            "LAMBDA_LOG_BUCKET_NAME", bucket.lambda_log_bucket.bucket_name
+        )
+        lambda_functions.review_summary.add_environment(
+            "LAMBDA_LOG_BUCKET_NAME", bucket.lambda_log_bucket.bucket_name
+        )
         lambda_functions.api_get_result.add_environment(
             "LAMBDA_LOG_BUCKET_NAME", bucket.lambda_log_bucket.bucket_name
         )
@@ -96,12 +115,18 @@ class CodeReview(Stack):
             "LAMBDA_LOG_BUCKET_NAME", bucket.lambda_log_bucket.bucket_name
         )
         # # grant api_post_codereview lambda function permission
-        database.repo_code_review_table.grant_write_data(
-            lambda_functions.api_post_codereview
-        )
+        # 重复提交检查与取消需要读取已有任务
         database.repo_code_review_table.grant_read_write_data(
-            lambda_functions.code_review
+            lambda_functions.api_post_codereview
         )
+        # code_review, review_merge and review_summary run the same code on different queues
+        review_functions = [
+            lambda_functions.code_review,
+            lambda_functions.review_merge,
+            lambda_functions.review_summary,
+        ]
+        for function in review_functions:
+            database.repo_code_review_table.grant_read_write_data(function)
         database.repo_code_review_table.grant_read_write_data(
             lambda_functions.modify_dynamodb
         )
@@ -140,6 +165,7 @@ class CodeReview(Stack):
             "REPO_CODE_REVIEW_TABLE_NAME", database.repo_code_review_table.table_name
         )
         lambda_functions.api_get_result.add_environment("EXPIRES_IN", "36000")
+        lambda_functions.api_get_result.add_environment("RECORD_MONTHS", "3")
 
         lambda_functions.split_task.add_environment(
             "REPO_CODE_REVIEW_TABLE_NAME", database.repo_code_review_table.table_name
@@ -154,21 +180,47 @@ class CodeReview(Stack):
         )
         lambda_functions.split_task.add_environment("FILE_SIZE_LIMIT", "102400")
         lambda_functions.split_task.add_environment("FILE_NUM_LIMIT", "3000")
-
-        lambda_functions.code_review.add_environment(
-            "TASK_SQS_URL", sqs.codereview_task_queue.queue_url
+        # 拆分进度检查点: 工作列表保存在 S3, 分片 worker 与超时前的继续拆分都异步调用自身
+        bucket.bucket.grant_read_write(lambda_functions.split_task)
+        bucket.bucket.grant_delete(lambda_functions.split_task)
+        lambda_functions.split_task.add_environment("BUCKET_NAME", bucket.bucket.bucket_name)
+        lambda_functions.split_task.add_environment("SPLIT_FILES_PER_INVOCATION", "1000")
+        lambda_functions.split_task.add_environment("SPLIT_TIME_RESERVE_MS", "120000")
+        lambda_functions.split_task.add_environment("SPLIT_SHARDS", "4")
+        lambda_functions.split_task.add_environment("SPLIT_SHARD_MIN_FILES", "200")
+        # grant_invoke on itself would make the role policy depend on the function
+        lambda_functions.split_task.role.add_to_policy(
+            aws_iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    self.format_arn(
+                        service="lambda",
+                        resource="function",
+                        resource_name="split_task_{}".format(env_name),
+                        arn_format=cdk.ArnFormat.COLON_RESOURCE_NAME,
+                    )
+                ],
+            )
         )
+
         bedrock_policy = aws_iam.PolicyStatement(
             actions=["bedrock:InvokeModel"],
             resources=["*"],
         )
-        lambda_functions.code_review.role.add_to_policy(bedrock_policy)
-        lambda_functions.code_review.add_environment(
-            "REPO_CODE_REVIEW_TABLE_NAME", database.repo_code_review_table.table_name
-        )
-        lambda_functions.code_review.add_environment(
-            "REPO_CODE_REVIEW_SCORE_TABLE_NAME", database.repo_code_review_score_table.table_name
-        )
+        for function in review_functions:
+            function.role.add_to_policy(bedrock_policy)
+            function.add_environment(
+                "REPO_CODE_REVIEW_TABLE_NAME", database.repo_code_review_table.table_name
+            )
+            function.add_environment(
+                "REPO_CODE_REVIEW_SCORE_TABLE_NAME",
+                database.repo_code_review_score_table.table_name,
+            )
+            database.repo_code_review_file_table.grant_read_write_data(function)
+            function.add_environment(
+                "REPO_CODE_REVIEW_FILE_TABLE_NAME",
+                database.repo_code_review_file_table.table_name,
+            )
         lambda_functions.codereview_get_score_file.add_environment(
             "REPO_CODE_REVIEW_SCORE_TABLE_NAME", database.repo_code_review_score_table.table_name
         )
@@ -185,19 +237,19 @@ class CodeReview(Stack):
         lambda_functions.api_post_codereview.role.add_to_policy(net_policy)
         lambda_functions.split_task.role.add_to_policy(net_policy)
         lambda_functions.api_get_result.role.add_to_policy(net_policy)
-        lambda_functions.code_review.role.add_to_policy(net_policy)
+        for function in review_functions:
+            function.role.add_to_policy(net_policy)
         lambda_functions.codereview_get_score_file.role.add_to_policy(net_policy)
 
-        lambda_functions.code_review.add_environment(
-            "BUCKET_NAME", bucket.bucket.bucket_name
-        )
-        lambda_functions.code_review.add_environment(
-            "LLM_ID", "anthropic.claude-3-sonnet-20240229-v1:0"
-        )
-        lambda_functions.code_review.add_environment("TEMPERATURE", "0.1")
-        lambda_functions.code_review.add_environment("TOP_P", "0.9")
-        lambda_functions.code_review.add_environment("MAX_TOKEN_TO_SAMPLE", "10000")
-        lambda_functions.code_review.add_environment("MAX_FAILED_TIMES", "6")
+        for function in review_functions:
+            function.add_environment("BUCKET_NAME", bucket.bucket.bucket_name)
+            function.add_environment("LLM_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+            function.add_environment("TEMPERATURE", "0.1")
+            function.add_environment("TOP_P", "0.9")
+            function.add_environment("MAX_TOKEN_TO_SAMPLE", "10000")
+            # 最后一次投递时放弃该文件, 之后消息由 redrive policy 移入死信队列
+            function.add_environment("MAX_FAILED_TIMES", str(sqs.max_receive_count - 1))
+            function.add_environment("REPORT_IMMUTABLE_KEYS", "false")
         lambda_functions.api_get_result.add_environment(
             "BUCKET_NAME", bucket.bucket.bucket_name
         )
@@ -207,13 +259,212 @@ class CodeReview(Stack):
         lambda_functions.modify_dynamodb.add_environment(
             "REPO_CODE_REVIEW_TABLE_NAME", "repo_code_review_table_dev2"
         )
-        sqs.codereview_task_queue.grant_send_messages(lambda_functions.split_task)
-        sqs.codereview_task_queue.grant_consume_messages(lambda_functions.code_review)
-        sqs.codereview_task_queue.grant_send_messages(lambda_functions.code_review)
+        review_queues = {
+            "TASK_SQS_URL": sqs.codereview_task_queue,
+            "INTERACTIVE_SQS_URL": sqs.codereview_interactive_queue,
+            "MERGE_SQS_URL": sqs.codereview_merge_queue,
+            "SUMMARY_SQS_URL": sqs.codereview_summary_queue,
+        }
+        for key, queue in review_queues.items():
+            for function in review_functions:
+                function.add_environment(key, queue.queue_url)
+                queue.grant_send_messages(function)
+        # split_task 发送文件审查与合并检查
+        for key in ["INTERACTIVE_SQS_URL", "MERGE_SQS_URL"]:
+            lambda_functions.split_task.add_environment(key, review_queues[key].queue_url)
+        for key in ["TASK_SQS_URL", "INTERACTIVE_SQS_URL", "MERGE_SQS_URL"]:
+            review_queues[key].grant_send_messages(lambda_functions.split_task)
+        # 每个函数只消费自己的队列; 消息按来源队列删除 (eventSourceARN)
+        for queue in [sqs.codereview_task_queue, sqs.codereview_interactive_queue]:
+            queue.grant_consume_messages(lambda_functions.code_review)
+        sqs.codereview_merge_queue.grant_consume_messages(lambda_functions.review_merge)
+        sqs.codereview_summary_queue.grant_consume_messages(lambda_functions.review_summary)
+        # 两个队列各自限制并发: 全量扫描最多占用 BATCH_REVIEW_CONCURRENCY 个 code_review,
+        # DIFF 审查始终有自己的并发, 不会被全量扫描的积压阻塞
         sqs_event_source = source.SqsEventSource(
-            sqs.codereview_task_queue, batch_size=1
+            sqs.codereview_task_queue,
+            batch_size=1,
+            max_concurrency=BATCH_REVIEW_CONCURRENCY,
+            report_batch_item_failures=True,
         )
         lambda_functions.code_review.add_event_source(sqs_event_source)
+        interactive_event_source = source.SqsEventSource(
+            sqs.codereview_interactive_queue,
+            batch_size=1,
+            max_concurrency=INTERACTIVE_REVIEW_CONCURRENCY,
+            report_batch_item_failures=True,
+        )
+        lambda_functions.code_review.add_event_source(interactive_event_source)
+        # 合并与汇总有各自的函数和并发, 大型报告的合并不会阻塞文件审查
+        lambda_functions.review_merge.add_event_source(
+            source.SqsEventSource(
+                sqs.codereview_merge_queue,
+                batch_size=1,
+                max_concurrency=MERGE_CONCURRENCY,
+                report_batch_item_failures=True,
+            )
+        )
+        lambda_functions.review_summary.add_event_source(
+            source.SqsEventSource(
+                sqs.codereview_summary_queue,
+                batch_size=1,
+                max_concurrency=SUMMARY_CONCURRENCY,
+                report_batch_item_failures=True,
+            )
+        )
+
+        # record counters for getReviewRecords
+        database.repo_code_review_counter_table.grant_read_write_data(
+            lambda_functions.record_counter
+        )
+        database.repo_code_review_counter_table.grant_read_data(
+            lambda_functions.api_get_result
+        )
+        database.repo_code_review_counter_table.grant_read_write_data(
+            lambda_functions.modify_dynamodb
+        )
+        lambda_functions.record_counter.add_environment(
+            "REPO_CODE_REVIEW_COUNTER_TABLE_NAME",
+            database.repo_code_review_counter_table.table_name,
+        )
+        lambda_functions.api_get_result.add_environment(
+            "REPO_CODE_REVIEW_COUNTER_TABLE_NAME",
+            database.repo_code_review_counter_table.table_name,
+        )
+        lambda_functions.modify_dynamodb.add_environment(
+            "REPO_CODE_REVIEW_COUNTER_TABLE_NAME",
+            database.repo_code_review_counter_table.table_name,
+        )
+        lambda_functions.record_counter.add_event_source(
+            source.DynamoEventSource(
+                database.repo_code_review_table,
+                starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
+                batch_size=100,
+                retry_attempts=3,
+                bisect_batch_on_error=True,
+                report_batch_item_failures=True,
+                filters=[
+                    aws_lambda.FilterCriteria.filter(
+                        {"eventName": aws_lambda.FilterRule.is_equal("INSERT")}
+                    )
+                ],
+            )
+        )
+
+        # response cache of the read APIs
+        for function in [
+            lambda_functions.api_get_result,
+            lambda_functions.codereview_get_score_file,
+        ]:
+            database.repo_code_review_cache_table.grant_read_write_data(function)
+            function.add_environment(
+                "REPO_CODE_REVIEW_CACHE_TABLE_NAME",
+                database.repo_code_review_cache_table.table_name,
+            )
+        database.repo_code_review_cache_table.grant_write_data(
+            lambda_functions.review_cache_invalidator
+        )
+        lambda_functions.review_cache_invalidator.add_environment(
+            "REPO_CODE_REVIEW_CACHE_TABLE_NAME",
+            database.repo_code_review_cache_table.table_name,
+        )
+        # per-file progress updates keep their short in-progress TTL, every other
+        # task_status write (init, completion) invalidates the cached result
+        lambda_functions.review_cache_invalidator.add_event_source(
+            source.DynamoEventSource(
+                database.repo_code_review_table,
+                starting_position=aws_lambda.StartingPosition.LATEST,
+                batch_size=100,
+                retry_attempts=3,
+                filters=[
+                    aws_lambda.FilterCriteria.filter(
+                        {
+                            "dynamodb": {
+                                "NewImage": {
+                                    "task_status": {
+                                        "S": aws_lambda.FilterRule.not_equals(
+                                            "InProgress LLM"
+                                        )
+                                    }
+                                }
+                            }
+                        }
+                    )
+                ],
+            )
+        )
+
+        # completion callbacks of reviews submitted with a callback_url
+        callback_secret = aws_secretsmanager.Secret(
+            self,
+            "callback_secret",
+            secret_name="codereview_callback_secret_{}".format(env_name),
+            description="HMAC key of the X-CodeReview-Signature callback header",
+            generate_secret_string=aws_secretsmanager.SecretStringGenerator(
+                exclude_punctuation=True, password_length=48
+            ),
+        )
+        callback_secret.grant_read(lambda_functions.review_notifier)
+        database.repo_code_review_table.grant_read_write_data(
+            lambda_functions.review_notifier
+        )
+        bucket.bucket.grant_read(lambda_functions.review_notifier)
+        lambda_functions.review_notifier.add_environment(
+            "REPO_CODE_REVIEW_TABLE_NAME", database.repo_code_review_table.table_name
+        )
+        lambda_functions.review_notifier.add_environment(
+            "BUCKET_NAME", bucket.bucket.bucket_name
+        )
+        lambda_functions.review_notifier.add_environment("EXPIRES_IN", "36000")
+        lambda_functions.review_notifier.add_environment(
+            "CALLBACK_SECRET_ARN", callback_secret.secret_arn
+        )
+        lambda_functions.review_notifier.role.add_to_policy(net_policy)
+        # review_cache_invalidator reads the request stream and invokes
+        # review_notifier once per review to notify, so the table stream keeps
+        # two readers and a slow callback endpoint only delays its own review
+        lambda_functions.review_notifier.grant_invoke(
+            lambda_functions.review_cache_invalidator
+        )
+        lambda_functions.review_cache_invalidator.add_environment(
+            "REVIEW_NOTIFIER_LAMBDA_NAME", lambda_functions.review_notifier.function_name
+        )
+        lambda_functions.review_notifier.configure_async_invoke(retry_attempts=2)
+        # callback_url 只允许这些 host (逗号分隔), 未配置时只允许公网地址
+        callback_allowed_hosts = self.node.try_get_context("callback_allowed_hosts") or ""
+        for function in [
+            lambda_functions.api_post_codereview,
+            lambda_functions.review_notifier,
+        ]:
+            function.add_environment("CALLBACK_ALLOWED_HOSTS", callback_allowed_hosts)
+
+        # dead-letter triage and replay
+        database.repo_code_review_table.grant_read_write_data(lambda_functions.review_dlq)
+        database.repo_code_review_file_table.grant_read_write_data(lambda_functions.review_dlq)
+        for queue in review_queues.values():
+            queue.grant_send_messages(lambda_functions.review_dlq)
+        for queue in [
+            sqs.codereview_task_dlq,
+            sqs.codereview_interactive_dlq,
+            sqs.codereview_merge_dlq,
+            sqs.codereview_summary_dlq,
+        ]:
+            queue.grant_consume_messages(lambda_functions.review_dlq)
+        for key, value in {
+            "REPO_CODE_REVIEW_TABLE_NAME": database.repo_code_review_table.table_name,
+            "REPO_CODE_REVIEW_FILE_TABLE_NAME": database.repo_code_review_file_table.table_name,
+            "TASK_SQS_URL": sqs.codereview_task_queue.queue_url,
+            "INTERACTIVE_SQS_URL": sqs.codereview_interactive_queue.queue_url,
+            "MERGE_SQS_URL": sqs.codereview_merge_queue.queue_url,
+            "SUMMARY_SQS_URL": sqs.codereview_summary_queue.queue_url,
+            "TASK_DLQ_URL": sqs.codereview_task_dlq.queue_url,
+            "INTERACTIVE_DLQ_URL": sqs.codereview_interactive_dlq.queue_url,
+            "MERGE_DLQ_URL": sqs.codereview_merge_dlq.queue_url,
+            "SUMMARY_DLQ_URL": sqs.codereview_summary_dlq.queue_url,
+            "REPLAY_RATE": "2",
+        }.items():
+            lambda_functions.review_dlq.add_environment(key, value)
+        lambda_functions.review_dlq.role.add_to_policy(net_policy)
 
         # api gateway
         api = API(self, "api", env_name_string=env_name)
@@ -226,6 +477,15 @@ class CodeReview(Stack):
         api_codereview_resource.add_method(
             "POST", api_post_codereview_integration, api_key_required=True
         )
+        # 批量提交, 同一个 lambda 按 path 分发
+        api_codereview_batch_resource = api_codereview_resource.add_resource("batch")
+        api_codereview_batch_resource.add_method(
+            "POST", api_post_codereview_integration, api_key_required=True
+        )
+        api_cancel_review = api.api.root.add_resource("cancelReview")
+        api_cancel_review.add_method(
+            "POST", api_post_codereview_integration, api_key_required=True
+        )
         api_result = api.api.root.add_resource("getReviewResult")
         api_get_result_integration = aws_apigateway.LambdaIntegration(
             lambda_functions.api_get_result
@@ -64,6 +64,13 @@ class Database(Construct):
             sort_key=Attribute(name="created_at", type=AttributeType.STRING),
         )
 
+        # composite "<project>#<branch>" key for getReviewRecords queries filtering on both
+        self.repo_code_review_table.add_global_secondary_index(
+            index_name="project_branch_created_at_gsi",
+            partition_key=Attribute(name="project_branch", type=AttributeType.STRING),
+            sort_key=Attribute(name="created_at", type=AttributeType.STRING),
+        )
+
         self.repo_code_review_table.add_global_secondary_index(
             index_name="year_month-created_at-index",
             partition_key=Attribute(name="year_month", type=AttributeType.STRING),
@@ -104,4 +111,40 @@ class Database(Construct):
             index_name="year_month-review_at-index",
             partition_key=Attribute(name="year_month", type=AttributeType.STRING),
             sort_key=Attribute(name="review_at", type=AttributeType.STRING),
-        )
\ No newline at end of file
+        )
+
+        # precomputed record counters, maintained from the request table stream
+        self.repo_code_review_counter_table = Table(
+            self,
+            "repo_code_review_counter_table_{}".format(env_name_string),
+            table_name="repo_code_review_counter_{}".format(env_name_string),
+            partition_key=Attribute(name="counter_key", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST,
+            encryption=TableEncryption.AWS_MANAGED,
+            point_in_time_recovery=True,
+            # record_counter 的 event# 去重标记
+            time_to_live_attribute="expires_at",
+        )
+
+        # shared response cache of the read APIs, expired items are removed by DynamoDB TTL
+        self.repo_code_review_cache_table = Table(
+            self,
+            "repo_code_review_cache_table_{}".format(env_name_string),
+            table_name="repo_code_review_cache_{}".format(env_name_string),
+            partition_key=Attribute(name="cache_key", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST,
+            encryption=TableEncryption.AWS_MANAGED,
+            time_to_live_attribute="expires_at",
+        )
+
+        # one record per reviewed file of a review, makes duplicate SQS deliveries idempotent
+        self.repo_code_review_file_table = Table(
+            self,
+            "repo_code_review_file_table_{}".format(env_name_string),
+            table_name="repo_code_review_file_{}".format(env_name_string),
+            partition_key=Attribute(name="review_id", type=AttributeType.STRING),
+            sort_key=Attribute(name="file_key", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST,
+            encryption=TableEncryption.AWS_MANAGED,
+            time_to_live_attribute="expires_at",
+        )
@@ -0,0 +1,4 @@
+"""
+Helpers shared by the code review lambdas, deployed as the common Lambda layer
+(codereview/lambda_common, see codereview/lambda_function/stack.py).
+"""
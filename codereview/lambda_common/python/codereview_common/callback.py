@@ -0,0 +1,91 @@
+import http.client
+import ipaddress
+import socket
+import ssl
+from urllib.parse import urlparse
+
+SSL_CONTEXT = ssl.create_default_context()
+
+
+def resolve_callback_address(callback_url, allowed_hosts=[]):
+    """
+    Resolves the host of a callback URL once and returns the address to
+    connect to. Without allowed_hosts every resolved address must be public,
+    so a callback cannot reach the VPC, the instance metadata endpoint or
+    localhost. The caller connects to this address instead of resolving the
+    host again, a DNS answer that changes after the check (DNS rebinding)
+    cannot redirect the callback.
+
+    Parameters:
+    callback_url (str): http/https address that receives the callback.
+    allowed_hosts (list): hosts allowed regardless of their addresses.
+
+    Returns:
+    str: The checked address, None when the callback is not allowed.
+    """
+    parsed = urlparse(callback_url)
+    hostname = parsed.hostname
+    if parsed.scheme not in ["http", "https"] or not hostname:
+        return None
+    if allowed_hosts and hostname not in allowed_hosts:
+        return None
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(hostname, None)]
+    except (socket.gaierror, UnicodeError):
+        return None
+    if not addresses:
+        return None
+    if not allowed_hosts:
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split("%")[0])
+            if ip.version == 6 and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global:
+                return None
+    return addresses[0]
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    # 连接已检查的地址, Host 头仍然是原始 host
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    # 连接已检查的地址, SNI 与证书校验使用原始 host
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, context=SSL_CONTEXT, **kwargs)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = SSL_CONTEXT.wrap_socket(sock, server_hostname=self.host)
+
+
+def post_pinned(callback_url, address, body, headers, timeout):
+    """
+    POSTs body to callback_url over a connection to address. Redirects are
+    not followed, the callback never reaches an unchecked address.
+
+    Returns:
+    int: The HTTP status code.
+    """
+    parsed = urlparse(callback_url)
+    connection_class = (
+        PinnedHTTPSConnection if parsed.scheme == "https" else PinnedHTTPConnection
+    )
+    connection = connection_class(
+        parsed.hostname, address, port=parsed.port, timeout=timeout
+    )
+    path = parsed.path or "/"
+    if parsed.query:
+        path = f"{path}?{parsed.query}"
+    try:
+        connection.request("POST", path, body=body, headers=headers)
+        return connection.getresponse().status
+    finally:
+        connection.close()
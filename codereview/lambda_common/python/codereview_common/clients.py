@@ -0,0 +1,20 @@
+import threading
+
+
+class LazyClient:
+    """
+    Creates a boto3 client, resource or table on first attribute access, so a
+    cold start only pays for the clients the invocation actually uses.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import boto3
+
+from codereview_common.clients import LazyClient
+
+DYNAMODB = LazyClient(lambda: boto3.client("dynamodb"))
+REPO_CODE_REVIEW_CACHE_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_CACHE_TABLE_NAME")
+# response cache: per-container LRU plus the optional shared cache table
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "256"))
+# the stream only invalidates the shared table, so getReviewResult entries stay
+# in the per-container LRU at most CACHE_LOCAL_REVIEW_TTL seconds
+CACHE_LOCAL_REVIEW_TTL = float(os.getenv("CACHE_LOCAL_REVIEW_TTL", "5"))
+LOCAL_CACHE = OrderedDict()
+# list responses are keyed with the epoch item that review_cache_invalidator
+# increments on every task_status write, each container reads it again after
+# CACHE_EPOCH_TTL seconds
+EPOCH_KEY = "epoch#lists"
+CACHE_EPOCH_TTL = float(os.getenv("CACHE_EPOCH_TTL", "1"))
+EPOCH = {"value": None, "read_at": 0.0}
+
+
+def get_list_epoch(table_name=REPO_CODE_REVIEW_CACHE_TABLE_NAME):
+    """
+    Returns the current list epoch, "0" without a shared cache table and
+    None when it cannot be read, the list response is not cached then.
+    """
+    if not table_name:
+        return "0"
+    now = time.time()
+    if EPOCH["value"] is not None and now - EPOCH["read_at"] < CACHE_EPOCH_TTL:
+        return EPOCH["value"]
+    try:
+        item = DYNAMODB.get_item(
+            TableName=table_name, Key={"cache_key": {"S": EPOCH_KEY}}
+        ).get("Item")
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        return None
+    EPOCH["value"] = item["epoch"]["N"] if item else "0"
+    EPOCH["read_at"] = now
+    return EPOCH["value"]
+
+
+def get_cache_key(path, body):
+    """
+    Returns the response cache key of a request. getReviewResult is keyed by
+    review_id so the stream can invalidate it, the other APIs by the list
+    epoch and the request body.
+
+    Returns:
+    str: The cache key, None when the list epoch cannot be read.
+    """
+    if path == "/getReviewResult" and isinstance(body.get("review_id"), str):
+        return f"review#{body['review_id']}"
+    epoch = get_list_epoch()
+    if epoch is None:
+        return None
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{path}#{epoch}#{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+def local_cache_put(cache_key, response, expires_at):
+    if cache_key.startswith("review#"):
+        # 重跑、取消或死信重放后, 其他容器最迟 CACHE_LOCAL_REVIEW_TTL 秒看到新状态
+        expires_at = min(expires_at, time.time() + CACHE_LOCAL_REVIEW_TTL)
+    LOCAL_CACHE[cache_key] = (expires_at, response)
+    LOCAL_CACHE.move_to_end(cache_key)
+    while len(LOCAL_CACHE) > CACHE_SIZE:
+        LOCAL_CACHE.popitem(last=False)
+
+
+def cache_get(cache_key, table_name=REPO_CODE_REVIEW_CACHE_TABLE_NAME):
+    """
+    Looks the response up in the per-container LRU, then in the shared cache table.
+
+    Returns:
+    dict: The cached lambda response, or None on a miss.
+    """
+    now = time.time()
+    entry = LOCAL_CACHE.get(cache_key)
+    if entry:
+        if entry[0] > now:
+            LOCAL_CACHE.move_to_end(cache_key)
+            return entry[1]
+        del LOCAL_CACHE[cache_key]
+    if not table_name:
+        return None
+    try:
+        item = DYNAMODB.get_item(
+            TableName=table_name, Key={"cache_key": {"S": cache_key}}
+        ).get("Item")
+        # DynamoDB TTL 删除有延迟, 需要检查 expires_at
+        if item and float(item["expires_at"]["N"]) > now:
+            response = json.loads(item["response"]["S"])
+            local_cache_put(cache_key, response, float(item["expires_at"]["N"]))
+            return response
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+    return None
+
+
+def cache_put(cache_key, response, ttl, table_name=REPO_CODE_REVIEW_CACHE_TABLE_NAME):
+    if ttl <= 0:
+        return
+    expires_at = time.time() + ttl
+    local_cache_put(cache_key, response, expires_at)
+    if not table_name:
+        return
+    try:
+        DYNAMODB.put_item(
+            TableName=table_name,
+            Item={
+                "cache_key": {"S": cache_key},
+                "response": {"S": json.dumps(response)},
+                "expires_at": {"N": str(int(expires_at))},
+            },
+        )
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+
+
+def cached_response(event, handler, get_cache_ttl):
+    """
+    Serves the request from the response cache, or runs handler and caches
+    its response for get_cache_ttl(path, response) seconds.
+    """
+    path = event["path"]
+    try:
+        body = json.loads(event["body"])
+        cache_key = get_cache_key(path, body)
+    except Exception:
+        # 请求体无效, 由 handler 返回错误
+        return handler(event)
+    if cache_key is None:
+        return handler(event)
+    response = cache_get(cache_key)
+    # 长轮询请求只使用已完成任务的缓存
+    if response is not None and (
+        not body.get("wait_seconds") or json.loads(response["body"])["status"] == "success"
+    ):
+        logging.debug(f"cache hit: {cache_key}")
+        return response
+    response = handler(event)
+    cache_put(cache_key, response, get_cache_ttl(path, response))
+    return response
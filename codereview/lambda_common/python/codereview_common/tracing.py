@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+TRACE_NAMESPACE = os.getenv("TRACE_NAMESPACE", "CodeReview")
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+# a dimension set is emitted only when the record has all of its dimensions
+TRACE_DIMENSION_SETS = [["Stage"], ["Stage", "Project"], ["Stage", "FileSize"]]
+TRACE = {"dimensions": {}, "properties": {}, "spans": {}, "counters": {}}
+
+
+def trace_reset(**dimensions):
+    """
+    Starts a new trace record for one invocation (or one SQS record).
+
+    Parameters:
+    dimensions: CloudWatch dimensions of the record, e.g. Stage and Project.
+    """
+    TRACE["dimensions"] = {k: str(v) for k, v in dimensions.items() if v is not None}
+    TRACE["properties"] = {}
+    TRACE["spans"] = {}
+    TRACE["counters"] = {}
+
+
+def trace_count(name, value=1):
+    TRACE["counters"][name] = TRACE["counters"].get(name, 0) + value
+
+
+def trace_record(name, duration_ms, size=0):
+    span = TRACE["spans"].setdefault(name, {"count": 0, "ms": 0.0, "bytes": 0})
+    span["count"] += 1
+    span["ms"] += duration_ms
+    span["bytes"] += size
+
+
+@contextmanager
+def trace_span(name, group=None):
+    """
+    Times the enclosed block. The yielded dict accepts a "bytes" value.
+    When group is given the timing is also added to that group span.
+    """
+    span = {"bytes": 0}
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000.0
+        trace_record(name, duration_ms, span["bytes"])
+        if group:
+            trace_record(group, duration_ms, span["bytes"])
+
+
+def traced(name=None, group=None, size_of=None):
+    """
+    Decorator version of trace_span. size_of(result) returns the bytes
+    handled by the call.
+    """
+
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(span_name, group) as span:
+                result = func(*args, **kwargs)
+                if size_of is not None and result is not None:
+                    span["bytes"] = size_of(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def trace_emit():
+    """
+    Prints the current trace as one CloudWatch embedded metric format (EMF)
+    record on stdout, so metrics are extracted from the logs without any
+    extra API call.
+    """
+    if not TRACE_ENABLED or not (TRACE["spans"] or TRACE["counters"]):
+        return
+    record = dict(TRACE["dimensions"])
+    record.update(TRACE["properties"])
+    metrics = []
+    for name, span in TRACE["spans"].items():
+        record[f"{name}.ms"] = round(span["ms"], 3)
+        record[f"{name}.count"] = span["count"]
+        metrics.append({"Name": f"{name}.ms", "Unit": "Milliseconds"})
+        metrics.append({"Name": f"{name}.count", "Unit": "Count"})
+        if span["bytes"]:
+            record[f"{name}.bytes"] = span["bytes"]
+            metrics.append({"Name": f"{name}.bytes", "Unit": "Bytes"})
+    for name, value in TRACE["counters"].items():
+        record[name] = value
+        metrics.append({"Name": name, "Unit": "Count"})
+    record["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [
+            {
+                "Namespace": TRACE_NAMESPACE,
+                "Dimensions": [
+                    dims
+                    for dims in TRACE_DIMENSION_SETS
+                    if all(d in TRACE["dimensions"] for d in dims)
+                ],
+                "Metrics": metrics,
+            }
+        ],
+    }
+    print(json.dumps(record, ensure_ascii=False))
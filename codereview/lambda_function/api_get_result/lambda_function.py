@@ -1,19 +1,41 @@
+import base64
 import json
 import boto3
 import os
+from boto3.dynamodb.types import TypeDeserializer
 from botocore.config import Config
-import json
+import decimal
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from codereview_common.clients import LazyClient
+from codereview_common.response_cache import cached_response
 
-DYNAMODB = boto3.client("dynamodb")
+DYNAMODB = LazyClient(lambda: boto3.client("dynamodb"))
 REPO_CODE_REVIEW_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_TABLE_NAME")
+REPO_CODE_REVIEW_COUNTER_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_COUNTER_TABLE_NAME")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 LAMBDA_LOG_BUCKET_NAME = os.getenv("LAMBDA_LOG_BUCKET_NAME")
 EXPIRES_IN = int(os.getenv("EXPIRES_IN", "36000"))
+# presigned URLs are reused until PRESIGNED_URL_REFRESH seconds before they expire
+PRESIGNED_URL_REFRESH = int(os.getenv("PRESIGNED_URL_REFRESH", str(EXPIRES_IN // 4)))
+PRESIGNED_URLS = OrderedDict()
+# number of year_month partitions listed by getReviewRecords without filters
+RECORD_MONTHS = int(os.getenv("RECORD_MONTHS", "3"))
+# response cache TTLs in seconds, see codereview_common.response_cache
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "256"))
+CACHE_COMPLETED_TTL = int(os.getenv("CACHE_COMPLETED_TTL", "3600"))
+CACHE_PROGRESS_TTL = int(os.getenv("CACHE_PROGRESS_TTL", "5"))
+CACHE_LIST_TTL = int(os.getenv("CACHE_LIST_TTL", "30"))
+# getReviewResult long polling: the API Gateway integration times out after 29 seconds
+MAX_WAIT_SECONDS = int(os.getenv("MAX_WAIT_SECONDS", "20"))
+WAIT_INITIAL_DELAY = 0.25
+WAIT_MAX_DELAY = 2.0
 HTML_POSTFIX = "merged-code-review-result.html"
-S3 = boto3.client("s3")
+S3 = LazyClient(lambda: boto3.client("s3"))
 NO_FILE_NEED_REVIEW = "No file need review"
 PRESIGNED_URL_GEN_ERROR = "An error occurred in generating presigned URL"
 HTML_GEN_ERROR = "An error occurred in generating html"
@@ -21,6 +43,13 @@ ALL_SCAN_SCOPE = "ALL"
 COMPLETED_STATUS = "Completed"
 PROGRESS_STATUS = "InProgress"
 PROGRESSLLM_STATUS = "InProgress LLM"
+FAILED_STATUS = "Failed"
+CANCELLED_STATUS = "Cancelled"
+# getReviewRecords item encodings: DynamoDB attribute values ({"S": ...}) or plain JSON
+DYNAMODB_FORMAT = "dynamodb"
+JSON_FORMAT = "json"
+RESPONSE_FORMATS = [DYNAMODB_FORMAT, JSON_FORMAT]
+DESERIALIZER = TypeDeserializer()
 
 
 GSI_INDEX_NAMES = {
@@ -29,7 +58,32 @@ GSI_INDEX_NAMES = {
     "COMMIT_ID_INDEX": "commit_id_created_at_gsi",
     "REPO_URL_INDEX": "repo_url_created_at_gsi",
     "BRANCH_INDEX": "branch_created_at_gsi",
+    "PROJECT_BRANCH_INDEX": "project_branch_created_at_gsi",
+}
+
+# GSI partition keys usable by getReviewRecords and the filter parameters they cover,
+# composite partition keys join the values with "#". Without counters the first
+# usable key in this order is queried.
+QUERY_PARTITION_KEYS = {
+    "commit_id": ["commit_id"],
+    "project_branch": ["project", "branch"],
+    "repo_url": ["repo_url"],
+    "project": ["project"],
+    "branch": ["branch"],
+    "scan_scope": ["scan_scope"],
 }
+# estimated partition size of the partition keys without a counter
+DEFAULT_PARTITION_SIZE = {"commit_id": 1}
+
+# record attributes with a precomputed counter, see the record_counter lambda
+COUNTER_DIMENSIONS = [
+    "project",
+    "branch",
+    "project_branch",
+    "repo_url",
+    "scan_scope",
+    "year_month",
+]
 
 RESPONSE_HEADERS = {
     "Access-Control-Allow-Origin": "*",  # 允许来自任何源的请求
@@ -58,6 +112,22 @@ def ui_print(log, lambda_name="lambda_api_get_result"):
     )
 
 
+def get_cache_ttl(path, response):
+    """
+    Completed reviews are cached for long, in-progress ones and record lists
+    briefly, errors are not cached.
+    """
+    body = json.loads(response["body"])
+    if path == "/getReviewResult":
+        if body["status"] == "success":
+            # 缓存的预签名 URL 至少还有 PRESIGNED_URL_REFRESH 秒有效期
+            return min(CACHE_COMPLETED_TTL, PRESIGNED_URL_REFRESH)
+        if body["message"].startswith("The task is in"):
+            return CACHE_PROGRESS_TTL
+        return 0
+    return CACHE_LIST_TTL if body["status"] == "success" else 0
+
+
 def query_task_status(review_id):
     """
     查询指定review_id的任务状态。
@@ -88,85 +158,37 @@ def query_task_status(review_id):
         return None
 
 
-def count_next_month(
-    index_name,
-    partition_key,
-    partition_value,
-    query_params,
-    table_name=REPO_CODE_REVIEW_TABLE_NAME,
-):
-    year = int(partition_value.split('-')[0])
-    print("year is " + str(year))
-    month = int(partition_value.split('-')[1])
-    print("month is " + str(month))
-    
+def query_count(index_name, query_params, table_name=REPO_CODE_REVIEW_TABLE_NAME):
+    """
+    Counts the matching items of a GSI partition. A single COUNT query stops
+    after 1 MB of data, so LastEvaluatedKey is followed until the end.
+    """
+    params = dict(query_params, Select="COUNT")  # 设置查询为计数模式
     count = 0
-    iteration = 0
-    # Initialize filter expression components
-    expression_attribute_names = {}
-    expression_attribute_values = {}
-    
-    while iteration < 2:
-        print("iteration is " + str(iteration))
-        print("month is " + str(month))
-        if month > 1:
-            month = month - 1
-            partition_value = str(year) + "-0" + str(month)
-            print("partition_value is " + partition_value)
-            expression_attribute_values[":value"] = {"S": partition_value}
-            print("expression_attribute_values update.")
-            query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        else:
-            month = 12
-            year = year - 1
-            partition_value = str(year) + "-0" + str(month)
-            expression_attribute_values[":value"] = {"S": partition_value}
-            query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        
-        print("query parameters is " + str(query_params))
-        response = DYNAMODB.query(
-            TableName=table_name, IndexName=index_name, **query_params
-        )
-        print("response count is " + str(response.get("Count", 0)))
+    while True:
+        response = DYNAMODB.query(TableName=table_name, IndexName=index_name, **params)
         count = count + int(response.get("Count", 0))
-        print("iteration is " + str(iteration) + ", count is "+ str(count))
-        iteration = iteration + 1
-    return count
+        if "LastEvaluatedKey" not in response:
+            return count
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
 
 def count_items_in_dynamodb(
     index_name,
     partition_key,
     partition_value,
-    table_name=REPO_CODE_REVIEW_TABLE_NAME,
 ):
-    # 初始化查询参数
-    query_params = {
-        "KeyConditionExpression": f"#{partition_key} = :value",
-        "ExpressionAttributeNames": {f"#{partition_key}": partition_key},
-        "ExpressionAttributeValues": {":value": {"S": partition_value}},
-        "Select": "COUNT",  # 设置查询为计数模式
-    }
-
-    # 初始化过滤表达式组件
-    expression_attribute_names = {}
-    expression_attribute_values = {}
-    
-    query_params["FilterExpression"] = "NOT commit_id = :commit_id"
-    expression_attribute_values[":commit_id"] = {"S": "00000000"}
-    query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        
     try:
-        # 执行查询
-        response = DYNAMODB.query(
-            TableName=table_name, IndexName=index_name, **query_params
-        )
-        count = response.get("Count", 0)
-        print("partition_key is " + partition_key)
-        print("partition_value is " + partition_value)
-        print("first month count is " + str(count))
-        count = count + count_next_month(index_name, partition_key, partition_value, query_params)
-        return count
-        
+        partitions = get_month_partitions(partition_value)
+        with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+            counts = executor.map(
+                lambda partition: query_count(
+                    index_name, get_query_params(partition_key, partition)
+                ),
+                partitions,
+            )
+            return sum(counts)
+
     except Exception as e:
         ui_print(f"An error occurred: {str(e)}")
         return None
@@ -176,66 +198,312 @@ def query_with_count(
     index_name,
     partition_key,
     partition_value,
-    table_name=REPO_CODE_REVIEW_TABLE_NAME,
     filter_parameters={},
 ):
+    try:
+        # 返回符合条件的记录数量
+        return query_count(
+            index_name, get_query_params(partition_key, partition_value, filter_parameters)
+        )
+    except Exception as e:
+        ui_print(f"An error occurred: {str(e)}")
+        return None
 
-    # 初始化查询参数
-    query_params = {
-        "KeyConditionExpression": f"#{partition_key} = :value",
-        "ExpressionAttributeNames": {f"#{partition_key}": partition_key},
-        "ExpressionAttributeValues": {":value": {"S": partition_value}},
-        "Select": "COUNT",  # 设置查询为计数模式
-    }
 
-    # 初始化过滤表达式组件
-    filter_expressions = []
-    expression_attribute_names = {}
-    expression_attribute_values = {}
+def get_counter(counter_key, table_name=REPO_CODE_REVIEW_COUNTER_TABLE_NAME):
+    """
+    Reads one precomputed record counter. The counters are maintained by the
+    record_counter lambda from the repo_code_review_table stream.
 
-    # 根据非空值构建过滤表达式，并确保它们不与分区键匹配
-    for key in ["commit_id", "project", "scan_scope", "repo_url", "branch"]:
-        if key != partition_key and filter_parameters.get(key, ""):
-            filter_expressions.append(f"#{key} = :{key}")
-            expression_attribute_names[f"#{key}"] = key
-            expression_attribute_values[f":{key}"] = {"S": filter_parameters[key]}
+    Parameters:
+    counter_key (str): "<attribute>#<value>", e.g. "project#my-project".
 
-    # 如果存在过滤表达式，将它们添加到查询参数中
-    if filter_expressions:
-        query_params["FilterExpression"] = " AND ".join(filter_expressions)
-        query_params["ExpressionAttributeNames"].update(expression_attribute_names)
-        query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        if "commit_id" not in query_params["FilterExpression"] and partition_key != "commit_id":
-            query_params["FilterExpression"] = query_params["FilterExpression"] + " AND NOT commit_id = :commit_id"
-            expression_attribute_values[":commit_id"] = {"S": "00000000"}
-    else:
-        if partition_key != "commit_id":
-            query_params["FilterExpression"] = "NOT commit_id = :commit_id"
-            expression_attribute_values[":commit_id"] = {"S": "00000000"}
-    query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        
+    Returns:
+    int: The number of records, 0 if the counter does not exist, or None on error.
+    """
+    totals = get_counters([counter_key], table_name)
+    return None if totals is None else totals[counter_key]
+
+
+def get_counters(counter_keys, table_name=REPO_CODE_REVIEW_COUNTER_TABLE_NAME, default=0):
+    """
+    Reads several precomputed record counters, with GetItem for a single
+    counter and BatchGetItem otherwise.
+
+    Returns:
+    dict: {counter_key: number of records, or default if the counter does not exist},
+        or None on error.
+    """
+    if not table_name:
+        return None
+    totals = {key: default for key in counter_keys}
     try:
-        # 执行查询
-        response = DYNAMODB.query(
-            TableName=table_name, IndexName=index_name, **query_params
-        )
-        # 返回符合条件的记录数量
-        return response.get("Count", 0)
+        if len(counter_keys) == 1:
+            response = DYNAMODB.get_item(
+                TableName=table_name,
+                Key={"counter_key": {"S": counter_keys[0]}},
+                ProjectionExpression="counter_key, #total",
+                ExpressionAttributeNames={"#total": "total"},
+            )
+            items = [response["Item"]] if "Item" in response else []
+        else:
+            items = []
+            request = {
+                table_name: {
+                    "Keys": [{"counter_key": {"S": key}} for key in counter_keys],
+                    "ProjectionExpression": "counter_key, #total",
+                    "ExpressionAttributeNames": {"#total": "total"},
+                }
+            }
+            while request:
+                response = DYNAMODB.batch_get_item(RequestItems=request)
+                items.extend(response["Responses"].get(table_name, []))
+                request = response.get("UnprocessedKeys")
+        for item in items:
+            totals[item["counter_key"]["S"]] = int(item.get("total", {}).get("N", "0"))
+        return totals
     except Exception as e:
         ui_print(f"An error occurred: {str(e)}")
         return None
 
 
-def query_with_pagination(
+def plan_query(parameters):
+    """
+    Chooses the GSI partition that reads the fewest items for the given filters.
+    Candidates are the partition keys whose filter parameters are all given,
+    their sizes come from the record counters.
+
+    Parameters:
+    parameters (dict): The getReviewRecords filter parameters.
+
+    Returns:
+    tuple: (partition_key, partition_value, total) or None without filters.
+        total is the exact number of matching records when the partition key covers
+        every given filter and has a counter, otherwise None.
+    """
+    candidates = []
+    for partition_key, filter_keys in QUERY_PARTITION_KEYS.items():
+        if all(parameters.get(key, "") for key in filter_keys):
+            partition_value = "#".join(parameters[key] for key in filter_keys)
+            candidates.append((partition_key, partition_value))
+    if not candidates:
+        return None
+
+    counter_keys = [
+        f"{key}#{value}" for key, value in candidates if key in COUNTER_DIMENSIONS
+    ]
+    totals = get_counters(counter_keys, default=None) if counter_keys else {}
+    if totals is None:
+        totals = {}
+
+    def partition_size(candidate):
+        key, value = candidate
+        if key in DEFAULT_PARTITION_SIZE:
+            return DEFAULT_PARTITION_SIZE[key]
+        return totals.get(f"{key}#{value}")
+
+    # 优先选择分区最小的索引, 没有计数器的索引按 QUERY_PARTITION_KEYS 顺序排在后面
+    sized = [candidate for candidate in candidates if partition_size(candidate) is not None]
+    partition_key, partition_value = (
+        min(sized, key=partition_size) if sized else candidates[0]
+    )
+
+    total = None
+    active_keys = {key for key, value in parameters.items() if value}
+    covered_keys = set(QUERY_PARTITION_KEYS[partition_key])
+    if partition_key in COUNTER_DIMENSIONS and covered_keys == active_keys:
+        total = totals.get(f"{partition_key}#{partition_value}")
+    ui_print(f"query plan: {partition_key}={partition_value}, candidates: {candidates}")
+    return partition_key, partition_value, total
+
+
+def count_recent_records(partition_value):
+    """
+    Returns the number of records listed by the default (unfiltered) query,
+    from the year_month counters, falling back to COUNT queries.
+    """
+    partitions = get_month_partitions(partition_value)
+    totals = get_counters([f"year_month#{partition}" for partition in partitions])
+    if totals is not None:
+        return sum(totals.values())
+    return count_items_in_dynamodb('year_month-created_at-index', 'year_month', partition_value)
+
+
+def encode_cursor(index_name, last_key=None, positions=None):
+    """
+    Encodes the position after the current page as an opaque cursor token.
+
+    Parameters:
+    index_name (str): The GSI the cursor belongs to.
+    last_key (dict): The ExclusiveStartKey of the next page, or None.
+    positions (list): [partition, ExclusiveStartKey] of the month partitions
+        that still have items (full scan only).
+
+    Returns:
+    str: The cursor, or "" when there is no next page.
+    """
+    if not last_key and not positions:
+        return ""
+    token = {"index": index_name, "key": last_key}
+    if positions:
+        token["positions"] = positions
+    return base64.urlsafe_b64encode(json.dumps(token).encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor, index_name):
+    """
+    Decodes a cursor created by encode_cursor for the same GSI.
+
+    Returns:
+    dict: {"key": ExclusiveStartKey or None, "positions": month partition positions}.
+    """
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except Exception:
+        raise ValueError("cursor is invalid.")
+    if token.get("index") != index_name:
+        raise ValueError("cursor does not match the query parameters.")
+    return {"key": token.get("key"), "positions": token.get("positions") or []}
+
+
+def get_item_key(item, partition_key):
+    """
+    Builds the GSI ExclusiveStartKey that points right after the given item.
+    All GSIs of repo_code_review_table are sorted by created_at.
+    """
+    return {
+        key: item[key] for key in ["review_id", partition_key, "created_at"] if key in item
+    }
+
+
+def query_page(
     index_name,
     partition_key,
-    partition_value,
-    page_index,
+    query_params,
     page_size,
+    start_key=None,
     table_name=REPO_CODE_REVIEW_TABLE_NAME,
-    filter_parameters={},
 ):
+    """
+    Reads one page of matching items from a GSI partition, following
+    LastEvaluatedKey until page_size items passed the filter or the
+    partition is exhausted.
+
+    Returns:
+    tuple: (items, next_key). next_key is None when the partition has no more items.
+    """
+    items = []
+    while len(items) < page_size:
+        params = dict(query_params, Limit=page_size)
+        if start_key:
+            params["ExclusiveStartKey"] = start_key
+        response = DYNAMODB.query(TableName=table_name, IndexName=index_name, **params)
+        items.extend(response["Items"])
+        start_key = response.get("LastEvaluatedKey")
+        if not start_key:
+            break
+    if len(items) > page_size:
+        items = items[:page_size]
+        start_key = get_item_key(items[-1], partition_key)
+    return items, start_key
+
+
+def get_key_only_params(query_params, partition_key):
+    """
+    Returns a copy of query_params that only reads the GSI key attributes.
+    The filter expression is still evaluated on the full item.
+    """
+    key_params = dict(query_params)
+    key_params["ExpressionAttributeNames"] = dict(query_params["ExpressionAttributeNames"])
+    projection = []
+    for key in ["review_id", partition_key, "created_at"]:
+        key_params["ExpressionAttributeNames"][f"#key_{key}"] = key
+        projection.append(f"#key_{key}")
+    key_params["ProjectionExpression"] = ", ".join(projection)
+    return key_params
+
+
+def get_projection_params(query_params, partition_key, fields):
+    """
+    Returns a copy of query_params that only reads the requested fields, plus
+    the GSI key attributes the cursor is built from.
+    """
+    if not fields:
+        return query_params
+    projected_params = dict(query_params)
+    projected_params["ExpressionAttributeNames"] = dict(query_params["ExpressionAttributeNames"])
+    projection = []
+    attributes = dict.fromkeys(["review_id", partition_key, "created_at"] + fields)
+    for index, attribute in enumerate(attributes):
+        projected_params["ExpressionAttributeNames"][f"#field_{index}"] = attribute
+        projection.append(f"#field_{index}")
+    projected_params["ProjectionExpression"] = ", ".join(projection)
+    return projected_params
+
+
+def get_response_options(body):
+    """
+    Reads the optional "fields" and "format" parameters of a list request.
+
+    Returns:
+    tuple: (fields, response_format). An empty fields list returns whole items.
+    """
+    fields = body.get("fields", [])
+    if not isinstance(fields, list) or not all(
+        isinstance(field, str) and field for field in fields
+    ):
+        raise ValueError("fields should be a list of attribute names.")
+    response_format = body.get("format", DYNAMODB_FORMAT)
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"format should be one of {RESPONSE_FORMATS}.")
+    return fields, response_format
+
+
+def format_items(items, fields=[], response_format=DYNAMODB_FORMAT):
+    """
+    Drops the attributes that were not requested and converts the items to
+    the requested encoding.
+    """
+    if fields:
+        items = [
+            {key: value for key, value in item.items() if key in fields} for item in items
+        ]
+    if response_format == JSON_FORMAT:
+        items = [
+            {key: DESERIALIZER.deserialize(value) for key, value in item.items()}
+            for item in items
+        ]
+    return items
+
+
+def json_default(obj):
+    # DynamoDB 数字反序列化为 Decimal, 集合反序列化为 set
+    if isinstance(obj, decimal.Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, set):
+        return sorted(obj)
+    return str(obj)
+
 
+def skip_to_page(index_name, partition_key, query_params, page_index, page_size):
+    """
+    Compatibility layer for page_index: walks over the previous pages reading
+    only key attributes.
+
+    Returns:
+    tuple: (ExclusiveStartKey of the requested page, whether the page exists).
+    """
+    skip = (page_index - 1) * page_size
+    if skip <= 0:
+        return None, True
+    items, start_key = query_page(
+        index_name, partition_key, get_key_only_params(query_params, partition_key), skip
+    )
+    # without a start key after a full skip there is nothing left to read
+    return start_key, len(items) == skip and start_key is not None
+
+
+def get_query_params(partition_key, partition_value, filter_parameters={}):
     # 初始化查询参数
     query_params = {
         "KeyConditionExpression": f"#{partition_key} = :value",
@@ -249,8 +517,9 @@ def query_with_pagination(
     expression_attribute_values = {}
 
     # Build filter expression based on non-empty values and not matching the partition key
+    covered_keys = QUERY_PARTITION_KEYS.get(partition_key, [partition_key])
     for key in ["commit_id", "project", "scan_scope", "repo_url", "branch"]:
-        if key != partition_key and filter_parameters.get(key, ""):
+        if key not in covered_keys and filter_parameters.get(key, ""):
             filter_expressions.append(f"#{key} = :{key}")
             expression_attribute_names[f"#{key}"] = key
             expression_attribute_values[f":{key}"] = {"S": filter_parameters[key]}
@@ -268,112 +537,169 @@ def query_with_pagination(
             query_params["FilterExpression"] = "NOT commit_id = :commit_id"
             expression_attribute_values[":commit_id"] = {"S": "00000000"}
     query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        
-    index_count = 0
-    items_count = 0
-    try:
-        response = DYNAMODB.query(
-            TableName=table_name, IndexName=index_name, **query_params
-        )
-        # 处理查询结果
-        ui_print(response)
-        
-        if page_index * page_size <= len(response['Items']):
-            response['Items'] = response['Items'][(page_index-1) * page_size : page_index * page_size]
-        else:
-            response['Items'] = response['Items'][(page_index-1) * page_size : ]
-        return response
-            
-    except Exception as e:
-        ui_print(f"An error occurred: {str(e)}")
-        return None
+    return query_params
 
 
-def full_scan_next_month(
+def query_with_pagination(
     index_name,
     partition_key,
     partition_value,
-    query_params,
-    table_name=REPO_CODE_REVIEW_TABLE_NAME,
+    page_size,
+    cursor="",
+    page_index=1,
+    filter_parameters={},
+    fields=[],
 ):
+    """
+    Returns one page of records from a GSI partition.
+
+    Parameters:
+    cursor (str): The next_cursor of the previous page; takes precedence over page_index.
+    page_index (int): 1-based page number, only used when no cursor is given.
+    fields (list): The attributes to read, all attributes when empty.
+
+    Returns:
+    tuple: (items, next_cursor), or (None, "") on error.
+    """
+    query_params = get_query_params(partition_key, partition_value, filter_parameters)
+    try:
+        if cursor:
+            start_key = decode_cursor(cursor, index_name)["key"]
+        else:
+            start_key, found = skip_to_page(
+                index_name, partition_key, query_params, page_index, page_size
+            )
+            if not found:
+                return [], ""
+        items, next_key = query_page(
+            index_name,
+            partition_key,
+            get_projection_params(query_params, partition_key, fields),
+            page_size,
+            start_key,
+        )
+        return items, encode_cursor(index_name, next_key)
+    except ValueError:
+        raise
+    except Exception as e:
+        ui_print(f"An error occurred: {str(e)}")
+        return None, ""
+
+
+def get_month_partitions(partition_value, months=RECORD_MONTHS):
+    """
+    Returns the year_month partition values scanned by the default listing,
+    starting with partition_value and going back month by month.
+    """
     year = int(partition_value.split('-')[0])
     month = int(partition_value.split('-')[1])
-    
-    items = []
-    iteration = 0
-    
-    # Initialize filter expression components
-    expression_attribute_names = {}
-    expression_attribute_values = {}
-    
-    while iteration < 2:
+    partitions = []
+    while len(partitions) < months:
+        partitions.append(f"{year:04d}-{month:02d}")
         if month > 1:
             month = month - 1
-            partition_value = str(year) + "-0" + str(month)
-            expression_attribute_values[":value"] = {"S": partition_value}
-            query_params["ExpressionAttributeValues"].update(expression_attribute_values)
         else:
             month = 12
             year = year - 1
-            partition_value = str(year) + "-0" + str(month)
-            expression_attribute_values[":value"] = {"S": partition_value}
-            query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        
-        print("next month query parameters is " + str(query_params))
-        response = DYNAMODB.query(
-            TableName=table_name, IndexName=index_name, **query_params
+    return partitions
+
+
+def query_months_page(
+    index_name, partition_key, positions, page_size, keys_only=False, fields=[]
+):
+    """
+    Reads the month partitions newest first and stops after page_size items.
+    created_at of a month partition never overlaps another month, so the
+    items come out ordered by created_at descending.
+
+    Parameters:
+    positions (list): [partition, ExclusiveStartKey or None] of every month partition
+        that still has items to read, newest first.
+
+    Returns:
+    tuple: (items, positions) where positions is where the next page starts.
+    """
+    items = []
+    for index, (partition, start_key) in enumerate(positions):
+        query_params = get_query_params(partition_key, partition)
+        if keys_only:
+            query_params = get_key_only_params(query_params, partition_key)
+        else:
+            query_params = get_projection_params(query_params, partition_key, fields)
+        page, next_key = query_page(
+            index_name, partition_key, query_params, page_size - len(items), start_key
         )
-        items.extend(response['Items'])
-        iteration = iteration + 1
-    return items
-    
+        items.extend(page)
+        # 只有当前分区读完后才读取更早的月份
+        if next_key:
+            return items, [[partition, next_key]] + positions[index + 1 :]
+        if len(items) >= page_size:
+            return items, positions[index + 1 :]
+    return items, []
+
 
 def full_table_scan(
     index_name,
     partition_key,
     partition_value,
-    page_index,
     page_size,
-    table_name=REPO_CODE_REVIEW_TABLE_NAME,
+    cursor="",
+    page_index=1,
+    fields=[],
 ):
-    # 初始化查询参数
-    query_params = {
-        "KeyConditionExpression": f"#{partition_key} = :value",
-        "ExpressionAttributeNames": {f"#{partition_key}": partition_key},
-        "ExpressionAttributeValues": {":value": {"S": partition_value}},
-        "ScanIndexForward": False,  # 倒序排列
-    }
-    # Initialize filter expression components
-    expression_attribute_names = {}
-    expression_attribute_values = {}
+    """
+    Returns one page of records from the recent year_month partitions, newest first.
 
-    query_params["FilterExpression"] = "NOT commit_id = :commit_id"
-    expression_attribute_values[":commit_id"] = {"S": "00000000"}
-    query_params["ExpressionAttributeValues"].update(expression_attribute_values)
-        
-    index_count = 0
-    items = []
-    print("query parameters is " + str(query_params))
+    Returns:
+    tuple: (items, next_cursor), or (None, "") on error.
+    """
     try:
-        response = DYNAMODB.query(
-            TableName=table_name, IndexName=index_name, **query_params
-        )
-        # 处理查询结果
-        ui_print(response)
-        print("query first response is " + str(response))
-        items.extend(response['Items'])
-        print("start next month query")
-        items.extend(full_scan_next_month(index_name, partition_key, partition_value, query_params))
-        
-        if page_index * page_size <= len(items):
-            items = items[(page_index-1) * page_size : page_index * page_size]
+        if cursor:
+            positions = decode_cursor(cursor, index_name)["positions"]
         else:
-            items = items[(page_index-1) * page_size : ]
-        return items
-        
+            positions = [
+                [partition, None] for partition in get_month_partitions(partition_value)
+            ]
+            if page_index > 1:
+                skip = (page_index - 1) * page_size
+                skipped, positions = query_months_page(
+                    index_name, partition_key, positions, skip, keys_only=True
+                )
+                if len(skipped) < skip:
+                    return [], ""
+        items, positions = query_months_page(
+            index_name, partition_key, positions, page_size, fields=fields
+        )
+        return items, encode_cursor(index_name, positions=positions)
+
+    except ValueError:
+        raise
     except Exception as e:
         ui_print(f"An error occurred: {str(e)}")
-        return None
+        return None, ""
+
+
+def generate_presigned_url(object_key):
+    """
+    Returns a presigned GET URL of a report, reusing the URL signed earlier in
+    this container until it gets close to expiry. A stable URL also lets
+    browsers and proxies serve repeated report loads from their cache.
+    """
+    now = time.time()
+    entry = PRESIGNED_URLS.get(object_key)
+    if entry and entry[0] - now > PRESIGNED_URL_REFRESH:
+        PRESIGNED_URLS.move_to_end(object_key)
+        return entry[1]
+    url = S3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": BUCKET_NAME, "Key": object_key},
+        ExpiresIn=EXPIRES_IN,
+    )
+    PRESIGNED_URLS[object_key] = (now + EXPIRES_IN, url)
+    PRESIGNED_URLS.move_to_end(object_key)
+    while len(PRESIGNED_URLS) > CACHE_SIZE:
+        PRESIGNED_URLS.popitem(last=False)
+    return url
 
 
 def get_presigned_url(file_review_html_key, review_summary_html_key):
@@ -382,17 +708,9 @@ def get_presigned_url(file_review_html_key, review_summary_html_key):
         presigned_url_file_review = ""
         presigned_url_review_summary = ""
         if file_review_html_key:
-            presigned_url_file_review = S3.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": BUCKET_NAME, "Key": file_review_html_key},
-                ExpiresIn=EXPIRES_IN,
-            )  # URL有效期为1小时
+            presigned_url_file_review = generate_presigned_url(file_review_html_key)
         if review_summary_html_key:
-            presigned_url_review_summary = S3.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": BUCKET_NAME, "Key": review_summary_html_key},
-                ExpiresIn=EXPIRES_IN,
-            )  # URL有效期为1小时
+            presigned_url_review_summary = generate_presigned_url(review_summary_html_key)
         if presigned_url_file_review.startswith("https"):
             urls.append(presigned_url_file_review)
         if presigned_url_review_summary.startswith("https"):
@@ -402,6 +720,44 @@ def get_presigned_url(file_review_html_key, review_summary_html_key):
     return urls
 
 
+def get_wait_seconds(body, context=None):
+    """
+    Reads the optional wait_seconds of a getReviewResult request, bounded by
+    MAX_WAIT_SECONDS and the remaining lambda execution time.
+    """
+    wait_seconds = body.get("wait_seconds", 0)
+    is_number = isinstance(wait_seconds, (int, float)) and not isinstance(wait_seconds, bool)
+    if not is_number or wait_seconds < 0:
+        raise ValueError("wait_seconds should be a number not smaller than 0.")
+    wait_seconds = min(wait_seconds, MAX_WAIT_SECONDS)
+    if context:
+        # 预留 2 秒返回结果
+        wait_seconds = min(wait_seconds, context.get_remaining_time_in_millis() / 1000 - 2)
+    return max(wait_seconds, 0)
+
+
+def wait_for_task(review_id, wait_seconds):
+    """
+    Queries the task status until the review is no longer in progress or
+    wait_seconds have passed, backing off between the queries.
+
+    Returns:
+    dict: The last DynamoDB query response, or None on error.
+    """
+    deadline = time.time() + wait_seconds
+    delay = WAIT_INITIAL_DELAY
+    while True:
+        response = query_task_status(review_id)
+        if not response or not response["Items"]:
+            return response
+        task_status = response["Items"][0].get("task_status", {}).get("S")
+        remaining = deadline - time.time()
+        if task_status not in [PROGRESS_STATUS, PROGRESSLLM_STATUS] or remaining <= 0:
+            return response
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, WAIT_MAX_DELAY)
+
+
 def return_review_result(status, review_result=[], message=""):
     current_time = datetime.now()
 
@@ -418,7 +774,7 @@ def return_review_result(status, review_result=[], message=""):
     return res
 
 
-def return_review_records(status, total_records=0, data=[], message=""):
+def return_review_records(status, total_records=0, data=[], message="", next_cursor=""):
     current_time = datetime.now()
     response = {
         "status": status,
@@ -426,18 +782,24 @@ def return_review_records(status, total_records=0, data=[], message=""):
         "timestamp": str(current_time),
         "total_records": total_records,
         "data": data,
+        "next_cursor": next_cursor,
     }
-    res = {"statusCode": 200, "headers": RESPONSE_HEADERS, "body": json.dumps(response)}
-    ui_print(res)
+    body = json.dumps(response, default=json_default)
+    res = {"statusCode": 200, "headers": RESPONSE_HEADERS, "body": body}
+    # 只记录摘要, 不把整页记录写入日志
+    ui_print(
+        f"status: {status}, message: {message}, total_records: {total_records}, "
+        f"items: {len(data)}, bytes: {len(body)}"
+    )
     return res
 
 
-def get_review_result(event):
+def get_review_result(event, context=None):
     try:
         body = json.loads(event["body"])
         ui_print(body)
         review_id = body["review_id"]
-        response = query_task_status(review_id)
+        response = wait_for_task(review_id, get_wait_seconds(body, context))
         size = len(response["Items"])
         if size == 0:
             return return_review_result(
@@ -464,6 +826,15 @@ def get_review_result(event):
                 status="failure",
                 message=f"The task is in progress,Done {file_done},ALL {file_num}",
             )
+        elif task_status == COMPLETED_STATUS and file_num == 0:
+            return return_review_result(status="failure", message=NO_FILE_NEED_REVIEW)
+        elif task_status == FAILED_STATUS:
+            return return_review_result(
+                status="failure",
+                message=request_item.get("error_message", {}).get("S", "The task failed."),
+            )
+        elif task_status == CANCELLED_STATUS:
+            return return_review_result(status="failure", message="The task was cancelled.")
         elif task_status == COMPLETED_STATUS:
             presigned_urls = get_presigned_url(
                 file_review_html_key, review_summary_html_key
@@ -490,14 +861,16 @@ def get_review_records(event):
         body = json.loads(event["body"])
         ui_print(body)  #
 
-        # Validate page index and size
-        page_index = body.get("page_index", 0)
+        # Validate page index and size, page_index is ignored when a cursor is given
+        cursor = body.get("cursor", "")
+        page_index = body.get("page_index", 1 if cursor else 0)
         page_size = body.get("page_size", 0)
         if page_index <= 0 or page_size <= 0:
             return return_review_records(
                 status="failure",
                 message="page_index and page_size should be larger than 0.",
             )
+        fields, response_format = get_response_options(body)
 
         # Extract parameters
         parameters = {
@@ -508,70 +881,74 @@ def get_review_records(event):
             "branch": body.get("branch", ""),
         }
 
-        # Query based on the first non-empty parameter
-        for key, value in parameters.items():
-            print("start query items!")
-            if value:
-                index_name = f"{key.upper()}_INDEX"
+        # Query the most selective GSI, the other parameters become filters
+        plan = plan_query(parameters)
+        if plan:
+            partition_key, partition_value, count = plan
+            index_name = GSI_INDEX_NAMES[f"{partition_key.upper()}_INDEX"]
+            if count is None:
                 count = query_with_count(
-                    GSI_INDEX_NAMES[index_name],
-                    key,
-                    value,
+                    index_name,
+                    partition_key,
+                    partition_value,
                     filter_parameters=parameters,
                 )
-                ui_print(f"total_records :{count}")
-                if count > 0:
-                    last_page_index = max(page_index - 1, 0)
-                    if count <= last_page_index * page_size:
-                        return_review_records(
-                            status="failure",
-                            message="page_index and page_size should be valid.",
-                        )
-                    response = query_with_pagination(
-                        GSI_INDEX_NAMES[index_name],
-                        key,
-                        value,
-                        page_index,
-                        page_size,
-                        filter_parameters=parameters,
-                    )
-                    print("Finish query items!")
-
-                    if response and response.get("Items"):
-                        return return_review_records(
-                            status="success",
-                            total_records=count,
-                            data=response["Items"],
-                        )
-                    break
-                elif count == 0:
-                    return return_review_records(
-                        status="success",
-                        total_records=count,
-                        data=[],
-                    )
-                    break
-                    
-        count = count_items_in_dynamodb('year_month-created_at-index', 'year_month', datetime.now().strftime('%Y-%m'))
-        if count > 0:
-            last_page_index = max(page_index - 1, 0)
-            if count <= last_page_index * page_size:
-                return_review_records(
+            ui_print(f"total_records :{count}")
+            # 过滤查询出错时返回失败, 不能退回到不带过滤条件的当月记录
+            if count is None:
+                return return_review_records(
+                    status="failure",
+                    message="Failed to count the matching code review records.",
+                )
+            if count == 0:
+                return return_review_records(
+                    status="success",
+                    total_records=count,
+                    data=[],
+                )
+            print("start query items!")
+            items, next_cursor = query_with_pagination(
+                index_name,
+                partition_key,
+                partition_value,
+                page_size,
+                cursor=cursor,
+                page_index=page_index,
+                filter_parameters=parameters,
+                fields=fields,
+            )
+            print("Finish query items!")
+            if items is None:
+                return return_review_records(
                     status="failure",
-                    message="page_index and page_size should be valid.",
+                    message="Failed to query the matching code review records.",
                 )
+            return return_review_records(
+                status="success",
+                total_records=count,
+                data=format_items(items, fields, response_format),
+                next_cursor=next_cursor,
+            )
+
+        count = count_recent_records(datetime.now().strftime('%Y-%m'))
+        if count:
             print("start full scan!")
-            page_items = full_table_scan(
+            page_items, next_cursor = full_table_scan(
                 'year_month-created_at-index',
                 'year_month',
                 datetime.now().strftime('%Y-%m'),
+                page_size,
+                cursor=cursor,
                 page_index=page_index,
-                page_size=page_size,
+                fields=fields,
             )
+            if page_items is None:
+                page_items = []
             return return_review_records(
                 status="success",
                 total_records=count,
-                data=page_items,
+                data=format_items(page_items, fields, response_format),
+                next_cursor=next_cursor,
             )
 
         # If no valid response or parameters were empty
@@ -589,9 +966,11 @@ def lambda_handler(event, context):
     ui_print(event)
     path = event["path"]
     if path == "/getReviewResult":
-        return get_review_result(event)
+        return cached_response(
+            event, lambda event: get_review_result(event, context), get_cache_ttl
+        )
     elif path == "/getReviewRecords":
-        return get_review_records(event)
+        return cached_response(event, get_review_records, get_cache_ttl)
     else:
         res = {
             "statusCode": 404,
@@ -3,21 +3,44 @@ import boto3
 import os
 import re
 from datetime import datetime, timedelta
-import gitlab
 import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
 
+from codereview_common.callback import resolve_callback_address
+from codereview_common.clients import LazyClient
 
-DYNAMODB = boto3.resource("dynamodb")
-LAMBDA_CLIENT = boto3.client("lambda")
+DYNAMODB = LazyClient(lambda: boto3.resource("dynamodb"))
+LAMBDA_CLIENT = LazyClient(lambda: boto3.client("lambda"))
 REPO_CODE_REVIEW_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_TABLE_NAME")
-REPO_CODE_REVIEW_TABLE = DYNAMODB.Table(REPO_CODE_REVIEW_TABLE_NAME)
+REPO_CODE_REVIEW_TABLE = LazyClient(lambda: DYNAMODB.Table(REPO_CODE_REVIEW_TABLE_NAME))
 
 SPLIT_TASK_LAMBDA_NAME = os.getenv("SPLIT_TASK_LAMBDA_NAME")
 CODE_REVIEW_WHITE_LIST = os.getenv("CODE_REVIEW_WHITE_LIST", ".py:.go:.cpp:.ts")
 COMPLETED_STATUS = "Completed"
+PROGRESS_STATUS = "InProgress"
+PROGRESSLLM_STATUS = "InProgress LLM"
+FAILED_STATUS = "Failed"
+CANCELLED_STATUS = "Cancelled"
+# 已在进行或已完成的任务, 重复提交时不再审查
+ACTIVE_STATUSES = [PROGRESS_STATUS, PROGRESSLLM_STATUS, COMPLETED_STATUS]
+DUPLICATE_PROJECTION = "review_id, task_status, file_num, file_done, created_at"
+# /codereview/batch limits
+BATCH_PATH = "/codereview/batch"
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "100"))
+BATCH_INVOKE_WORKERS = int(os.getenv("BATCH_INVOKE_WORKERS", "8"))
+# BatchGetItem reads at most 100 keys per call
+BATCH_GET_SIZE = 100
+# request fields a batch may set once for all of its requests
+BATCH_SHARED_FIELDS = ["repo_url", "access_token", "branch", "scan_scope", "callback_url", "force"]
+CANCEL_PATH = "/cancelReview"
 LAMBDA_LOG_BUCKET_NAME = os.getenv("LAMBDA_LOG_BUCKET_NAME")
-S3 = boto3.client("s3")
+S3 = LazyClient(lambda: boto3.client("s3"))
+# optional comma separated hosts that callback_url may point to, any public host when empty
+CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
 
 logging.basicConfig(
     force=True,
@@ -118,15 +141,160 @@ def contains_extension(changes):
     return False
 
 
+def check_callback_url(callback_url):
+    """
+    检查完成通知地址是否有效。review_notifier 发送通知时重新解析并检查，
+    并直接连接检查过的地址。
+
+    Parameters:
+    callback_url (str): 任务完成后接收 POST 通知的地址。
+
+    Returns:
+    bool: http/https 地址且 host 在 CALLBACK_ALLOWED_HOSTS 中返回True；未配置
+    CALLBACK_ALLOWED_HOSTS 时 host 解析出的地址必须全部是公网地址（拒绝私有、
+    回环、链路本地如 169.254.169.254 等地址）。
+    """
+    return resolve_callback_address(callback_url, CALLBACK_ALLOWED_HOSTS) is not None
+
+
 def insert_dynamodb(item):
     try:
         # 尝试向DynamoDB表中插入项目
         response = REPO_CODE_REVIEW_TABLE.put_item(Item=item)
         return response
     except Exception as e:
-        # 捕获其他可能的异常
+        # 写入失败时不能调用 split_task, 由调用方返回 failure
         ui_print(f"An unexpected error occurred: {str(e)}")
+        raise
+
+
+def admit_request_item(item, force=False):
+    """
+    Inserts the request item unless a review with the same review_id is
+    already in progress or completed, e.g. when CI retries submit a commit twice.
+
+    Parameters:
+    item (dict): The request item.
+    force (bool): Overwrite the existing review and run it again.
+
+    Returns:
+    dict: The existing review item when the request is a duplicate, otherwise None.
+    Errors other than a failed condition are raised, the review was not written
+    and must not be started.
+    """
+    if force:
+        insert_dynamodb(item)
         return None
+    try:
+        REPO_CODE_REVIEW_TABLE.put_item(
+            Item=item,
+            ConditionExpression="attribute_not_exists(review_id) OR NOT task_status IN (:p, :l, :c)",
+            ExpressionAttributeValues={
+                ":p": PROGRESS_STATUS,
+                ":l": PROGRESSLLM_STATUS,
+                ":c": COMPLETED_STATUS,
+            },
+        )
+        return None
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            ui_print(f"An unexpected error occurred: {str(e)}")
+            raise
+    response = REPO_CODE_REVIEW_TABLE.get_item(
+        Key={"review_id": item["review_id"]},
+        ProjectionExpression=DUPLICATE_PROJECTION,
+    )
+    return response.get("Item")
+
+
+def get_existing_items(review_ids):
+    """
+    Reads the status of already submitted reviews with BatchGetItem.
+
+    Parameters:
+    review_ids (list): The review ids of a batch.
+
+    Returns:
+    dict: review_id -> existing item.
+    """
+    existing_items = {}
+    for i in range(0, len(review_ids), BATCH_GET_SIZE):
+        request_items = {
+            REPO_CODE_REVIEW_TABLE_NAME: {
+                "Keys": [{"review_id": review_id} for review_id in review_ids[i : i + BATCH_GET_SIZE]],
+                "ProjectionExpression": DUPLICATE_PROJECTION,
+            }
+        }
+        while request_items:
+            response = DYNAMODB.batch_get_item(RequestItems=request_items)
+            for item in response["Responses"].get(REPO_CODE_REVIEW_TABLE_NAME, []):
+                existing_items[item["review_id"]] = item
+            request_items = response.get("UnprocessedKeys")
+    return existing_items
+
+
+def admit_batch_items(requests):
+    """
+    Batch version of admit_request_item: reviews already in progress or
+    completed are skipped unless their request sets force, the others are
+    written with BatchWriteItem.
+
+    BatchWriteItem has no condition expression, so two batches racing on
+    the same review_id may both admit it; the single submit keeps the
+    conditional put.
+
+    Parameters:
+    requests (list): Requests built by prepare_request, with unique review ids.
+
+    Returns:
+    dict: review_id -> existing item of the duplicate requests.
+    """
+    checked_ids = [request["review_id"] for request in requests if not request["force"]]
+    duplicates = {
+        review_id: item
+        for review_id, item in get_existing_items(checked_ids).items()
+        if item.get("task_status") in ACTIVE_STATUSES
+    }
+    # batch_writer 按 25 条分批写入并重试 UnprocessedItems
+    with REPO_CODE_REVIEW_TABLE.batch_writer() as writer:
+        for request in requests:
+            if request["review_id"] not in duplicates:
+                writer.put_item(Item=request["item"])
+    return duplicates
+
+
+def fail_request_item(review_id, error_message):
+    # split_task 调用失败时结束任务, 以便重新提交
+    REPO_CODE_REVIEW_TABLE.update_item(
+        Key={"review_id": review_id},
+        UpdateExpression="set task_status = :s, update_at = :t, error_message = :e",
+        ExpressionAttributeValues={
+            ":s": FAILED_STATUS,
+            ":t": str(datetime.now()),
+            ":e": error_message,
+        },
+    )
+
+
+def mark_duplicate(result, existing_item):
+    # 重复提交: 返回已有任务的 review_id 与状态, 不重新审查
+    task_status = existing_item.get("task_status", "")
+    state = "completed" if task_status == COMPLETED_STATUS else "in progress"
+    result.update(
+        {
+            "duplicate": True,
+            "task_status": task_status,
+            "created_at": existing_item.get("created_at", ""),
+            "error_message": f"The review is already {state}, set force to run it again",
+        }
+    )
+    return result
+
+
+def return_duplicate(result, existing_item):
+    res = {"statusCode": 200, "body": json.dumps(mark_duplicate(result, existing_item), default=str)}
+    ui_print(res)
+    return res
 
 
 def retrun_data(status, message):
@@ -158,8 +326,9 @@ def get_request_item(
     task_status="InProgress",
     file_num=0,
     file_done=0,
+    callback_url="",
 ):
-    return {
+    item = {
         "review_id": review_id,
         "repo_url": repo_url,
         "commit_id": commit_id,
@@ -167,6 +336,8 @@ def get_request_item(
         "scan_scope": scan_scope,
         "project": project,
         "branch": branch,
+        # 组合分区键, 供 project_branch_created_at_gsi 使用
+        "project_branch": f"{project}#{branch}",
         "file_num": file_num,
         "file_done": file_done,
         "task_status": task_status,
@@ -176,133 +347,311 @@ def get_request_item(
         "update_at": str(current_time),
         "year_month": str(current_time.strftime('%Y-%m')),
     }
-    
-def check_changes_files(changes):
-    files = []
-    for change in changes:
-        files.append(change["new_path"])
-    return files
+    # 只有设置了回调地址的任务才会被 review_notifier 处理
+    if callback_url:
+        item["callback_url"] = callback_url
+    return item
 
 
-def lambda_handler(event, context):
+def prepare_request(body, current_time):
+    """
+    Validates one review request and builds its DynamoDB item and split_task payload.
+
+    Parameters:
+    body (dict): The request body of /codereview, or one request of a batch.
+    current_time (datetime): The submit time.
+
+    Returns:
+    tuple: (request, message). request is None and message the reason when the
+    request is invalid. A request without reviewable files gets a Completed
+    item, no payload and the message "No file need review".
+    """
+    # get parameter from request
+    repo_url = body["repo_url"]
+    project_idorpath = body["project"]
+    access_token = body["access_token"]
+    scan_scope = "DIFF"
+    branch = "main"
+
+    # check commitid and filelist
+    if "commitid" in body:
+        commit_id = body["commitid"]
+    else:
+        commit_id = "00000000"
+    if "filelist" in body:
+        file_list = list(body["filelist"])
+    else:
+        file_list = []
+
+    if "branch" in body:
+        branch = str(body["branch"])
+    if "scan_scope" in body:
+        scan_scope = str(body["scan_scope"])
+    force = body.get("force", False) is True
+    callback_url = str(body.get("callback_url", ""))
+    if callback_url and not check_callback_url(callback_url):
+        return None, "callback_url is invalid"
+
+    review_id = generate_unique_key(
+        repo_url, commit_id, file_list, scan_scope, project_idorpath, branch
+    )
+
+    result = {
+        "status": "success",
+        "error_message": "",
+        "review_id": review_id,
+        "repo_url": repo_url,
+        "commitid": commit_id,
+        "file_list": file_list,
+        "scan_scope": scan_scope,
+        "project": project_idorpath,
+        "branch": branch,
+        "timestamp": str(current_time),
+        "duplicate": False,
+    }
+    request = {
+        "review_id": review_id,
+        "force": force,
+        "result": result,
+        "payload": None,
+        "message": "",
+    }
+
+    # validate the request, the diff is fetched by split_task
+    if scan_scope == "DIFF":
+        if commit_id == "00000000" and file_list != []:
+            return None, "DIFF must insert commit_id"
+        if (commit_id == "00000000" and file_list == []) or (
+            file_list != [] and contains_extension(file_list) == False
+        ):
+            request["item"] = get_request_item(
+                review_id,
+                repo_url,
+                commit_id,
+                file_list,
+                scan_scope,
+                project_idorpath,
+                branch,
+                current_time,
+                task_status=COMPLETED_STATUS,
+                callback_url=callback_url,
+            )
+            request["message"] = "No file need review"
+            return request, ""
+
+    request["item"] = get_request_item(
+        review_id,
+        repo_url,
+        commit_id,
+        file_list,
+        scan_scope,
+        project_idorpath,
+        branch,
+        current_time,
+        callback_url=callback_url,
+    )
+    # 定义要传递给第二个Lambda函数的参数
+    request["payload"] = {
+        "review_id": review_id,
+        "private_token": access_token,
+        "project_idorpath": project_idorpath,
+        "repo_url": repo_url,
+        "commit_id": commit_id,
+        "file_list": file_list,
+        "scan_scope": scan_scope,
+        "branch": branch,
+        # 每次提交 (包括 force 重跑) 的 created_at 不同, 用于区分同一 review_id 的多次运行
+        "run_id": request["item"]["created_at"],
+    }
+    return request, ""
+
+
+def invoke_split_task(payload):
+    # 调用第二个Lambda函数
+    LAMBDA_CLIENT.invoke(
+        FunctionName=SPLIT_TASK_LAMBDA_NAME,
+        InvocationType="Event",  # 使用'Event'进行异步调用
+        Payload=json.dumps(payload),
+    )
+
+
+def post_code_review(event):
     body = json.loads(event["body"])
     ui_print(body)
-    # 1.get var
     try:
-        # get parameter from request    
-        repo_url = body["repo_url"]
-        project_idorpath = body["project"]
-        access_token = body["access_token"]
-        scan_scope = "DIFF"
-        branch = "main"
-        
-        # check commitid and filelist
-        if "commitid" in body:
-            commit_id = body["commitid"]
-        else:
-            commit_id = "00000000"
-        if "filelist" in body:
-            file_list = list(body["filelist"])
-        else:
-            file_list = []
-        
-        if "branch" in body:
-            branch = str(body["branch"])
-        if "scan_scope" in body:
-            scan_scope = str(body["scan_scope"])
-        current_time = datetime.now()
-
-        review_id = generate_unique_key(
-            repo_url, commit_id, file_list, scan_scope, project_idorpath, branch
-        )
-            
-        result = {
-            "status": "success",
-            "error_message": "",
-            "review_id": review_id,
-            "repo_url": repo_url,
-            "commitid": commit_id,
-            "file_list": file_list,
-            "scan_scope": scan_scope,
-            "project": project_idorpath,
-            "branch": branch,
-            "timestamp": str(current_time),
-        }
-
-        # 2.get diff and insert into sqs todo
-        private_token = access_token
-        if not repo_url:
-            gl = gitlab.Gitlab(private_token=private_token)
-        else:
-            gl = gitlab.Gitlab(repo_url, private_token=private_token)
-        project = gl.projects.get(project_idorpath)
+        # 1. validate the request
+        request, message = prepare_request(body, datetime.now())
+        if request is None:
+            return retrun_data(status="failure", message=message)
+        # 2. Insert dynamodb - request
+        existing_item = admit_request_item(request["item"], request["force"])
+        if existing_item:
+            return return_duplicate(request["result"], existing_item)
+        if request["payload"] is None:
+            return retrun_data(status="failure", message=request["message"])
+        # 3. split the task asynchronously
         try:
-            change_files = []
-            if scan_scope == "DIFF":
-                if commit_id != "00000000" and file_list != []:
-                    commit = project.commits.get(commit_id)
-                    changes = commit.diff(get_all=True, all=True)
-                    change_files = list(set(check_changes_files(changes)) & set(file_list))
-                    print("change file is: " + str(change_files))
-                elif commit_id == "00000000" and file_list != []:
-                    return retrun_data(status="failure", message="DIFF must insert commit_id")
-                elif commit_id != "00000000" and file_list == []:
-                    commit = project.commits.get(commit_id)
-                    changes = commit.diff(get_all=True, all=True)
-                    change_files = check_changes_files(changes)
-                    
-                if contains_extension(change_files) == False:
-                    request_item = get_request_item(
-                        review_id,
-                        repo_url,
-                        commit_id,
-                        file_list,
-                        scan_scope,
-                        project_idorpath,
-                        branch,
-                        current_time,
-                        task_status=COMPLETED_STATUS,
-                    )
-                    insert_dynamodb(request_item)
-                    return retrun_data(status="failure", message="No file need review")
+            invoke_split_task(request["payload"])
         except Exception as e:
-            ui_print(str(e))
-            return retrun_data(status="failure", message=str(e))
-        # 3. Insert dynamodb - request]
-        request_item = get_request_item(
-            review_id,
-            repo_url,
-            commit_id,
-            file_list,
-            scan_scope,
-            project_idorpath,
-            branch,
-            current_time,
+            fail_request_item(request["review_id"], str(e))
+            raise
+    except Exception as e:
+        ui_print(str(e))
+        return retrun_data(status="failure", message=str(e))
+    res = {"statusCode": 200, "body": json.dumps(request["result"])}
+    ui_print(res)
+    return res
+
+
+def batch_fan_out(request):
+    try:
+        invoke_split_task(request["payload"])
+    except Exception as e:
+        ui_print(f"invoke split_task for {request['review_id']} failed: {e}")
+        fail_request_item(request["review_id"], str(e))
+        request["result"].update({"status": "failure", "error_message": str(e)})
+
+
+def post_code_review_batch(event):
+    """
+    Handles /codereview/batch: admits up to BATCH_MAX_REQUESTS review
+    requests with BatchWriteItem and invokes split_task for each of them.
+
+    Request body:
+    requests (list): /codereview request bodies.
+    repo_url, access_token, branch, scan_scope, callback_url, force: optional
+    defaults for the requests that do not set them.
+
+    Returns:
+    dict: results, one per request in order, with the review_id or the
+    failure message of each request.
+    """
+    body = json.loads(event["body"])
+    requests = body.get("requests")
+    if not isinstance(requests, list) or not requests:
+        return retrun_data(status="failure", message="requests must be a non-empty list")
+    if len(requests) > BATCH_MAX_REQUESTS:
+        return retrun_data(
+            status="failure", message=f"At most {BATCH_MAX_REQUESTS} requests per batch"
         )
-        insert_dynamodb(request_item)
-        
-        # 定义要传递给第二个Lambda函数的参数
-        payload = {
-            "review_id": review_id,
-            "private_token": private_token,
-            "project_idorpath": project_idorpath,
-            "repo_url": repo_url,
-            "commit_id": commit_id,
-            "file_list": file_list,
-            "scan_scope": scan_scope,
-            "branch": branch,
-        }
+    ui_print(f"batch of {len(requests)} requests")
+    shared = {key: body[key] for key in BATCH_SHARED_FIELDS if key in body}
+    current_time = datetime.now()
+    try:
+        # 1. validate the requests, the same review_id is admitted once
+        results = []
+        admitted = {}
+        for request_body in requests:
+            try:
+                request, message = prepare_request(dict(shared, **request_body), current_time)
+            except Exception as e:
+                request, message = None, f"invalid request: {e}"
+            if request is None:
+                results.append({"status": "failure", "error_message": message})
+            elif request["review_id"] in admitted:
+                result = dict(request["result"], duplicate=True)
+                result["error_message"] = "The review is already in this batch"
+                results.append(result)
+            else:
+                admitted[request["review_id"]] = request
+                results.append(request["result"])
+
+        # 2. Insert dynamodb - requests
+        duplicates = admit_batch_items(list(admitted.values()))
+        fan_out = []
+        for review_id, request in admitted.items():
+            if review_id in duplicates:
+                mark_duplicate(request["result"], duplicates[review_id])
+            elif request["payload"] is None:
+                request["result"].update({"status": "failure", "error_message": request["message"]})
+            else:
+                fan_out.append(request)
+
+        # 3. split the tasks asynchronously
+        with ThreadPoolExecutor(max_workers=BATCH_INVOKE_WORKERS) as executor:
+            list(executor.map(batch_fan_out, fan_out))
+    except Exception as e:
+        ui_print(str(e))
+        return retrun_data(status="failure", message=str(e))
+    response = {
+        "status": "success",
+        "timestamp": str(current_time),
+        "submitted": len(fan_out),
+        "results": results,
+    }
+    res = {"statusCode": 200, "body": json.dumps(response, default=str)}
+    ui_print(f"batch submitted {len(fan_out)} of {len(requests)} requests")
+    return res
+
+
+def cancel_review_item(review_id):
+    """
+    Marks an in progress review as cancelled. split_task stops at its next
+    checkpoint and code_review drops the queued messages of the review.
+
+    Parameters:
+    review_id (str): The review to cancel.
 
-        # 调用第二个Lambda函数
-        LAMBDA_CLIENT.invoke(
-            FunctionName=SPLIT_TASK_LAMBDA_NAME,
-            InvocationType="Event",  # 使用'Event'进行异步调用
-            Payload=json.dumps(payload),
+    Returns:
+    dict: None if the review was cancelled, otherwise the current review item
+    (empty when the review does not exist).
+    """
+    current_time = str(datetime.now())
+    try:
+        REPO_CODE_REVIEW_TABLE.update_item(
+            Key={"review_id": review_id},
+            UpdateExpression="set task_status = :x, cancelled_at = :t, update_at = :t",
+            ConditionExpression="task_status IN (:p, :l)",
+            ExpressionAttributeValues={
+                ":x": CANCELLED_STATUS,
+                ":t": current_time,
+                ":p": PROGRESS_STATUS,
+                ":l": PROGRESSLLM_STATUS,
+            },
         )
+        return None
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+    response = REPO_CODE_REVIEW_TABLE.get_item(
+        Key={"review_id": review_id},
+        ProjectionExpression="review_id, task_status",
+    )
+    return response.get("Item", {})
+
 
+def cancel_review(event):
+    body = json.loads(event["body"])
+    ui_print(body)
+    review_id = body.get("review_id")
+    if not isinstance(review_id, str) or not review_id:
+        return retrun_data(status="failure", message="review_id is required")
+    try:
+        existing_item = cancel_review_item(review_id)
     except Exception as e:
         ui_print(str(e))
         return retrun_data(status="failure", message=str(e))
-    res = {"statusCode": 200, "body": json.dumps(result)}
-    ui_print(res)
-    return res
+    if existing_item is None:
+        response = {
+            "status": "success",
+            "timestamp": str(datetime.now()),
+            "review_id": review_id,
+            "task_status": CANCELLED_STATUS,
+        }
+        res = {"statusCode": 200, "body": json.dumps(response)}
+        ui_print(res)
+        return res
+    if not existing_item:
+        return retrun_data(status="failure", message=f"No review {review_id}")
+    return retrun_data(
+        status="failure",
+        message=f"The review is {existing_item.get('task_status', '')}, only reviews in progress can be cancelled",
+    )
+
+
+def lambda_handler(event, context):
+    if event.get("path") == BATCH_PATH:
+        return post_code_review_batch(event)
+    if event.get("path") == CANCEL_PATH:
+        return cancel_review(event)
+    return post_code_review(event)
@@ -1,38 +1,78 @@
 import boto3
+import hashlib
 import logging
 import os
 import json
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from jinja2 import Template, Environment, select_autoescape
 from botocore.config import Config
-from botocore.exceptions import NoCredentialsError, ClientError
+from botocore.exceptions import ClientError
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from pygments import highlight
-from pygments.lexers import get_lexer_for_filename
-from pygments.formatters import HtmlFormatter
 from boto3.dynamodb.conditions import Key
 import re
 
+from codereview_common.clients import LazyClient
+from codereview_common.tracing import TRACE, trace_count, trace_emit, trace_reset, trace_span, traced
 
-BEDROCK = boto3.client(service_name="bedrock-runtime")
+BEDROCK = LazyClient(lambda: boto3.client(service_name="bedrock-runtime"))
 LAMBDA_LOG_BUCKET_NAME = os.getenv("LAMBDA_LOG_BUCKET_NAME")
 client_config = Config(max_pool_connections=50)
-S3 = boto3.client("s3", config=client_config)
-SQS = boto3.client("sqs")
-DYNAMODB = boto3.resource("dynamodb")
+S3 = LazyClient(lambda: boto3.client("s3", config=client_config))
+SQS = LazyClient(lambda: boto3.client("sqs"))
+DYNAMODB = LazyClient(lambda: boto3.resource("dynamodb"))
 REPO_CODE_REVIEW_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_TABLE_NAME")
-REPO_CODE_REVIEW_TABLE = DYNAMODB.Table(REPO_CODE_REVIEW_TABLE_NAME)
+REPO_CODE_REVIEW_TABLE = LazyClient(lambda: DYNAMODB.Table(REPO_CODE_REVIEW_TABLE_NAME))
 REPO_CODE_REVIEW_SCORE_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_SCORE_TABLE_NAME")
-REPO_CODE_REVIEW_SCORE_TABLE = DYNAMODB.Table(REPO_CODE_REVIEW_SCORE_TABLE_NAME)
+REPO_CODE_REVIEW_SCORE_TABLE = LazyClient(
+    lambda: DYNAMODB.Table(REPO_CODE_REVIEW_SCORE_TABLE_NAME)
+)
+# 每个任务每个文件一条记录, 重复投递的消息在调用 Bedrock 前被识别
+REPO_CODE_REVIEW_FILE_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_FILE_TABLE_NAME")
+FILE_RECORD_TTL = int(os.getenv("FILE_RECORD_TTL", str(7 * 24 * 3600)))
+FILE_REVIEWING = "reviewing"
+FILE_DONE = "done"
+FILE_FAILED = "failed"
 BEDROCK_ERROR_MSG = "An error occurred: in invoke bedrock."
 TASK_SQS_URL = os.getenv("TASK_SQS_URL")
+# DIFF 审查与汇总消息走低延迟队列, 不排在大型全量扫描之后
+INTERACTIVE_SQS_URL = os.getenv("INTERACTIVE_SQS_URL") or TASK_SQS_URL
+# 合并与汇总由独立的函数消费各自的队列, 不占用文件审查的并发
+MERGE_SQS_URL = os.getenv("MERGE_SQS_URL") or INTERACTIVE_SQS_URL
+SUMMARY_SQS_URL = os.getenv("SUMMARY_SQS_URL") or INTERACTIVE_SQS_URL
 ALL_SCAN_SCOPE = "ALL"
 File_REVIEW = "file review"
 REVIEW_SUMMARY = "review summary"
+# sent by split_task when every file was reviewed before the split was sealed
+MERGE_CHECK = "merge check"
+# 合并认领超过该秒数 (review_merge 的超时) 仍未完成时视为已崩溃, 重新投递的消息可以接管
+MERGE_CLAIM_TIMEOUT = int(os.getenv("MERGE_CLAIM_TIMEOUT", "900"))
 HTML_GEN_ERROR = "An error occurred in generating html"
 HTML_POSTFIX = "merged-code-review-result.html"
 SUMMARY_HTML_POSTFIX = "summary-review-result.html"
+# 报告对象名带内容哈希时内容不会再变化, 可以被浏览器和代理长期缓存
+REPORT_IMMUTABLE_KEYS = os.getenv("REPORT_IMMUTABLE_KEYS", "false").lower() == "true"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 COMPLETED_STATUS = "Completed"
+CANCELLED_STATUS = "Cancelled"
+FAILED_STATUS = "Failed"
+PROGRESS_STATUS = "InProgress"
+LLM_STATUS = "InProgress LLM"
+# 所有文件都最终失败时写入任务的 error_message
+ALL_FILES_FAILED = "Every file of the review failed, see the review_dlq triage"
+# 取消状态在容器内缓存的秒数, 取消后最迟这么久开始丢弃该任务的消息
+CANCEL_CHECK_TTL = float(os.getenv("CANCEL_CHECK_TTL", "5"))
+CANCEL_CACHE_SIZE = 1024
+CANCEL_CACHE = {}
+# 处理中的消息每 HEARTBEAT_INTERVAL 秒把可见性超时延长到 HEARTBEAT_VISIBILITY 秒,
+# Lambda 崩溃或超时后消息最迟 HEARTBEAT_VISIBILITY 秒重新可见
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "60"))
+HEARTBEAT_VISIBILITY = int(os.getenv("HEARTBEAT_VISIBILITY", "300"))
+# SQS 可见性超时上限 12 小时
+MAX_VISIBILITY_TIMEOUT = 43200
+# 最近一次 Bedrock 调用失败的错误类型, 记录到文件记录中供死信分析
+LAST_BEDROCK_ERROR = {}
 
 NO_FILE_NEED_REVIEW = "No file need review"
 
@@ -61,6 +101,16 @@ def ui_print(log, lambda_name="lambda_code_review"):
     )
 
 
+def file_size_bucket(size):
+    if size < 4 * 1024:
+        return "<4KB"
+    if size < 16 * 1024:
+        return "4-16KB"
+    if size < 64 * 1024:
+        return "16-64KB"
+    return ">=64KB"
+
+
 def extract_tags(text):
     try:
         score_pattern = re.compile(r"<review_score>(.*?)</review_score>", re.DOTALL)
@@ -107,6 +157,7 @@ def get_request_item(
     }
 
 
+@traced(group="dynamodb")
 def insert_dynamodb_v0(item):
     try:
         REPO_CODE_REVIEW_SCORE_TABLE.update_item(
@@ -119,6 +170,7 @@ def insert_dynamodb_v0(item):
         ui_print(f"An error occurred: {e}")
         
 
+@traced(group="dynamodb")
 def insert_dynamodb(item):
     try:
         # 尝试向DynamoDB表中插入项目
@@ -130,6 +182,7 @@ def insert_dynamodb(item):
         return None
 
 
+@traced(group="dynamodb")
 def update_dynamodb_version(item):
     try:
         REPO_CODE_REVIEW_SCORE_TABLE.update_item(
@@ -143,6 +196,7 @@ def update_dynamodb_version(item):
         ui_print(f"An error occurred: {e}")
         
 
+@traced(group="dynamodb")
 def update_dynamodb_only_version(item):
     try:
         REPO_CODE_REVIEW_SCORE_TABLE.update_item(
@@ -156,6 +210,7 @@ def update_dynamodb_only_version(item):
         ui_print(f"An error occurred: {e}")
 
 
+@traced(group="dynamodb")
 def get_file_status_recode(project_branch_file, version):
     try:
         print("Start query: " + project_branch_file)
@@ -172,30 +227,202 @@ def get_file_status_recode(project_branch_file, version):
         return None
 
 
-def update_dynamodb_file_num(review_id):
+def get_file_key(msg_body):
+    """
+    Sort key of the file record: the file name and a hash of what is
+    reviewed and of the run, so a changed file in the same review is not
+    mistaken for a duplicate and a rerun (force, or a resubmit after
+    Failed/Cancelled) does not find the records of the previous run done.
+    """
+    content = msg_body.get("file_content", "") + msg_body.get("diff", "") + msg_body.get("prompt_key", "")
+    content += msg_body.get("run_id", "")
+    return f"{msg_body['file_name']}#{hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]}"
+
+
+def is_conditional_failure(e):
+    return isinstance(e, ClientError) and e.response["Error"]["Code"] in [
+        "ConditionalCheckFailedException",
+        "TransactionCanceledException",
+    ]
+
+
+@traced(group="dynamodb")
+def claim_file(review_id, file_key, message_id):
+    """
+    Claims a file of a review for one SQS message before calling Bedrock.
+    Redeliveries of the claiming message (after a failure or a crash) claim
+    it again, other copies of the message and files already done do not.
+
+    Returns:
+    bool: True if this message should review the file.
+    """
+    now = datetime.now()
     try:
-        REPO_CODE_REVIEW_TABLE.update_item(
-            Key={"review_id": review_id},
-            UpdateExpression="set file_num = file_num - :s, update_at = :t",
-            ExpressionAttributeValues={":s": 1, ":t": str(datetime.now())},
-            ReturnValues="ALL_NEW",
+        DYNAMODB.meta.client.update_item(
+            TableName=REPO_CODE_REVIEW_FILE_TABLE_NAME,
+            Key={"review_id": review_id, "file_key": file_key},
+            UpdateExpression="set file_status = :r, message_id = :m, claimed_at = :t, expires_at = :e",
+            ConditionExpression="attribute_not_exists(review_id) OR (file_status <> :d AND (message_id = :m OR file_status = :f))",
+            ExpressionAttributeValues={
+                ":r": FILE_REVIEWING,
+                ":m": message_id,
+                ":t": str(now),
+                ":e": int(now.timestamp()) + FILE_RECORD_TTL,
+                ":d": FILE_DONE,
+                ":f": FILE_FAILED,
+            },
+        )
+        return True
+    except ClientError as e:
+        if not is_conditional_failure(e):
+            raise
+        return False
+
+
+def finish_file_transaction(
+    review_id, file_key, message_id, file_status, request_update=None, run_id=""
+):
+    """
+    Sets the final status of a claimed file and, in the same transaction,
+    updates the counters of the review, so they change once per file. The
+    resource client serializes the Python values like Table.update_item.
+
+    Parameters:
+    run_id (str): created_at of the run the message belongs to, the
+    counters of a later run of the review are not updated.
+
+    Returns:
+    bool: False if the file is no longer claimed by this message or the
+    message belongs to an earlier run.
+    """
+    items = [
+        {
+            "Update": {
+                "TableName": REPO_CODE_REVIEW_FILE_TABLE_NAME,
+                "Key": {"review_id": review_id, "file_key": file_key},
+                "UpdateExpression": "set file_status = :s, finished_at = :t remove replayed_at",
+                "ConditionExpression": "message_id = :m AND file_status = :r",
+                "ExpressionAttributeValues": {
+                    ":s": file_status,
+                    ":t": str(datetime.now()),
+                    ":m": message_id,
+                    ":r": FILE_REVIEWING,
+                },
+            }
+        }
+    ]
+    if request_update:
+        request_item = {
+            "TableName": REPO_CODE_REVIEW_TABLE_NAME,
+            "Key": {"review_id": review_id},
+            "UpdateExpression": request_update + ", update_at = :t",
+            "ExpressionAttributeValues": {
+                ":s": 1,
+                ":t": str(datetime.now()),
+            },
+        }
+        if run_id:
+            request_item["ConditionExpression"] = "created_at = :c"
+            request_item["ExpressionAttributeValues"][":c"] = run_id
+        items.append({"Update": request_item})
+    try:
+        DYNAMODB.meta.client.transact_write_items(TransactItems=items)
+        return True
+    except ClientError as e:
+        if not is_conditional_failure(e):
+            raise
+        return False
+
+
+def get_error_class(e):
+    # botocore 错误使用错误码 (如 ThrottlingException), 其他异常使用类名
+    if isinstance(e, ClientError):
+        return e.response["Error"]["Code"]
+    return type(e).__name__
+
+
+@traced(group="dynamodb")
+def record_file_error(review_id, file_key, message_id, error):
+    """
+    Keeps the error class and message of the latest failed attempt on the
+    file record, for the dead-letter triage of review_dlq.
+    """
+    try:
+        DYNAMODB.meta.client.update_item(
+            TableName=REPO_CODE_REVIEW_FILE_TABLE_NAME,
+            Key={"review_id": review_id, "file_key": file_key},
+            UpdateExpression="set error_class = :c, error_message = :e, failed_at = :t add failures :n",
+            ConditionExpression="message_id = :m",
+            ExpressionAttributeValues={
+                ":c": error["error_class"],
+                ":e": error["error_message"][:1000],
+                ":t": str(datetime.now()),
+                ":n": 1,
+                ":m": message_id,
+            },
         )
     except Exception as e:
         ui_print(f"An error occurred: {e}")
 
 
-def update_dynamodb_done_file(review_id):
+@traced(group="dynamodb")
+def update_dynamodb_file_num(review_id, file_key, message_id, run_id=""):
+    # 放弃该文件: file_num 减一, 重放死信队列中的消息时可以重新认领
     try:
-        REPO_CODE_REVIEW_TABLE.update_item(
-            Key={"review_id": review_id},
-            UpdateExpression="set file_done = file_done + :s, update_at = :t",
-            ExpressionAttributeValues={":s": 1, ":t": str(datetime.now())},
-            ReturnValues="ALL_NEW",
+        abandoned = finish_file_transaction(
+            review_id, file_key, message_id, FILE_FAILED, "set file_num = file_num - :s", run_id
         )
+        if abandoned:
+            fail_review_without_files(review_id, run_id)
+        return abandoned
     except Exception as e:
         ui_print(f"An error occurred: {e}")
+        return False
 
 
+def fail_review_without_files(review_id, run_id=""):
+    """
+    Marks a sealed review Failed once its last file was abandoned: with
+    file_num at 0 no merge check ever fires. split_task does the same when
+    it seals a review whose files all failed before the seal.
+    """
+    condition = (
+        "file_num = :z AND task_status IN (:p, :l) "
+        "AND (attribute_not_exists(split_sealed) OR split_sealed = :d)"
+    )
+    values = {
+        ":s": FAILED_STATUS,
+        ":e": ALL_FILES_FAILED,
+        ":t": str(datetime.now()),
+        ":z": 0,
+        ":p": PROGRESS_STATUS,
+        ":l": LLM_STATUS,
+        ":d": True,
+    }
+    if run_id:
+        condition += " AND created_at = :c"
+        values[":c"] = run_id
+    try:
+        REPO_CODE_REVIEW_TABLE.update_item(
+            Key={"review_id": review_id},
+            UpdateExpression="set task_status = :s, error_message = :e, update_at = :t",
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+        )
+        ui_print(f"every file of review {review_id} failed, mark it {FAILED_STATUS}")
+    except REPO_CODE_REVIEW_TABLE.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+@traced(group="dynamodb")
+def update_dynamodb_done_file(review_id, file_key, message_id, run_id=""):
+    # 异常向上抛出, 消息留在队列中重试
+    return finish_file_transaction(
+        review_id, file_key, message_id, FILE_DONE, "set file_done = file_done + :s", run_id
+    )
+
+
+@traced(group="dynamodb")
 def update_dynamodb_file_review_html_key(review_id, file_review_html_key, scores):
     try:
         REPO_CODE_REVIEW_TABLE.update_item(
@@ -213,6 +440,7 @@ def update_dynamodb_file_review_html_key(review_id, file_review_html_key, scores
         ui_print(f"An error occurred: {e}")
 
 
+@traced(group="dynamodb")
 def update_dynamodb_review_summary_html_key(review_id, review_summary_html_key):
     try:
         REPO_CODE_REVIEW_TABLE.update_item(
@@ -227,20 +455,27 @@ def update_dynamodb_review_summary_html_key(review_id, review_summary_html_key):
         ui_print(f"An error occurred: {e}")
 
 
+@traced(group="dynamodb")
 def update_dynamodb_stask_status(review_id, task_status=COMPLETED_STATUS):
+    # 晚到的文件审查或合并不能把已取消的任务改回 Completed
     try:
         REPO_CODE_REVIEW_TABLE.update_item(
             Key={"review_id": review_id},
             UpdateExpression="set task_status = :h",
+            ConditionExpression="attribute_exists(review_id) AND task_status <> :c",
             ExpressionAttributeValues={
-                ":h": task_status  # Assuming html_key_value is the value you want to set for file_review_html_key
+                ":h": task_status,  # Assuming html_key_value is the value you want to set for file_review_html_key
+                ":c": CANCELLED_STATUS,
             },
             ReturnValues="ALL_NEW",
         )
+    except REPO_CODE_REVIEW_TABLE.meta.client.exceptions.ConditionalCheckFailedException:
+        ui_print(f"review {review_id} was cancelled, keep its status")
     except Exception as e:
         ui_print(f"An error occurred: {e}")
 
 
+@traced(group="dynamodb")
 def query_dynamodb_by_review_id(review_id):
     try:
         response = REPO_CODE_REVIEW_TABLE.query(
@@ -254,7 +489,35 @@ def query_dynamodb_by_review_id(review_id):
         return None
 
 
+def is_review_cancelled(review_id):
+    """
+    Whether the review was cancelled through /cancelReview. The answer is
+    cached per container for CANCEL_CHECK_TTL seconds, so the messages of a
+    cancelled full scan are dropped at the cost of one read per container.
+    """
+    now = time.monotonic()
+    cached = CANCEL_CACHE.get(review_id)
+    if cached is not None and now - cached[1] < CANCEL_CHECK_TTL:
+        return cached[0]
+    try:
+        item = REPO_CODE_REVIEW_TABLE.get_item(
+            Key={"review_id": review_id}, ProjectionExpression="task_status"
+        ).get("Item", {})
+    except Exception as e:
+        ui_print(f"An error occurred: {e}")
+        return False
+    cancelled = item.get("task_status") == CANCELLED_STATUS
+    if len(CANCEL_CACHE) >= CANCEL_CACHE_SIZE:
+        CANCEL_CACHE.clear()
+    CANCEL_CACHE[review_id] = (cancelled, now)
+    return cancelled
+
+
 def can_merge_review_result(record):
+    # split_task 在拆分期间逐批增加 file_num, 只有拆分封口后 file_num 才是最终值
+    # (records written before split_sealed existed have a final file_num)
+    if record.get("split_sealed", True) is not True:
+        return False
     file_done = int(record["file_done"])
     file_num = int(record["file_num"])
     if file_num != 0 and file_num == file_done:
@@ -262,6 +525,48 @@ def can_merge_review_result(record):
     return False
 
 
+@traced(group="dynamodb")
+def claim_merge(review_id):
+    """
+    The last file reviews and split_task may all send a merge check, only
+    the first one to claim the review merges. A claim older than
+    MERGE_CLAIM_TIMEOUT belongs to a crashed invocation and is taken over.
+
+    Returns:
+    str: The merge_started_at of the claim, None if another invocation merges.
+    """
+    now = datetime.now()
+    claimed_at = str(now)
+    try:
+        REPO_CODE_REVIEW_TABLE.update_item(
+            Key={"review_id": review_id},
+            UpdateExpression="set merge_started_at = :t",
+            ConditionExpression="attribute_not_exists(merge_started_at) OR merge_started_at < :s",
+            ExpressionAttributeValues={
+                ":t": claimed_at,
+                ":s": str(now - timedelta(seconds=MERGE_CLAIM_TIMEOUT)),
+            },
+        )
+        return claimed_at
+    except REPO_CODE_REVIEW_TABLE.meta.client.exceptions.ConditionalCheckFailedException:
+        ui_print(f"review {review_id} is merged by another invocation")
+        return None
+
+
+@traced(group="dynamodb")
+def release_merge(review_id, claimed_at):
+    # 合并失败: 释放认领, 重新投递的合并检查可以再次合并
+    try:
+        REPO_CODE_REVIEW_TABLE.update_item(
+            Key={"review_id": review_id},
+            UpdateExpression="remove merge_started_at",
+            ConditionExpression="merge_started_at = :t",
+            ExpressionAttributeValues={":t": claimed_at},
+        )
+    except Exception as e:
+        ui_print(f"An error occurred: {e}")
+
+
 def str_to_float(s):
     try:
         return float(s)
@@ -394,6 +699,7 @@ def get_full_prompt(scan_scope, file_content, file_diff):
         return get_diff_scan_prompt(file_content, file_diff)
 
 
+@traced()
 def invoke_claude3(prompt):
     body = json.dumps(
         {
@@ -406,16 +712,21 @@ def invoke_claude3(prompt):
     )
     reply = BEDROCK_ERROR_MSG
     output_tokens = 0
+    LAST_BEDROCK_ERROR.clear()
+    trace_count("prompt_bytes", len(body))
     try:
         response = BEDROCK.invoke_model(body=body, modelId=LLM_ID)
         response_body = json.loads(response.get("body").read())
         reply = response_body.get("content")[0]["text"]
         output_tokens = response_body["usage"]["output_tokens"]
+        trace_count("input_tokens", response_body["usage"].get("input_tokens", 0))
+        trace_count("output_tokens", output_tokens)
         ui_print(f"Bedrock reply: {reply}")
     except Exception as e:
         # Code to handle the error
         err_str = str(e)
         ui_print(f"An error occurred: {err_str}")
+        LAST_BEDROCK_ERROR.update({"error_class": get_error_class(e), "error_message": err_str})
         reply = BEDROCK_ERROR_MSG
     return reply, output_tokens
 
@@ -427,34 +738,6 @@ def invoke_bedrock(full_prompt):
     return reply, output_tokens
 
 
-def increment_field(json_obj, field_name):
-    """
-    检查字段是否存在，如果存在则将其值增加1，如果不存在则创建该字段并设置为1。
-
-    参数:
-    json_obj (dict): JSON对象（通常是从json.loads()得到的字典）。
-    field_name (str): 要检查和增加的字段名称。
-
-    返回:
-    dict: 更新后的JSON对象。
-    """
-    # 检查字段是否存在
-    if field_name in json_obj:
-        # 如果字段存在，增加其值
-        json_obj[field_name] += 1
-    else:
-        # 如果字段不存在，创建字段并设置值为1
-        json_obj[field_name] = 1
-    return json_obj
-
-
-def get_field(json_obj, field_name):
-    # 检查字段是否存在
-    if field_name not in json_obj:
-        json_obj[field_name] = 0
-    return json_obj[field_name]
-
-
 def get_json_name(scan_scope, project, branch, commit_id, file_name):
     if commit_id != "00000000":
         return (
@@ -587,95 +870,192 @@ def process_successful_reply(
         update_dynamodb_only_version(update_item_v0)
     print("update file " + project_branch_file + " , v0 latest!")
 
-    update_dynamodb_done_file(review_id)
 
+def get_queue_url(msg_body):
+    """
+    Full scan file reviews go to the batch task queue and DIFF file reviews
+    to the interactive queue, both consumed by code_review. Merge checks go
+    to the merge queue (review_merge) and summaries to the summary queue
+    (review_summary).
+    """
+    msg_type = msg_body.get("msg_type")
+    if msg_type == MERGE_CHECK:
+        return MERGE_SQS_URL
+    if msg_type == REVIEW_SUMMARY:
+        return SUMMARY_SQS_URL
+    if msg_type == File_REVIEW and msg_body.get("scan_scope") == ALL_SCAN_SCOPE:
+        return TASK_SQS_URL
+    return INTERACTIVE_SQS_URL
 
-def process_failed_reply(msg_body, review_id):
-    msg_body = increment_field(msg_body, "failed_times")
-    failed_times = get_field(msg_body, "failed_times")
-    ui_print(f"failed_times: {failed_times}")
-    if failed_times > MAX_FAILED_TIMES:
-        update_dynamodb_file_num(review_id)
-    else:
-        SQS.send_message(
-            QueueUrl=TASK_SQS_URL,
-            MessageBody=json.dumps(msg_body, indent=4, ensure_ascii=False),
-            DelaySeconds=2**failed_times * 10,
-        )
 
+def get_message_group_id(msg_body):
+    # SQS fair queues 按 MessageGroupId 平衡各项目的排队时间
+    return str(msg_body.get("project") or "default")
 
-def handle_reply(
-    msg_body,
-    reply,
-    output_tokens,
-    scan_scope,
-    commit_id,
-    file_name,
-    file_content,
-    file_diff,
-    project,
-    branch,
-    review_id,
-):
-    if reply != BEDROCK_ERROR_MSG:
-        return process_successful_reply(
-            reply,
-            output_tokens,
-            scan_scope,
-            commit_id,
-            file_name,
-            file_content,
-            file_diff,
-            project,
-            branch,
-            review_id,
-        )
-    else:
-        return process_failed_reply(msg_body, review_id)
 
+def get_source_queue_url(record, msg_body):
+    """
+    The URL of the queue the record was received from, so a message queued
+    before the merge and summary queues existed is still deleted from its
+    own queue. Falls back to the queue of the message type.
+    """
+    queue_name = record.get("eventSourceARN", "").rpartition(":")[2]
+    for queue_url in [TASK_SQS_URL, INTERACTIVE_SQS_URL, MERGE_SQS_URL, SUMMARY_SQS_URL]:
+        if queue_name and queue_url and queue_url.rpartition("/")[2] == queue_name:
+            return queue_url
+    return get_queue_url(msg_body)
 
-def handle_failure(msg_body, review_id):
-    msg_body = increment_field(msg_body, "failed_times")
-    failed_times = get_field(msg_body, "failed_times")
-    ui_print(f"failed_times: {failed_times}")
-    if failed_times > MAX_FAILED_TIMES:
-        update_dynamodb_file_num(review_id)
-    else:
-        SQS.send_message(
-            QueueUrl=TASK_SQS_URL,
-            MessageBody=json.dumps(msg_body, indent=4, ensure_ascii=False),
-            DelaySeconds=2**failed_times * 10,
+
+def get_receive_count(record):
+    return str_to_int(record.get("attributes", {}).get("ApproximateReceiveCount", "1"))
+
+
+def acknowledge_message(record, msg_body):
+    # 结果已保存后才删除消息, 处理中途崩溃的消息会重新投递
+    SQS.delete_message(QueueUrl=get_source_queue_url(record, msg_body), ReceiptHandle=record["receiptHandle"])
+
+
+def retry_message(record, msg_body):
+    """
+    Leaves a failed message on its queue and backs off its next delivery
+    exponentially. After MAX_FAILED_TIMES retries the queue redrive policy
+    moves the message to the dead-letter queue on its next receive.
+
+    Returns:
+    bool: False on the last attempt, when the message will not be retried.
+    """
+    receive_count = get_receive_count(record)
+    ui_print(f"receive_count: {receive_count}")
+    retried = receive_count <= MAX_FAILED_TIMES
+    try:
+        SQS.change_message_visibility(
+            QueueUrl=get_source_queue_url(record, msg_body),
+            ReceiptHandle=record["receiptHandle"],
+            VisibilityTimeout=min(2**receive_count * 10, MAX_VISIBILITY_TIMEOUT) if retried else 0,
         )
+    except Exception as e:
+        ui_print(f"An error occurred: {e}")
+    return retried
+
+
+@contextmanager
+def visibility_heartbeat(record, msg_body):
+    """
+    Extends the visibility timeout of the message while it is processed, so
+    a long Bedrock call is not delivered twice and a crashed one comes back
+    after HEARTBEAT_VISIBILITY seconds instead of the queue visibility timeout.
+    """
+    stopped = threading.Event()
+
+    def beat():
+        while True:
+            try:
+                SQS.change_message_visibility(
+                    QueueUrl=get_source_queue_url(record, msg_body),
+                    ReceiptHandle=record["receiptHandle"],
+                    VisibilityTimeout=HEARTBEAT_VISIBILITY,
+                )
+            except Exception as e:
+                logging.debug(f"heartbeat failed: {e}")
+            if stopped.wait(HEARTBEAT_INTERVAL):
+                return
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class BedrockError(Exception):
+    def __init__(self, error):
+        super().__init__(f"{error['error_class']}: {error['error_message']}")
+        self.error = error
+
+
+def get_bedrock_error():
+    return {
+        "error_class": LAST_BEDROCK_ERROR.get("error_class", "BedrockError"),
+        "error_message": LAST_BEDROCK_ERROR.get("error_message", BEDROCK_ERROR_MSG),
+    }
+
+
+def handle_failure(record, msg_body, review_id, error):
+    file_key = get_file_key(msg_body)
+    message_id = record.get("messageId", "")
+    record_file_error(review_id, file_key, message_id, error)
+    if not retry_message(record, msg_body):
+        # 最后一次失败: 不再等待该文件, 消息进入死信队列, 可由 review_dlq 重放
+        update_dynamodb_file_num(review_id, file_key, message_id, msg_body.get("run_id", ""))
+
+
+def acknowledge_duplicate(record, msg_body):
+    # 同一文件已由其他消息审查或正在审查
+    ui_print(f"duplicate message of {msg_body['file_name']}, skip")
+    acknowledge_message(record, msg_body)
+    trace_count("duplicate_messages")
+    return True
 
 
 def process_record_review(record):
+    """
+    Reviews one file message. The message is deleted only after the review
+    result is saved, a failed review is left on the queue for redelivery.
+
+    Returns:
+    bool: True if the message was processed and deleted.
+    """
+    msg_body = json.loads(record["body"].encode("utf-8"))
+    ui_print(f"Msg body from sqs: {msg_body}")
+    # 提取消息体中的内容
+    review_id, project, branch, commit_id, file_list, file_name, file_content, scan_scope = (
+        extract_message_details(msg_body)
+    )
+    file_key = get_file_key(msg_body)
+    message_id = record.get("messageId", "")
     try:
-        msg_body = json.loads(record["body"].encode("utf-8"))
-        ui_print(f"Msg body from sqs: {msg_body}")
-        # 提取消息体中的内容
-        review_id, project, branch, commit_id, file_list, file_name, file_content, scan_scope = (
-            extract_message_details(msg_body)
-        )
+        if not claim_file(review_id, file_key, message_id):
+            return acknowledge_duplicate(record, msg_body)
         file_diff = extract_file_diff(msg_body, scan_scope)
         full_prompt = get_full_prompt(scan_scope, file_content, file_diff)
-        SQS.delete_message(QueueUrl=TASK_SQS_URL, ReceiptHandle=record["receiptHandle"])
-        reply, output_tokens = invoke_bedrock(full_prompt)
-        return handle_reply(
-            msg_body,
-            reply,
-            output_tokens,
-            scan_scope,
-            commit_id,
-            file_name,
-            file_content,
-            file_diff,
-            project,
-            branch,
-            review_id,
-        )
+        # 心跳结束后再删除消息或设置重试的可见性超时
+        with visibility_heartbeat(record, msg_body):
+            reply, output_tokens = invoke_bedrock(full_prompt)
+            if reply == BEDROCK_ERROR_MSG:
+                raise BedrockError(get_bedrock_error())
+            process_successful_reply(
+                reply,
+                output_tokens,
+                scan_scope,
+                commit_id,
+                file_name,
+                file_content,
+                file_diff,
+                project,
+                branch,
+                review_id,
+            )
+            done = update_dynamodb_done_file(
+                review_id, file_key, message_id, msg_body.get("run_id", "")
+            )
+        if not done:
+            return acknowledge_duplicate(record, msg_body)
+        acknowledge_message(record, msg_body)
+        return True
     except Exception as e:
         ui_print(f"Error processing message: {str(e)}")
-        return handle_failure(msg_body, review_id)
+        if isinstance(e, BedrockError):
+            handle_failure(record, msg_body, review_id, e.error)
+        else:
+            handle_failure(
+                record,
+                msg_body,
+                review_id,
+                {"error_class": get_error_class(e), "error_message": str(e)},
+            )
+        return False
 
 
 def get_record_type(record):
@@ -688,8 +1068,15 @@ def get_record_type(record):
         return ""
 
 
+@traced(group="html", size_of=len)
 def generate_code_review_all_html(json_data):
     try:
+        # jinja2 与 pygments 只在生成报告时导入, 不计入文件审查消息的冷启动时间
+        from jinja2 import Environment, select_autoescape
+        from pygments import highlight
+        from pygments.formatters import HtmlFormatter
+        from pygments.lexers import get_lexer_for_filename
+
         env = Environment(autoescape=select_autoescape())
 
         html = """
@@ -884,8 +1271,10 @@ def generate_code_review_all_html(json_data):
     return HTML_GEN_ERROR
 
 
+@traced(group="html", size_of=len)
 def generate_code_review_diff_html(json_data):
     try:
+        from jinja2 import Environment, select_autoescape
         env = Environment(autoescape=select_autoescape())
 
         html = """
@@ -1023,8 +1412,10 @@ def generate_code_review_diff_html(json_data):
     return HTML_GEN_ERROR
 
 
+@traced(group="html", size_of=len)
 def generate_summary_html(json_data):
     try:
+        from jinja2 import Environment, select_autoescape
         env = Environment(autoescape=select_autoescape())
 
         html = """
@@ -1098,15 +1489,49 @@ def gen_reveiw_summary_key(commit_id, scan_scope, project, branch):
     return gen_prefix(commit_id, scan_scope, project, branch) + SUMMARY_HTML_POSTFIX
 
 
-def handle_send_message(message, sqs_url=TASK_SQS_URL):
+def put_report_html(report_key, html_content, bucket=BUCKET_NAME):
+    """
+    Uploads a review report. With REPORT_IMMUTABLE_KEYS the object name is
+    prefixed with the content hash, e.g. <prefix>/<sha256[:16]>-merged-code-review-result.html,
+    and the object gets long-lived cache headers.
+
+    Returns:
+    str: The key the report was written to.
+    """
+    if not REPORT_IMMUTABLE_KEYS:
+        S3.put_object(
+            Bucket=bucket,
+            Key=report_key,
+            Body=html_content,
+            ContentType="Content-Type: text/html",
+        )
+        return report_key
+    body = html_content.encode("utf-8")
+    prefix, _, name = report_key.rpartition("/")
+    immutable_key = f"{prefix}/{hashlib.sha256(body).hexdigest()[:16]}-{name}"
+    S3.put_object(
+        Bucket=bucket,
+        Key=immutable_key,
+        Body=body,
+        ContentType="text/html; charset=utf-8",
+        CacheControl=IMMUTABLE_CACHE_CONTROL,
+    )
+    return immutable_key
+
+
+def handle_send_message(message, sqs_url=TASK_SQS_URL, group_id=None):
     try:
-        SQS.send_message(QueueUrl=sqs_url, MessageBody=message)
+        if group_id:
+            SQS.send_message(QueueUrl=sqs_url, MessageBody=message, MessageGroupId=group_id)
+        else:
+            SQS.send_message(QueueUrl=sqs_url, MessageBody=message)
         return True
     except Exception as e:
         print("An unexpected error occurred:", e)
         return False
 
 
+@traced()
 def merge_json_files_concurrently(
     scan_scope,
     prefix,
@@ -1114,57 +1539,55 @@ def merge_json_files_concurrently(
     bucket=BUCKET_NAME,
     max_workers=40,
 ):
-    try:
-        # 获取所有以.json结尾的文件的元数据
-        response = S3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    """
+    Merges the per-file review results under prefix into one HTML report.
+    S3 errors are raised, the merge check is retried.
 
-        json_files = [
-            obj["Key"]
-            for obj in response.get("Contents", [])
-            if obj["Key"].endswith(".json")
+    Returns:
+    tuple: (merged review results, key of the uploaded report).
+    """
+    # 获取所有以.json结尾的文件的元数据
+    response = S3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+
+    json_files = [
+        obj["Key"]
+        for obj in response.get("Contents", [])
+        if obj["Key"].endswith(".json")
+    ]
+
+    files_num = len(json_files)
+    trace_count("merged_files", files_num)
+    if not json_files:
+        ui_print("No .json files found.")
+        return NO_FILE_NEED_REVIEW, merged_file_key
+
+    # 定义并发下载文件内容的函数
+    def download_file(file_key):
+        response = S3.get_object(Bucket=bucket, Key=file_key)
+        return json.loads(response["Body"].read())
+
+    # 使用线程池并发下载文件内容
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(download_file, file_key) for file_key in json_files
         ]
+        all_data = [future.result() for future in as_completed(futures)]
 
-        files_num = len(json_files)
-        if not json_files:
-            ui_print("No .json files found.")
-            return NO_FILE_NEED_REVIEW
-
-        # 定义并发下载文件内容的函数
-        def download_file(file_key):
-            response = S3.get_object(Bucket=bucket, Key=file_key)
-            return json.loads(response["Body"].read())
-
-        # 使用线程池并发下载文件内容
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(download_file, file_key) for file_key in json_files
-            ]
-            all_data = [future.result() for future in as_completed(futures)]
-
-        # 将合并后的数据转换为JSON格式的字符串
-        # print(all_data)
-        merged_json_string = json.dumps(all_data, indent=4, ensure_ascii=False)
-        json_data = json.loads(merged_json_string)
-
-        html_content = generate_code_review_html(json_data, scan_scope)
-        # metadata = {'Content-Type': 'text/html'}
-        S3.put_object(
-            Bucket=bucket,
-            Key=merged_file_key,
-            Body=html_content,
-            ContentType="Content-Type: text/html",
-        )
-        ui_print(
-            f"Merged JSON file '{merged_file_key}' has been uploaded to bucket '{BUCKET_NAME}'."
-        )
-        return json_data
-    except (NoCredentialsError, ClientError) as e:
-        ui_print(f"An error occurred: {e}")
-        return {}
+    # 将合并后的数据转换为JSON格式的字符串
+    # print(all_data)
+    merged_json_string = json.dumps(all_data, indent=4, ensure_ascii=False)
+    json_data = json.loads(merged_json_string)
+
+    html_content = generate_code_review_html(json_data, scan_scope)
+    report_key = put_report_html(merged_file_key, html_content, bucket)
+    ui_print(
+        f"Merged JSON file '{report_key}' has been uploaded to bucket '{BUCKET_NAME}'."
+    )
+    return json_data, report_key
 
 
 def send_review_summary_msg(
-    json_data, review_id, project, branch, commit_id, file_list, scan_scope
+    json_data, review_id, project, branch, commit_id, file_list, scan_scope, run_id=""
 ):
     prompt = gen_review_summary_prompt(json_data)
     prompt_key = "review-summary-prompt-" + review_id + ".txt"
@@ -1186,7 +1609,13 @@ def send_review_summary_msg(
         "scan_scope": scan_scope,
         "msg_type": REVIEW_SUMMARY,
     }
-    return handle_send_message(json.dumps(item, indent=4, ensure_ascii=False))
+    if run_id:
+        item["run_id"] = run_id
+    return handle_send_message(
+        json.dumps(item, ensure_ascii=False),
+        get_queue_url(item),
+        get_message_group_id(item),
+    )
 
 
 def get_scores(json_data):
@@ -1217,42 +1646,106 @@ def get_scores(json_data):
     return {"min_score": min_score, "max_score": max_score, "avg_score": avg_score}
 
 
+def send_merge_check(msg_body):
+    """
+    Asks review_merge to merge the review once every file is reviewed. The
+    last file reviews of a review may all send one, review_merge claims the
+    merge so it runs once.
+
+    Returns:
+    bool: True if a merge check was sent.
+    """
+    review_id = msg_body["review_id"]
+    request_items = query_dynamodb_by_review_id(review_id) or []
+    if not any(can_merge_review_result(item) for item in request_items):
+        return False
+    item = {
+        "review_id": review_id,
+        "project": msg_body["project"],
+        "branch": msg_body["branch"],
+        "commit_id": msg_body["commit_id"],
+        "file_list": msg_body["file_list"],
+        "file_name": "merge-check",
+        "file_content": "",
+        "scan_scope": msg_body["scan_scope"],
+        "msg_type": MERGE_CHECK,
+    }
+    if msg_body.get("run_id"):
+        item["run_id"] = msg_body["run_id"]
+    return handle_send_message(
+        json.dumps(item, ensure_ascii=False),
+        get_queue_url(item),
+        get_message_group_id(item),
+    )
+
+
 def gen_review_summary_msg(record):
-    try:
-        msg_body = json.loads(record["body"].encode("utf-8"))
-        ui_print(f"Msg body from sqs: {msg_body}")
-        # 提取消息体中的内容
-        review_id, project, branch, commit_id, file_list, file_name, file_content, scan_scope = (
-            extract_message_details(msg_body)
-        )
-        responses = query_dynamodb_by_review_id(review_id)
-        for request_item in responses:
-            ui_print(request_item)
-            if can_merge_review_result(request_item) is True:
-                file_review_html_key = gen_merge_file_key(
-                    commit_id, scan_scope, project, branch
-                )
-                json_data = merge_json_files_concurrently(
+    """
+    Merges the per-file results of a mergeable review into its report and
+    sends the summary message of a full scan. Errors are raised after the
+    merge claim is released, so the merge check is retried.
+    """
+    msg_body = json.loads(record["body"].encode("utf-8"))
+    ui_print(f"Msg body from sqs: {msg_body}")
+    # 提取消息体中的内容
+    review_id, project, branch, commit_id, file_list, file_name, file_content, scan_scope = (
+        extract_message_details(msg_body)
+    )
+    responses = query_dynamodb_by_review_id(review_id)
+    if responses is None:
+        raise RuntimeError(f"review {review_id} could not be read")
+    for request_item in responses:
+        ui_print(request_item)
+        if can_merge_review_result(request_item) is not True:
+            continue
+        claimed_at = claim_merge(review_id)
+        if claimed_at is None:
+            continue
+        try:
+            file_review_html_key = gen_merge_file_key(commit_id, scan_scope, project, branch)
+            json_data, file_review_html_key = merge_json_files_concurrently(
+                scan_scope,
+                prefix=gen_prefix(commit_id, scan_scope, project, branch),
+                merged_file_key=file_review_html_key,
+            )
+            scores = get_scores(json_data)
+            update_dynamodb_file_review_html_key(review_id, file_review_html_key, scores)
+            if scan_scope == ALL_SCAN_SCOPE:
+                status = send_review_summary_msg(
+                    json_data,
+                    review_id,
+                    project,
+                    branch,
+                    commit_id,
+                    file_list,
                     scan_scope,
-                    prefix=gen_prefix(commit_id, scan_scope, project, branch),
-                    merged_file_key=file_review_html_key,
-                )
-                scores = get_scores(json_data)
-                update_dynamodb_file_review_html_key(
-                    review_id, file_review_html_key, scores
+                    request_item.get("created_at", ""),
                 )
-                if scan_scope == ALL_SCAN_SCOPE:
-                    status = send_review_summary_msg(
-                        json_data, review_id, project, branch, commit_id, file_list, scan_scope
-                    )
-                    if status is False:
-                        update_dynamodb_stask_status(review_id)
-
-                else:
+                if status is False:
                     update_dynamodb_stask_status(review_id)
 
+            else:
+                update_dynamodb_stask_status(review_id)
+        except Exception:
+            release_merge(review_id, claimed_at)
+            raise
+
+
+def process_record_merge(record):
+    """
+    Returns:
+    bool: True if the merge check was processed and deleted, a failed merge
+    is left on the merge queue for redelivery and then the dead-letter queue.
+    """
+    msg_body = json.loads(record["body"].encode("utf-8"))
+    try:
+        gen_review_summary_msg(record)
+        acknowledge_message(record, msg_body)
+        return True
     except Exception as e:
         ui_print(f"Error processing message: {str(e)}")
+        retry_message(record, msg_body)
+        return False
 
 
 def read_s3_object(prompt_key):
@@ -1271,20 +1764,29 @@ def read_s3_object(prompt_key):
 
 
 def process_record_summary_review(record):
+    """
+    Returns:
+    bool: True if the message was processed and deleted.
+    """
+    msg_body = json.loads(record["body"].encode("utf-8"))
+    ui_print(f"Msg body from sqs: {msg_body}")
+    # 提取消息体中的内容
+    review_id, project, branch, commit_id, file_list, file_name, file_content, scan_scope = (
+        extract_message_details(msg_body)
+    )
+    file_key = get_file_key(msg_body)
+    message_id = record.get("messageId", "")
     try:
-        msg_body = json.loads(record["body"].encode("utf-8"))
-        ui_print(f"Msg body from sqs: {msg_body}")
-        # 提取消息体中的内容
-        review_id, project, branch, commit_id, file_list, file_name, file_content, scan_scope = (
-            extract_message_details(msg_body)
-        )
+        if not claim_file(review_id, file_key, message_id):
+            return acknowledge_duplicate(record, msg_body)
         prompt_key = msg_body["prompt_key"]
         full_prompt = read_s3_object(prompt_key)
-        SQS.delete_message(QueueUrl=TASK_SQS_URL, ReceiptHandle=record["receiptHandle"])
         print(full_prompt)
-        reply, token_num = invoke_bedrock(full_prompt)
-        ui_print(f"token_num: {token_num}")
-        if reply != BEDROCK_ERROR_MSG:
+        with visibility_heartbeat(record, msg_body):
+            reply, token_num = invoke_bedrock(full_prompt)
+            ui_print(f"token_num: {token_num}")
+            if reply == BEDROCK_ERROR_MSG:
+                raise BedrockError(get_bedrock_error())
             code_review_result = {}
             code_review_result["review_id"] = review_id
             code_review_result["review_summary"] = reply
@@ -1293,49 +1795,29 @@ def process_record_summary_review(record):
                 commit_id, scan_scope, project, branch
             )
             html_content = generate_summary_html(json_data)
+            review_summary_html_key = put_report_html(review_summary_html_key, html_content)
             update_dynamodb_review_summary_html_key(review_id, review_summary_html_key)
-            S3.put_object(
-                Bucket=BUCKET_NAME,
-                Key=review_summary_html_key,
-                Body=html_content,
-                ContentType="Content-Type: text/html",
-            )
             update_dynamodb_stask_status(review_id)
-            # S3.put_object(
-            #     Bucket=BUCKET_NAME,
-            #     Key=review_summary_html_key,
-            #     Body=json_data,
-            #     ContentType="application/json",
-            # )
-        else:
-            msg_body = increment_field(msg_body, "failed_times")
-            failed_times = get_field(msg_body, "failed_times")
-            ui_print(f"failed_times: {failed_times}")
-            if failed_times <= max(MAX_FAILED_TIMES, 6):
-                SQS.send_message(
-                    QueueUrl=TASK_SQS_URL,
-                    MessageBody=json.dumps(msg_body, indent=4, ensure_ascii=False),
-                    DelaySeconds=2**failed_times * 10,
-                )
-            else:
-                update_dynamodb_stask_status(review_id)
-
+            finish_file_transaction(review_id, file_key, message_id, FILE_DONE)
+        acknowledge_message(record, msg_body)
+        return True
     except Exception as e:
         ui_print(f"Error processing message: {str(e)}")
-        msg_body = increment_field(msg_body, "failed_times")
-        failed_times = get_field(msg_body, "failed_times")
-        ui_print(f"failed_times: {failed_times}")
-        if failed_times <= max(MAX_FAILED_TIMES, 6):
-            SQS.send_message(
-                QueueUrl=TASK_SQS_URL,
-                MessageBody=json.dumps(msg_body, indent=4, ensure_ascii=False),
-                DelaySeconds=2**failed_times * 10,
-            )
-        else:
+        error = {"error_class": get_error_class(e), "error_message": str(e)}
+        if isinstance(e, BedrockError):
+            error = e.error
+        record_file_error(review_id, file_key, message_id, error)
+        if not retry_message(record, msg_body):
+            # 汇总最终失败时任务仍以逐文件报告完成
+            finish_file_transaction(review_id, file_key, message_id, FILE_FAILED)
             update_dynamodb_stask_status(review_id)
+        return False
 
 
 def lambda_handler(event, context):
+    # code_review、review_merge 与 review_summary 共用此入口, 各自的队列决定收到哪类消息
+    # 处理失败的消息留在队列中等待重试 (ReportBatchItemFailures)
+    batch_item_failures = []
     if event:
         record_size = len(event["Records"])
         ui_print(f"Record size: {record_size}")
@@ -1346,11 +1828,29 @@ def lambda_handler(event, context):
             review_id, project, branch, commit_id, file_list, file_name, file_content, scan_scope = (
                 extract_message_details(msg_body)
             )
-            if msg_type == File_REVIEW:
-                process_record_review(record)
-                if file_list == []:
-                    gen_review_summary_msg(record)
+            file_size = len(file_content.encode("utf-8"))
+            trace_reset(Stage=msg_type, Project=project, FileSize=file_size_bucket(file_size))
+            TRACE["properties"].update(
+                {"ReviewId": review_id, "FileName": file_name, "FileBytes": file_size}
+            )
+            with trace_span("invocation"):
+                processed = True
+                if is_review_cancelled(review_id):
+                    # 已取消的任务: 直接删除消息, 不调用 Bedrock
+                    acknowledge_message(record, msg_body)
+                    trace_count("cancelled_messages")
+                elif msg_type == File_REVIEW:
+                    processed = process_record_review(record)
+                    if file_list == []:
+                        send_merge_check(msg_body)
+                    elif processed or get_receive_count(record) > MAX_FAILED_TIMES:
+                        update_dynamodb_stask_status(review_id)
+                elif msg_type == MERGE_CHECK:
+                    processed = process_record_merge(record)
                 else:
-                    update_dynamodb_stask_status(review_id)
-            else:
-                process_record_summary_review(record)
+                    processed = process_record_summary_review(record)
+                if not processed:
+                    trace_count("failed_messages")
+                    batch_item_failures.append({"itemIdentifier": record["messageId"]})
+            trace_emit()
+    return {"batchItemFailures": batch_item_failures}
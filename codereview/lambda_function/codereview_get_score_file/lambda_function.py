@@ -8,6 +8,8 @@ import os
 from botocore.config import Config
 import decimal
 
+from codereview_common.response_cache import cached_response
+
 LAMBDA_LOG_BUCKET_NAME = os.getenv("LAMBDA_LOG_BUCKET_NAME")
 client_config = Config(max_pool_connections=50)
 S3 = boto3.client("s3", config=client_config)
@@ -18,6 +20,14 @@ dynamodb = boto3.resource('dynamodb')
 REPO_CODE_REVIEW_SCORE_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_SCORE_TABLE_NAME")
 REPO_CODE_REVIEW_SCORE_TABLE = dynamodb.Table(REPO_CODE_REVIEW_SCORE_TABLE_NAME)
 
+# response cache TTL in seconds, see codereview_common.response_cache
+CACHE_LIST_TTL = int(os.getenv("CACHE_LIST_TTL", "30"))
+
+# getScoreFile / getReviewFiles data encodings: a JSON string (legacy) or a JSON list
+STRING_FORMAT = "string"
+JSON_FORMAT = "json"
+RESPONSE_FORMATS = [STRING_FORMAT, JSON_FORMAT]
+
 RESPONSE_HEADERS = {
     "Access-Control-Allow-Origin": "*",  # 允许来自任何源的请求
     "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Amz-User-Agent",  # 允许的请求头
@@ -35,23 +45,87 @@ def ui_print(log, lambda_name="codereview_get_score_file"):
         Body=msg.encode("utf-8"),
         ContentType="text/html; charset=utf-8",
     )
-    
+
+
+def get_cache_ttl(path, response):
+    # 成功的查询结果短暂缓存, 错误不缓存
+    body = json.loads(response["body"])
+    return CACHE_LIST_TTL if body["status"] == "success" else 0
+
+
 def decimal_serializer(obj):
     if isinstance(obj, decimal.Decimal):
         return str(obj)
     raise TypeError("Object of type '%s' is not JSON serializable" % type(obj).__name__)
     
     
-def return_score_files(status, data={}, message=""):
+def json_default(obj):
+    # Table 资源返回的数字为 Decimal, 集合为 set
+    if isinstance(obj, decimal.Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, set):
+        return sorted(obj)
+    return str(obj)
+
+
+def get_response_options(body):
+    """
+    Reads the optional "fields" and "format" parameters of a list request.
+
+    Returns:
+    tuple: (fields, response_format). An empty fields list returns whole items.
+    """
+    fields = body.get("fields", [])
+    if not isinstance(fields, list) or not all(
+        isinstance(field, str) and field for field in fields
+    ):
+        raise ValueError("fields should be a list of attribute names.")
+    response_format = body.get("format", STRING_FORMAT)
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"format should be one of {RESPONSE_FORMATS}.")
+    return fields, response_format
+
+
+def get_projection_params(fields):
+    """
+    Returns the query parameters that only read the requested fields.
+    """
+    if not fields:
+        return {}
+    names = {f"#field_{index}": field for index, field in enumerate(dict.fromkeys(fields))}
+    return {
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+
+
+def query_all_items(**query_params):
+    # 跟随 LastEvaluatedKey 读取全部结果
+    response = REPO_CODE_REVIEW_SCORE_TABLE.query(**query_params)
+    items = response['Items']
+    while 'LastEvaluatedKey' in response:
+        response = REPO_CODE_REVIEW_SCORE_TABLE.query(
+            ExclusiveStartKey=response['LastEvaluatedKey'], **query_params
+        )
+        items.extend(response['Items'])
+    return items
+
+
+def return_score_files(status, data={}, message="", response_format=STRING_FORMAT):
     current_time = datetime.now()
+    if response_format == STRING_FORMAT and status == "success":
+        # 旧格式: data 为 JSON 字符串
+        data = json.dumps(data, default=str)
     response = {
         "status": status,
         "message": message,
         "timestamp": str(current_time),
         "data": data,
     }
-    res = {"statusCode": 200, "headers": RESPONSE_HEADERS, "body": json.dumps(response)}
-    ui_print(res)
+    body = json.dumps(response, default=json_default)
+    res = {"statusCode": 200, "headers": RESPONSE_HEADERS, "body": body}
+    # 只记录摘要, 不把全部文件记录写入日志
+    ui_print(f"status: {status}, message: {message}, bytes: {len(body)}")
     return res
     
 def get_score_file(event):
@@ -60,20 +134,20 @@ def get_score_file(event):
         ui_print(body)
         score_limit = int(body["score"])
         project_limit = body["project"]
+        fields, response_format = get_response_options(body)
         # 查询文件
-        response = REPO_CODE_REVIEW_SCORE_TABLE.query(
+        items = query_all_items(
             IndexName='version_file_index',
             KeyConditionExpression=Key('version').eq(0) & Key('project_branch_file').begins_with(project_limit),
-            FilterExpression=Attr('score').lt(score_limit) & Attr('commit_id').ne("00000000")
+            FilterExpression=Attr('score').lt(score_limit) & Attr('commit_id').ne("00000000"),
+            **get_projection_params(fields),
         )
-        print(response)
-        
-        # 获取需要文件和分数
-        items = response['Items']
-        
+        print(f"score files: {len(items)}")
+
         return return_score_files(
             status="success",
-            data=json.dumps(items, default=str)
+            data=items,
+            response_format=response_format,
         )
                     
     except Exception as e:
@@ -86,20 +160,20 @@ def get_review_files(event):
         body = json.loads(event["body"])
         ui_print(body)
         reviewid = body["reviewid"]
+        fields, response_format = get_response_options(body)
         # 查询文件
-        response = REPO_CODE_REVIEW_SCORE_TABLE.query(
+        items = query_all_items(
             IndexName='review_id_gsi',
             KeyConditionExpression=Key('review_id').eq(reviewid),
-            FilterExpression=Attr('version').ne(0)
+            FilterExpression=Attr('version').ne(0),
+            **get_projection_params(fields),
         )
-        print(response)
-        
-        # 获取需要文件和分数
-        items = response['Items']
-        
+        print(f"review files: {len(items)}")
+
         return return_score_files(
             status="success",
-            data=json.dumps(items, default=str)
+            data=items,
+            response_format=response_format,
         )
                     
     except Exception as e:
@@ -206,7 +280,7 @@ def count_next_month(
         print("month is " + str(month))
         if month > 1:
             month = month - 1
-            partition_value = str(year) + "-0" + str(month)
+            partition_value = f"{year}-{month:02d}"
             print("partition_value is " + partition_value)
             expression_attribute_values[":value"] = {"S": partition_value}
             print("expression_attribute_values update.")
@@ -214,7 +288,7 @@ def count_next_month(
         else:
             month = 12
             year = year - 1
-            partition_value = str(year) + "-0" + str(month)
+            partition_value = f"{year}-{month:02d}"
             expression_attribute_values[":value"] = {"S": partition_value}
             query_params["ExpressionAttributeValues"].update(expression_attribute_values)
         
@@ -303,13 +377,13 @@ def full_scan_next_month(
     while iteration < 2:
         if month > 1:
             month = month - 1
-            partition_value = str(year) + "-0" + str(month)
+            partition_value = f"{year}-{month:02d}"
             expression_attribute_values[":value"] = {"S": partition_value}
             query_params["ExpressionAttributeValues"].update(expression_attribute_values)
         else:
             month = 12
             year = year - 1
-            partition_value = str(year) + "-0" + str(month)
+            partition_value = f"{year}-{month:02d}"
             expression_attribute_values[":value"] = {"S": partition_value}
             query_params["ExpressionAttributeValues"].update(expression_attribute_values)
         
@@ -477,11 +551,11 @@ def lambda_handler(event, context):
     path = event["path"]
     
     if path == "/getScoreFile":
-        return get_score_file(event)
+        return cached_response(event, get_score_file, get_cache_ttl)
     elif path == "/getReviewFiles":
-        return get_review_files(event)
+        return cached_response(event, get_review_files, get_cache_ttl)
     elif path == "/getFileRecords":
-        return get_file_record(event)
+        return cached_response(event, get_file_record, get_cache_ttl)
     else:
         res = {
             "statusCode": 404,
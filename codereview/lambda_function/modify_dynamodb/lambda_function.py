@@ -33,9 +33,80 @@ def add_column(table, id, version, review_at):
                 )
             print(f"Added year-month column for item with id {item[id]}")
 
+def add_project_branch_column(table):
+    # 为已有记录补充组合键 project_branch，供 project_branch_created_at_gsi 使用
+    response = table.scan()
+    items = response['Items']
+    while 'LastEvaluatedKey' in response:
+        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+        items.extend(response['Items'])
+
+    for item in items:
+        if item.get('project_branch') or not item.get('project') or not item.get('branch'):
+            continue
+        table.update_item(
+            Key={'review_id': item['review_id']},
+            UpdateExpression='SET project_branch = :project_branch',
+            ExpressionAttributeValues={':project_branch': f"{item['project']}#{item['branch']}"}
+        )
+        print(f"Added project_branch column for item with id {item['review_id']}")
+
+def rebuild_counters(table, counter_table):
+    # 扫描请求表，重新计算 getReviewRecords 使用的记录计数器（与 record_counter lambda 的规则一致）
+    totals = {}
+    response = table.scan()
+    items = response['Items']
+    while 'LastEvaluatedKey' in response:
+        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+        items.extend(response['Items'])
+
+    for item in items:
+        if item.get('commit_id') == '00000000':
+            continue
+        for dimension in ['project', 'branch', 'project_branch', 'repo_url', 'scan_scope', 'year_month']:
+            value = item.get(dimension)
+            if value:
+                counter_key = f"{dimension}#{value}"
+                totals[counter_key] = totals.get(counter_key, 0) + 1
+
+    # 已不存在的维度值的计数器需要删除，record_counter 的 event# 去重标记保留
+    response = counter_table.scan(ProjectionExpression='counter_key')
+    counter_keys = [item['counter_key'] for item in response['Items']]
+    while 'LastEvaluatedKey' in response:
+        response = counter_table.scan(
+            ProjectionExpression='counter_key', ExclusiveStartKey=response['LastEvaluatedKey']
+        )
+        counter_keys.extend(item['counter_key'] for item in response['Items'])
+    stale_keys = [
+        counter_key for counter_key in counter_keys
+        if counter_key not in totals and not counter_key.startswith('event#')
+    ]
+
+    # 覆盖写入计数器
+    with counter_table.batch_writer() as batch:
+        for counter_key, total in totals.items():
+            batch.put_item(
+                Item={
+                    'counter_key': counter_key,
+                    'total': total,
+                    'update_at': str(datetime.now()),
+                }
+            )
+        for counter_key in stale_keys:
+            batch.delete_item(Key={'counter_key': counter_key})
+    print(f"Rebuilt {len(totals)} counters, deleted {len(stale_keys)} stale counters.")
+
+
 def lambda_handler(event, context):
     # 初始化DynamoDB资源
     dynamodb = boto3.resource('dynamodb')
+
+    # 重建记录计数器：{"action": "rebuild_counters"}
+    if event and event.get('action') == 'rebuild_counters':
+        REPO_CODE_REVIEW_TABLE = dynamodb.Table(os.getenv("REPO_CODE_REVIEW_TABLE_NAME"))
+        REPO_CODE_REVIEW_COUNTER_TABLE = dynamodb.Table(os.getenv("REPO_CODE_REVIEW_COUNTER_TABLE_NAME"))
+        rebuild_counters(REPO_CODE_REVIEW_TABLE, REPO_CODE_REVIEW_COUNTER_TABLE)
+        return
     
     # 指定现有DynamoDB表名
     REPO_CODE_REVIEW_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_TABLE_NAME")
@@ -43,6 +114,7 @@ def lambda_handler(event, context):
     
     # 扫描表获取所有记录
     add_column(REPO_CODE_REVIEW_TABLE, 'review_id', '', 'created_at')
+    add_project_branch_column(REPO_CODE_REVIEW_TABLE)
     
     # 指定现有DynamoDB表名
     REPO_CODE_REVIEW_SCORE_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_SCORE_TABLE_NAME")
@@ -0,0 +1,137 @@
+import boto3
+import os
+import logging
+from botocore.exceptions import ClientError
+from datetime import datetime
+
+
+DYNAMODB = boto3.client("dynamodb")
+REPO_CODE_REVIEW_COUNTER_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_COUNTER_TABLE_NAME")
+
+# record attributes that get an aggregate counter, the counter item key is "<attribute>#<value>"
+COUNTER_DIMENSIONS = [
+    "project",
+    "branch",
+    "project_branch",
+    "repo_url",
+    "scan_scope",
+    "year_month",
+]
+# getReviewRecords never lists file-list reviews without a commit
+EXCLUDED_COMMIT_ID = "00000000"
+# 已计数的 stream 记录以 "event#<eventID>" 标记, 保留时间长于 stream 的 24 小时, 过期后由 DynamoDB TTL 删除
+EVENT_MARKER_PREFIX = "event#"
+EVENT_MARKER_TTL = int(os.getenv("EVENT_MARKER_TTL", str(2 * 24 * 3600)))
+
+logging.basicConfig(
+    force=True,
+    format="%(asctime)s %(levelname)-8s %(message)s",
+    level=logging.DEBUG,
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+
+def get_counter_keys(image):
+    """
+    Returns the counter keys a repo_code_review_table item contributes to.
+
+    Parameters:
+    image (dict): The item in DynamoDB attribute-value format (stream NewImage).
+
+    Returns:
+    list: Counter keys such as "project#my-project".
+    """
+    if image.get("commit_id", {}).get("S", "") == EXCLUDED_COMMIT_ID:
+        return []
+    keys = []
+    for dimension in COUNTER_DIMENSIONS:
+        value = image.get(dimension, {}).get("S", "")
+        if value:
+            keys.append(f"{dimension}#{value}")
+    return keys
+
+
+def get_record_keys(record):
+    """
+    Returns the counter keys a stream record increments, only INSERT events
+    count: a re-submitted review overwrites its item and arrives as MODIFY.
+    """
+    if record.get("eventName") != "INSERT":
+        return []
+    return get_counter_keys(record.get("dynamodb", {}).get("NewImage", {}))
+
+
+def count_record(event_id, counter_keys, table_name=REPO_CODE_REVIEW_COUNTER_TABLE_NAME):
+    """
+    Increments the counters of one stream record together with a marker item
+    of its eventID in one transaction, so a retried batch does not count the
+    record twice.
+
+    Returns:
+    bool: False when the record was already counted.
+    """
+    now = datetime.now()
+    increments = [
+        {
+            "Update": {
+                "TableName": table_name,
+                "Key": {"counter_key": {"S": counter_key}},
+                "UpdateExpression": "ADD #total :n SET update_at = :t",
+                "ExpressionAttributeNames": {"#total": "total"},
+                "ExpressionAttributeValues": {
+                    ":n": {"N": "1"},
+                    ":t": {"S": str(now)},
+                },
+            }
+        }
+        for counter_key in counter_keys
+    ]
+    marker = {
+        "Put": {
+            "TableName": table_name,
+            "Item": {
+                "counter_key": {"S": f"{EVENT_MARKER_PREFIX}{event_id}"},
+                "expires_at": {"N": str(int(now.timestamp()) + EVENT_MARKER_TTL)},
+            },
+            "ConditionExpression": "attribute_not_exists(counter_key)",
+        }
+    }
+    try:
+        DYNAMODB.transact_write_items(TransactItems=[marker] + increments)
+    except ClientError as e:
+        reasons = e.response.get("CancellationReasons", [])
+        if (
+            e.response["Error"]["Code"] == "TransactionCanceledException"
+            and reasons
+            and reasons[0].get("Code") == "ConditionalCheckFailed"
+        ):
+            return False
+        raise
+    return True
+
+
+def lambda_handler(event, context):
+    """
+    Counts the INSERT records of a stream batch one record at a time. On an
+    error the sequence number of the failed record is reported, the event
+    source retries the batch from there and the eventID markers skip the
+    records counted before.
+    """
+    counted = 0
+    for record in event.get("Records", []):
+        counter_keys = get_record_keys(record)
+        if not counter_keys:
+            continue
+        try:
+            if count_record(record["eventID"], counter_keys):
+                counted += 1
+        except Exception as e:
+            logging.error(f"failed to count record {record['eventID']}: {e}")
+            return {
+                "counted": counted,
+                "batchItemFailures": [
+                    {"itemIdentifier": record["dynamodb"]["SequenceNumber"]}
+                ],
+            }
+    logging.debug(f"counted {counted} records")
+    return {"counted": counted, "batchItemFailures": []}
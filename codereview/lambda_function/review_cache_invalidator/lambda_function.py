@@ -0,0 +1,97 @@
+import boto3
+import json
+import os
+import logging
+
+
+DYNAMODB = boto3.client("dynamodb")
+LAMBDA_CLIENT = boto3.client("lambda")
+REPO_CODE_REVIEW_CACHE_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_CACHE_TABLE_NAME")
+# 列表接口的缓存键包含该计数, 见 codereview_common.response_cache
+EPOCH_KEY = "epoch#lists"
+# 完成通知由 review_notifier 发送, 本函数是它在请求表 stream 上的入口
+REVIEW_NOTIFIER_LAMBDA_NAME = os.getenv("REVIEW_NOTIFIER_LAMBDA_NAME", "")
+COMPLETED_STATUS = "Completed"
+FAILED_STATUS = "Failed"
+CANCELLED_STATUS = "Cancelled"
+
+logging.basicConfig(
+    force=True,
+    format="%(asctime)s %(levelname)-8s %(message)s",
+    level=logging.DEBUG,
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+
+def get_cache_keys(records):
+    """
+    Returns the getReviewResult cache keys of the reviews changed by a batch
+    of stream records, see get_cache_key in codereview_common.response_cache.
+    """
+    cache_keys = set()
+    for record in records:
+        image = record.get("dynamodb", {}).get("NewImage", {})
+        review_id = image.get("review_id", {}).get("S", "")
+        if review_id:
+            cache_keys.add(f"review#{review_id}")
+    return cache_keys
+
+
+def bump_list_epoch():
+    # 任务新建或状态变化后, 之前缓存的记录列表与分数列表都不再使用
+    DYNAMODB.update_item(
+        TableName=REPO_CODE_REVIEW_CACHE_TABLE_NAME,
+        Key={"cache_key": {"S": EPOCH_KEY}},
+        UpdateExpression="ADD epoch :n",
+        ExpressionAttributeValues={":n": {"N": "1"}},
+    )
+
+
+def should_notify(image):
+    # 与 review_notifier 的 should_notify 一致
+    return (
+        image.get("task_status", {}).get("S") in [COMPLETED_STATUS, FAILED_STATUS, CANCELLED_STATUS]
+        and bool(image.get("callback_url", {}).get("S"))
+        and "callback_status" not in image
+    )
+
+
+def get_notifications(records):
+    """
+    Returns the review_ids of the stream records whose callback should be
+    sent, see should_notify.
+    """
+    review_ids = set()
+    for record in records:
+        image = record.get("dynamodb", {}).get("NewImage", {})
+        if should_notify(image):
+            review_ids.add(image["review_id"]["S"])
+    return review_ids
+
+
+def invoke_notifier(review_id):
+    # 每个回调一次异步调用, 慢的回调地址不会拖慢缓存失效或使整批超时
+    LAMBDA_CLIENT.invoke(
+        FunctionName=REVIEW_NOTIFIER_LAMBDA_NAME,
+        InvocationType="Event",
+        Payload=json.dumps({"review_id": review_id}),
+    )
+
+
+def lambda_handler(event, context):
+    records = event.get("Records", [])
+    cache_keys = get_cache_keys(records)
+    for cache_key in cache_keys:
+        # let errors propagate so the stream batch is retried
+        DYNAMODB.delete_item(
+            TableName=REPO_CODE_REVIEW_CACHE_TABLE_NAME,
+            Key={"cache_key": {"S": cache_key}},
+        )
+    if records:
+        bump_list_epoch()
+    logging.debug(f"invalidated cache keys: {cache_keys}")
+    review_ids = get_notifications(records) if REVIEW_NOTIFIER_LAMBDA_NAME else set()
+    for review_id in review_ids:
+        # 重试整批时 review_notifier 的认领保证回调只发送一次
+        invoke_notifier(review_id)
+    return {"invalidated": len(cache_keys), "notifications": len(review_ids)}
@@ -0,0 +1,418 @@
+import boto3
+import hashlib
+import json
+import os
+import logging
+from collections import Counter
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+
+SQS = boto3.client("sqs")
+DYNAMODB = boto3.resource("dynamodb")
+REPO_CODE_REVIEW_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_TABLE_NAME")
+REPO_CODE_REVIEW_FILE_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_FILE_TABLE_NAME")
+REPO_CODE_REVIEW_FILE_TABLE = DYNAMODB.Table(REPO_CODE_REVIEW_FILE_TABLE_NAME)
+TASK_SQS_URL = os.getenv("TASK_SQS_URL")
+INTERACTIVE_SQS_URL = os.getenv("INTERACTIVE_SQS_URL") or TASK_SQS_URL
+MERGE_SQS_URL = os.getenv("MERGE_SQS_URL") or INTERACTIVE_SQS_URL
+SUMMARY_SQS_URL = os.getenv("SUMMARY_SQS_URL") or INTERACTIVE_SQS_URL
+TASK_DLQ_URL = os.getenv("TASK_DLQ_URL")
+INTERACTIVE_DLQ_URL = os.getenv("INTERACTIVE_DLQ_URL")
+MERGE_DLQ_URL = os.getenv("MERGE_DLQ_URL")
+SUMMARY_DLQ_URL = os.getenv("SUMMARY_DLQ_URL")
+DLQ_URLS = [
+    url for url in [TASK_DLQ_URL, INTERACTIVE_DLQ_URL, MERGE_DLQ_URL, SUMMARY_DLQ_URL] if url
+]
+# 重放的消息按 REPLAY_RATE 条/秒错开投递, 审查并发仍受各队列事件源的 max_concurrency 限制
+REPLAY_RATE = float(os.getenv("REPLAY_RATE", "2"))
+MAX_DELAY_SECONDS = 900
+# triage 只读取死信消息, 结束后立即恢复可见
+TRIAGE_VISIBILITY = 60
+REPLAY_VISIBILITY = 300
+TRIAGE_SAMPLES = 20
+ALL_SCAN_SCOPE = "ALL"
+File_REVIEW = "file review"
+REVIEW_SUMMARY = "review summary"
+MERGE_CHECK = "merge check"
+PROGRESS_STATUS = "InProgress"
+PROGRESSLLM_STATUS = "InProgress LLM"
+COMPLETED_STATUS = "Completed"
+FAILED_STATUS = "Failed"
+FILE_REVIEWING = "reviewing"
+FILE_DONE = "done"
+FILE_FAILED = "failed"
+SUMMARY_FILE_NAME = "review-summary"
+
+logging.basicConfig(
+    force=True,
+    format="%(asctime)s %(levelname)-8s %(message)s",
+    level=logging.DEBUG,
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+
+def get_queue_url(msg_body):
+    """
+    Same routing as code_review: full scan file reviews go to the batch task
+    queue, DIFF file reviews to the interactive queue, merge checks to the
+    merge queue and summaries to the summary queue.
+    """
+    msg_type = msg_body.get("msg_type")
+    if msg_type == MERGE_CHECK:
+        return MERGE_SQS_URL
+    if msg_type == REVIEW_SUMMARY:
+        return SUMMARY_SQS_URL
+    if msg_type == File_REVIEW and msg_body.get("scan_scope") == ALL_SCAN_SCOPE:
+        return TASK_SQS_URL
+    return INTERACTIVE_SQS_URL
+
+
+def get_message_group_id(msg_body):
+    return str(msg_body.get("project") or "default")
+
+
+def get_file_key(msg_body):
+    # 与 code_review 的 get_file_key 一致
+    content = msg_body.get("file_content", "") + msg_body.get("diff", "") + msg_body.get("prompt_key", "")
+    content += msg_body.get("run_id", "")
+    return f"{msg_body.get('file_name', '')}#{hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]}"
+
+
+def is_conditional_failure(e):
+    return isinstance(e, ClientError) and e.response["Error"]["Code"] in [
+        "ConditionalCheckFailedException",
+        "TransactionCanceledException",
+    ]
+
+
+def receive_dead_letters(dlq_url, max_messages, visibility_timeout):
+    """
+    Receives up to max_messages messages of a dead-letter queue, hiding them
+    for visibility_timeout seconds so each one is returned once.
+    """
+    messages = []
+    while len(messages) < max_messages:
+        response = SQS.receive_message(
+            QueueUrl=dlq_url,
+            MaxNumberOfMessages=min(10, max_messages - len(messages)),
+            VisibilityTimeout=visibility_timeout,
+            WaitTimeSeconds=0,
+        )
+        if not response.get("Messages"):
+            break
+        messages.extend(response["Messages"])
+    return messages
+
+
+def release_messages(dlq_url, messages):
+    # 未处理的死信消息立即恢复可见
+    for start in range(0, len(messages), 10):
+        SQS.change_message_visibility_batch(
+            QueueUrl=dlq_url,
+            Entries=[
+                {"Id": str(index), "ReceiptHandle": message["ReceiptHandle"], "VisibilityTimeout": 0}
+                for index, message in enumerate(messages[start : start + 10])
+            ],
+        )
+
+
+def get_file_records(keys):
+    """
+    Reads the repo_code_review_file records of (review_id, file_key) pairs.
+
+    Returns:
+    dict: (review_id, file_key) -> record
+    """
+    records = {}
+    keys = list(dict.fromkeys(keys))
+    for start in range(0, len(keys), 100):
+        request = {
+            REPO_CODE_REVIEW_FILE_TABLE_NAME: {
+                "Keys": [
+                    {"review_id": review_id, "file_key": file_key}
+                    for review_id, file_key in keys[start : start + 100]
+                ]
+            }
+        }
+        while request:
+            response = DYNAMODB.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(REPO_CODE_REVIEW_FILE_TABLE_NAME, []):
+                records[(item["review_id"], item["file_key"])] = item
+            request = response.get("UnprocessedKeys")
+    return records
+
+
+def get_dead_letters(dlq_url, max_messages, visibility_timeout):
+    """
+    Returns (message, msg_body, file record) of the received dead letters.
+    """
+    messages = receive_dead_letters(dlq_url, max_messages, visibility_timeout)
+    letters = []
+    for message in messages:
+        try:
+            msg_body = json.loads(message["Body"])
+        except ValueError:
+            msg_body = {}
+        letters.append((message, msg_body))
+    records = get_file_records(
+        [
+            (msg_body["review_id"], get_file_key(msg_body))
+            for _, msg_body in letters
+            if msg_body.get("review_id") and msg_body.get("file_name")
+        ]
+    )
+    return [
+        (message, msg_body, records.get((msg_body.get("review_id"), get_file_key(msg_body)), {}))
+        for message, msg_body in letters
+    ]
+
+
+def matches(msg_body, record, filters):
+    if filters.get("review_id") and msg_body.get("review_id") != filters["review_id"]:
+        return False
+    if filters.get("error_class") and record.get("error_class") != filters["error_class"]:
+        return False
+    return True
+
+
+def triage(event):
+    """
+    Summarizes the dead letters by error class and review without removing
+    them from the dead-letter queues.
+    """
+    max_messages = int(event.get("max_messages", 1000))
+    by_error_class = Counter()
+    by_review = {}
+    samples = []
+    total = 0
+    for dlq_url in DLQ_URLS:
+        letters = get_dead_letters(dlq_url, max_messages - total, TRIAGE_VISIBILITY)
+        for message, msg_body, record in letters:
+            if not matches(msg_body, record, event):
+                continue
+            total += 1
+            error_class = record.get("error_class", "unknown")
+            by_error_class[error_class] += 1
+            review = by_review.setdefault(
+                msg_body.get("review_id", ""),
+                {"project": msg_body.get("project", ""), "files": 0, "error_classes": Counter()},
+            )
+            review["files"] += 1
+            review["error_classes"][error_class] += 1
+            if len(samples) < TRIAGE_SAMPLES:
+                samples.append(
+                    {
+                        "review_id": msg_body.get("review_id", ""),
+                        "file_name": msg_body.get("file_name", ""),
+                        "msg_type": msg_body.get("msg_type", ""),
+                        "error_class": error_class,
+                        "error_message": record.get("error_message", ""),
+                        "failures": int(record.get("failures", 0)),
+                        "failed_at": record.get("failed_at", ""),
+                    }
+                )
+        release_messages(dlq_url, [message for message, _, _ in letters])
+    for review in by_review.values():
+        review["error_classes"] = dict(review["error_classes"])
+    return {
+        "total": total,
+        "by_error_class": dict(by_error_class),
+        "by_review": by_review,
+        "samples": samples,
+    }
+
+
+def reopen_file(review_id, file_key, undo=False, run_id=""):
+    """
+    Counts a failed file of a review again before its message is replayed:
+    the file record is marked as replayed and file_num of the review is
+    incremented in one transaction, so a file is replayed once. The review
+    goes back to "InProgress LLM" and its merge claim is released, so the
+    report is merged again when the replayed files are done.
+
+    Parameters:
+    undo (bool): Revert a reopen whose message could not be sent.
+    run_id (str): created_at of the run the message belongs to, a dead
+    letter of an earlier run does not reopen a later run.
+
+    Returns:
+    bool: False if the file is not failed, already replayed, the review
+    is no longer active or was run again since.
+    """
+    current_time = str(datetime.now())
+    if undo:
+        file_update = {
+            "UpdateExpression": "remove replayed_at",
+            "ConditionExpression": "attribute_exists(replayed_at)",
+            "ExpressionAttributeValues": None,
+        }
+        request_update = {
+            "UpdateExpression": "set file_num = file_num - :n, update_at = :t",
+            "ExpressionAttributeValues": {":n": 1, ":t": current_time},
+        }
+    else:
+        file_update = {
+            "UpdateExpression": "set replayed_at = :t",
+            "ConditionExpression": "file_status = :f AND attribute_not_exists(replayed_at)",
+            "ExpressionAttributeValues": {":t": current_time, ":f": FILE_FAILED},
+        }
+        request_update = {
+            "UpdateExpression": "set file_num = file_num + :n, task_status = :l, update_at = :t remove merge_started_at, error_message",
+            # 所有文件都失败的任务被 code_review 标记为 Failed, 重放后同样继续
+            "ConditionExpression": "task_status IN (:p, :l, :c, :x)",
+            "ExpressionAttributeValues": {
+                ":n": 1,
+                ":t": current_time,
+                ":p": PROGRESS_STATUS,
+                ":l": PROGRESSLLM_STATUS,
+                ":c": COMPLETED_STATUS,
+                ":x": FAILED_STATUS,
+            },
+        }
+    file_item = {
+        "TableName": REPO_CODE_REVIEW_FILE_TABLE_NAME,
+        "Key": {"review_id": review_id, "file_key": file_key},
+        "UpdateExpression": file_update["UpdateExpression"],
+        "ConditionExpression": file_update["ConditionExpression"],
+    }
+    if file_update["ExpressionAttributeValues"]:
+        file_item["ExpressionAttributeValues"] = file_update["ExpressionAttributeValues"]
+    if run_id and not undo:
+        request_update["ConditionExpression"] += " AND created_at = :r"
+        request_update["ExpressionAttributeValues"][":r"] = run_id
+    request_item = dict(
+        request_update, TableName=REPO_CODE_REVIEW_TABLE_NAME, Key={"review_id": review_id}
+    )
+    try:
+        DYNAMODB.meta.client.transact_write_items(
+            TransactItems=[{"Update": file_item}, {"Update": request_item}]
+        )
+        return True
+    except ClientError as e:
+        if not is_conditional_failure(e):
+            raise
+        return False
+
+
+def release_claim(review_id, file_key, message_id):
+    """
+    Releases the claim of a message that went to the dead-letter queue while
+    it was being reviewed (e.g. a timeout on its last delivery), so the
+    replayed copy can claim the file. file_num was never decremented.
+    """
+    try:
+        REPO_CODE_REVIEW_FILE_TABLE.update_item(
+            Key={"review_id": review_id, "file_key": file_key},
+            UpdateExpression="set file_status = :f",
+            ConditionExpression="file_status = :r AND message_id = :m",
+            ExpressionAttributeValues={":f": FILE_FAILED, ":r": FILE_REVIEWING, ":m": message_id},
+        )
+        return True
+    except ClientError as e:
+        if not is_conditional_failure(e):
+            raise
+        return False
+
+
+def reset_summary(review_id):
+    # 重新合并后需要重新生成汇总, 删除已完成的汇总记录
+    response = REPO_CODE_REVIEW_FILE_TABLE.query(
+        KeyConditionExpression="review_id = :r AND begins_with(file_key, :s)",
+        ExpressionAttributeValues={":r": review_id, ":s": SUMMARY_FILE_NAME + "#"},
+    )
+    for item in response["Items"]:
+        if item.get("file_status") == FILE_DONE:
+            REPO_CODE_REVIEW_FILE_TABLE.delete_item(
+                Key={"review_id": review_id, "file_key": item["file_key"]}
+            )
+
+
+def replay_letter(message, msg_body, record, delay_seconds, reopened_reviews):
+    """
+    Sends one dead letter back to its source queue.
+
+    Returns:
+    str: "replayed", "skipped" (left in the dead-letter queue) or
+    "dropped" (the file was reviewed since, the dead letter is deleted).
+    """
+    review_id = msg_body["review_id"]
+    file_key = get_file_key(msg_body)
+    file_status = record.get("file_status")
+    # 放弃的文件已从 file_num 中减去, 重放前重新计入
+    reopen = msg_body.get("msg_type") == File_REVIEW and file_status == FILE_FAILED
+    if file_status == FILE_DONE:
+        return "dropped"
+    if file_status == FILE_REVIEWING and not release_claim(
+        review_id, file_key, record.get("message_id", "")
+    ):
+        return "skipped"
+    if reopen:
+        if not reopen_file(review_id, file_key, run_id=msg_body.get("run_id", "")):
+            return "skipped"
+        if review_id not in reopened_reviews:
+            reset_summary(review_id)
+            reopened_reviews.add(review_id)
+    try:
+        SQS.send_message(
+            QueueUrl=get_queue_url(msg_body),
+            MessageBody=message["Body"],
+            MessageGroupId=get_message_group_id(msg_body),
+            DelaySeconds=delay_seconds,
+        )
+    except Exception:
+        if reopen:
+            reopen_file(review_id, file_key, undo=True)
+        raise
+    return "replayed"
+
+
+def replay(event):
+    """
+    Re-drives dead letters to their source queues, optionally only those of
+    one review_id and/or error_class. Replayed messages are spread out by
+    REPLAY_RATE messages per second with DelaySeconds, at most
+    REPLAY_RATE * 900 per run; run it again for the rest.
+    """
+    max_messages = int(event.get("max_messages", REPLAY_RATE * MAX_DELAY_SECONDS))
+    max_messages = min(max_messages, int(REPLAY_RATE * MAX_DELAY_SECONDS))
+    results = Counter()
+    reopened_reviews = set()
+    for dlq_url in DLQ_URLS:
+        if results["replayed"] >= max_messages:
+            break
+        letters = get_dead_letters(
+            dlq_url, max_messages - results["replayed"], REPLAY_VISIBILITY
+        )
+        released = []
+        for message, msg_body, record in letters:
+            if not msg_body.get("review_id") or not matches(msg_body, record, event):
+                released.append(message)
+                continue
+            delay_seconds = min(int(results["replayed"] / REPLAY_RATE), MAX_DELAY_SECONDS)
+            try:
+                result = replay_letter(message, msg_body, record, delay_seconds, reopened_reviews)
+            except Exception as e:
+                logging.debug(f"replay of {msg_body.get('file_name')} failed: {e}")
+                result = "skipped"
+            results[result] += 1
+            if result == "skipped":
+                released.append(message)
+            else:
+                SQS.delete_message(QueueUrl=dlq_url, ReceiptHandle=message["ReceiptHandle"])
+        release_messages(dlq_url, released)
+    logging.debug(f"replay results: {dict(results)}, reviews: {reopened_reviews}")
+    return {
+        "replayed": results["replayed"],
+        "skipped": results["skipped"],
+        "dropped": results["dropped"],
+        "reviews": sorted(reopened_reviews),
+    }
+
+
+def lambda_handler(event, context):
+    # 分析: {"action": "triage"}; 重放: {"action": "replay", "review_id": ..., "error_class": ...}
+    event = event or {}
+    if event.get("action") == "replay":
+        return replay(event)
+    return triage(event)
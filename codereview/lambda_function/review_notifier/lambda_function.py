@@ -0,0 +1,269 @@
+import boto3
+import hashlib
+import hmac
+import json
+import os
+import logging
+import time
+from datetime import datetime, timedelta
+
+from codereview_common.callback import post_pinned, resolve_callback_address
+from codereview_common.clients import LazyClient
+
+DYNAMODB = LazyClient(lambda: boto3.client("dynamodb"))
+S3 = LazyClient(lambda: boto3.client("s3"))
+REPO_CODE_REVIEW_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_TABLE_NAME")
+BUCKET_NAME = os.getenv("BUCKET_NAME")
+EXPIRES_IN = int(os.getenv("EXPIRES_IN", "36000"))
+# HMAC key of the callback signature, read from Secrets Manager when CALLBACK_SECRET is not set
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET", "")
+CALLBACK_SECRET_ARN = os.getenv("CALLBACK_SECRET_ARN", "")
+CALLBACK_MAX_ATTEMPTS = int(os.getenv("CALLBACK_MAX_ATTEMPTS", "5"))
+CALLBACK_TIMEOUT = int(os.getenv("CALLBACK_TIMEOUT", "10"))
+CALLBACK_RETRY_DELAY = float(os.getenv("CALLBACK_RETRY_DELAY", "1"))
+# 与 api_post_code_review 相同: 配置后只回调这些 host, 否则只回调公网地址
+CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+# 剩余时间不足一次回调加上该毫秒数时不再尝试, 释放认领后由异步调用重试
+CALLBACK_TIME_RESERVE_MS = int(os.getenv("CALLBACK_TIME_RESERVE_MS", "5000"))
+# 没有 Lambda context 时 (本地调用) 认领的有效秒数
+CALLBACK_LEASE_SECONDS = int(os.getenv("CALLBACK_LEASE_SECONDS", "900"))
+COMPLETED_STATUS = "Completed"
+FAILED_STATUS = "Failed"
+CANCELLED_STATUS = "Cancelled"
+SIGNATURE_HEADER = "X-CodeReview-Signature"
+TIMESTAMP_HEADER = "X-CodeReview-Timestamp"
+# client errors worth retrying, other 4xx responses fail the callback at once
+RETRYABLE_STATUS_CODES = [408, 429]
+
+logging.basicConfig(
+    force=True,
+    format="%(asctime)s %(levelname)-8s %(message)s",
+    level=logging.DEBUG,
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+
+def get_callback_secret():
+    global CALLBACK_SECRET
+    if not CALLBACK_SECRET and CALLBACK_SECRET_ARN:
+        secrets_manager = boto3.client("secretsmanager")
+        CALLBACK_SECRET = secrets_manager.get_secret_value(SecretId=CALLBACK_SECRET_ARN)[
+            "SecretString"
+        ]
+    return CALLBACK_SECRET
+
+
+def should_notify(image):
+    """
+    Whether a repo_code_review_table item (stream NewImage or get_item
+    result) is a completed, failed or cancelled review with a callback that
+    has not been sent yet.
+    """
+    return (
+        image.get("task_status", {}).get("S") in [COMPLETED_STATUS, FAILED_STATUS, CANCELLED_STATUS]
+        and bool(image.get("callback_url", {}).get("S"))
+        and "callback_status" not in image
+    )
+
+
+def get_review_item(review_id, table_name=REPO_CODE_REVIEW_TABLE_NAME):
+    response = DYNAMODB.get_item(
+        TableName=table_name, Key={"review_id": {"S": review_id}}, ConsistentRead=True
+    )
+    return response.get("Item", {})
+
+
+def get_lease_until(context):
+    # 认领在本次调用超时前有效, 超时被终止后异步重试可以接管
+    if context is None:
+        return datetime.now() + timedelta(seconds=CALLBACK_LEASE_SECONDS)
+    return datetime.now() + timedelta(milliseconds=context.get_remaining_time_in_millis())
+
+
+def claim_notification(review_id, context=None, table_name=REPO_CODE_REVIEW_TABLE_NAME):
+    """
+    Marks the callback of a review as being sent until the end of this
+    invocation, so a duplicated invocation does not send it twice. The claim
+    of an invocation that was killed by its timeout can be taken over.
+
+    Returns:
+    bool: True if this invocation owns the callback.
+    """
+    now = datetime.now()
+    try:
+        DYNAMODB.update_item(
+            TableName=table_name,
+            Key={"review_id": {"S": review_id}},
+            UpdateExpression="SET callback_status = :s, callback_at = :t, callback_lease_until = :l",
+            ConditionExpression="attribute_not_exists(callback_status) OR (callback_status = :s AND callback_lease_until < :t)",
+            ExpressionAttributeValues={
+                ":s": {"S": "sending"},
+                ":t": {"S": str(now)},
+                ":l": {"S": str(get_lease_until(context))},
+            },
+        )
+        return True
+    except DYNAMODB.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def release_notification(review_id, table_name=REPO_CODE_REVIEW_TABLE_NAME):
+    # 回调没有在本次调用内完成: 释放认领, 由异步调用的重试重新发送
+    try:
+        DYNAMODB.update_item(
+            TableName=table_name,
+            Key={"review_id": {"S": review_id}},
+            UpdateExpression="REMOVE callback_status, callback_lease_until",
+            ConditionExpression="callback_status = :s",
+            ExpressionAttributeValues={":s": {"S": "sending"}},
+        )
+    except Exception as e:
+        logging.debug(f"release of callback {review_id} failed: {e}")
+
+
+def finish_notification(review_id, delivered, attempts, table_name=REPO_CODE_REVIEW_TABLE_NAME):
+    DYNAMODB.update_item(
+        TableName=table_name,
+        Key={"review_id": {"S": review_id}},
+        UpdateExpression="SET callback_status = :s, callback_attempts = :n, callback_at = :t REMOVE callback_lease_until",
+        ExpressionAttributeValues={
+            ":s": {"S": "delivered" if delivered else "failed"},
+            ":n": {"N": str(attempts)},
+            ":t": {"S": str(datetime.now())},
+        },
+    )
+
+
+def get_presigned_urls(image):
+    urls = []
+    for key in ["file_review_html_key", "review_summary_html_key"]:
+        object_key = image.get(key, {}).get("S", "")
+        if object_key:
+            urls.append(
+                S3.generate_presigned_url(
+                    "get_object",
+                    Params={"Bucket": BUCKET_NAME, "Key": object_key},
+                    ExpiresIn=EXPIRES_IN,
+                )
+            )
+    return urls
+
+
+def get_number(image, key):
+    value = image.get(key, {}).get("N")
+    if value is None:
+        return None
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def build_payload(image):
+    """
+    Builds the callback body: the review identity, the presigned report URLs
+    and the score aggregates.
+    """
+    return {
+        "review_id": image["review_id"]["S"],
+        "task_status": image["task_status"]["S"],
+        "repo_url": image.get("repo_url", {}).get("S", ""),
+        "project": image.get("project", {}).get("S", ""),
+        "branch": image.get("branch", {}).get("S", ""),
+        "commit_id": image.get("commit_id", {}).get("S", ""),
+        "scan_scope": image.get("scan_scope", {}).get("S", ""),
+        "file_num": get_number(image, "file_num"),
+        "error_message": image.get("error_message", {}).get("S", ""),
+        "review_result": get_presigned_urls(image),
+        "scores": {
+            key: get_number(image, key) for key in ["min_score", "max_score", "avg_score"]
+        },
+        "timestamp": str(datetime.now()),
+    }
+
+
+def sign(body, timestamp, secret):
+    """
+    Returns the hex HMAC-SHA256 of "<timestamp>.<body>". Receivers recompute it
+    with the shared secret and reject stale timestamps.
+    """
+    message = f"{timestamp}.{body}".encode("utf-8")
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def post_callback(callback_url, address, body, headers):
+    return post_pinned(
+        callback_url, address, body.encode("utf-8"), headers, CALLBACK_TIMEOUT
+    )
+
+
+def has_time_left(context, delay=0.0):
+    # 等待 delay 秒后是否还能完成一次回调
+    if context is None:
+        return True
+    needed_ms = (delay + CALLBACK_TIMEOUT) * 1000 + CALLBACK_TIME_RESERVE_MS
+    return context.get_remaining_time_in_millis() > needed_ms
+
+
+def deliver(callback_url, address, payload, context=None):
+    """
+    POSTs the payload to callback_url over a connection to the checked
+    address, retrying network errors, 5xx, 408 and 429 responses with
+    exponential backoff while the invocation has time left.
+
+    Returns:
+    tuple: (attempts, delivered), delivered is None when the invocation ran
+    out of time before the callback succeeded or failed for good.
+    """
+    body = json.dumps(payload)
+    secret = get_callback_secret()
+    for attempt in range(1, CALLBACK_MAX_ATTEMPTS + 1):
+        if not has_time_left(context):
+            return attempt - 1, None
+        timestamp = str(int(time.time()))
+        headers = {"Content-Type": "application/json", TIMESTAMP_HEADER: timestamp}
+        if secret:
+            headers[SIGNATURE_HEADER] = "sha256=" + sign(body, timestamp, secret)
+        try:
+            status_code = post_callback(callback_url, address, body, headers)
+            logging.debug(f"callback {callback_url} attempt {attempt}: {status_code}")
+            if status_code < 300:
+                return attempt, True
+            if status_code < 500 and status_code not in RETRYABLE_STATUS_CODES:
+                return attempt, False
+        except Exception as e:
+            logging.debug(f"callback {callback_url} attempt {attempt} failed: {e}")
+        if attempt < CALLBACK_MAX_ATTEMPTS:
+            delay = CALLBACK_RETRY_DELAY * 2 ** (attempt - 1)
+            if not has_time_left(context, delay):
+                return attempt, None
+            time.sleep(delay)
+    return CALLBACK_MAX_ATTEMPTS, False
+
+
+def lambda_handler(event, context):
+    """
+    Sends the callback of one review. review_cache_invalidator, which reads
+    the stream of repo_code_review_table, invokes it asynchronously for each
+    review to notify, so a slow callback endpoint delays only its own review.
+
+    Parameters:
+    event: {"review_id": ...}
+    """
+    review_id = event["review_id"]
+    item = get_review_item(review_id)
+    if not should_notify(item) or not claim_notification(review_id, context):
+        return {"notified": 0}
+    callback_url = item["callback_url"]["S"]
+    address = resolve_callback_address(callback_url, CALLBACK_ALLOWED_HOSTS)
+    if not address:
+        logging.debug(f"callback {callback_url} of {review_id} is not allowed")
+        finish_notification(review_id, False, 0)
+        return {"notified": 0}
+    attempts, delivered = deliver(callback_url, address, build_payload(item), context)
+    if delivered is None:
+        release_notification(review_id)
+        # 抛出异常, Lambda 稍后重试这次异步调用
+        raise TimeoutError(f"callback of {review_id} did not finish in time")
+    finish_notification(review_id, delivered, attempts)
+    return {"notified": 1}
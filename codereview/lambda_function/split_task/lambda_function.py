@@ -2,23 +2,49 @@ import json
 import boto3
 import os
 from datetime import datetime, timedelta
-import gitlab
 import logging
+from botocore.exceptions import ClientError
 
+from codereview_common.clients import LazyClient
+from codereview_common.tracing import TRACE, trace_count, trace_emit, trace_reset, trace_span, traced
 
 # Initialize AWS services clients
-SQS_CLIENT = boto3.client("sqs")
-DYNAMODB = boto3.resource("dynamodb")
+SQS_CLIENT = LazyClient(lambda: boto3.client("sqs"))
+DYNAMODB = LazyClient(lambda: boto3.resource("dynamodb"))
+LAMBDA_CLIENT = LazyClient(lambda: boto3.client("lambda"))
 
 # Environment variables and constants
 CODE_REVIEW_WHITE_LIST = os.getenv("CODE_REVIEW_WHITE_LIST", ".py:.go:.cpp:.ts:.c:.js")
 SQS_URL = os.getenv("TASK_SQS_URL")
+# DIFF 审查与合并检查走低延迟队列, 不排在大型全量扫描之后
+INTERACTIVE_SQS_URL = os.getenv("INTERACTIVE_SQS_URL") or SQS_URL
+# 合并检查由 review_merge 消费
+MERGE_SQS_URL = os.getenv("MERGE_SQS_URL") or INTERACTIVE_SQS_URL
+FILE_REVIEW = "file review"
 REPO_CODE_REVIEW_TABLE_NAME = os.getenv("REPO_CODE_REVIEW_TABLE_NAME")
-REPO_CODE_REVIEW_TABLE = DYNAMODB.Table(REPO_CODE_REVIEW_TABLE_NAME)
+REPO_CODE_REVIEW_TABLE = LazyClient(lambda: DYNAMODB.Table(REPO_CODE_REVIEW_TABLE_NAME))
 LLM_STATUS = "InProgress LLM"
+COMPLETED_STATUS = "Completed"
+FAILED_STATUS = "Failed"
+CANCELLED_STATUS = "Cancelled"
 GET_FILE_ERROR = "GET FILE ERROR"
+# 所有文件都最终失败时写入任务的 error_message
+ALL_FILES_FAILED = "Every file of the review failed, see the review_dlq triage"
 LAMBDA_LOG_BUCKET_NAME = os.getenv("LAMBDA_LOG_BUCKET_NAME")
-S3 = boto3.client("s3")
+BUCKET_NAME = os.getenv("BUCKET_NAME")
+S3 = LazyClient(lambda: boto3.client("s3"))
+PROGRESS_STATUS = "InProgress"
+# review_merge message that re-checks whether a sealed split can be merged
+MERGE_CHECK = "merge check"
+# 拆分进度: 每个 invocation 最多处理的文件数, 检查点间隔, 以及超时前预留的时间
+SPLIT_FILES_PER_INVOCATION = int(os.getenv("SPLIT_FILES_PER_INVOCATION", "1000"))
+SPLIT_CHECKPOINT_FILES = int(os.getenv("SPLIT_CHECKPOINT_FILES", "100"))
+SPLIT_TIME_RESERVE_MS = int(os.getenv("SPLIT_TIME_RESERVE_MS", "120000"))
+# 全量扫描按目录分片并行拆分: 最多 SPLIT_SHARDS 个 worker, 每个分片至少 SPLIT_SHARD_MIN_FILES 个文件
+SPLIT_SHARDS = int(os.getenv("SPLIT_SHARDS", "4"))
+SPLIT_SHARD_MIN_FILES = int(os.getenv("SPLIT_SHARD_MIN_FILES", "200"))
+# used when the handler has no context, e.g. in the benchmark
+SPLIT_TASK_LAMBDA_NAME = os.getenv("SPLIT_TASK_LAMBDA_NAME")
 
 logging.basicConfig(
     force=True,
@@ -86,6 +112,7 @@ def check_extension(filename, extensions=CODE_REVIEW_WHITE_LIST):
     return file_extension in ext_list
 
 
+@traced(size_of=len)
 def get_file_content(
     project, file_path, ref_name="main", file_size_limit=FILE_SIZE_LIMIT
 ):
@@ -110,162 +137,475 @@ def get_file_content(
     return GET_FILE_ERROR
 
 
-def send_message(message, sqs_url=SQS_URL):
+def get_queue_url(msg_body):
+    """
+    Full scan file reviews go to the batch task queue, DIFF file reviews to
+    the interactive queue and merge checks to the merge queue.
+    """
+    if msg_body.get("msg_type") == MERGE_CHECK:
+        return MERGE_SQS_URL
+    if msg_body.get("msg_type") == FILE_REVIEW and msg_body.get("scan_scope") == "ALL":
+        return SQS_URL
+    return INTERACTIVE_SQS_URL
+
+
+def send_message(msg_body):
+    """
+    Sends a code_review message to its queue. MessageGroupId is the project,
+    SQS fair queues use it to keep one project's backlog from delaying the
+    others.
+    """
+    message = json.dumps(msg_body)
     try:
-        response = SQS_CLIENT.send_message(QueueUrl=sqs_url, MessageBody=message)
+        with trace_span("send_message") as span:
+            span["bytes"] = len(message)
+            response = SQS_CLIENT.send_message(
+                QueueUrl=get_queue_url(msg_body),
+                MessageBody=message,
+                MessageGroupId=str(msg_body["project"] or "default"),
+            )
         return True
     except Exception as e:
         ui_print("An unexpected error occurred:", e)
         return False
 
 
-def send_fullscan_task_to_sqs(
-    review_id, project, project_idorpath, commit_id, file_list, branch="main"
-):
+class SplitConflict(Exception):
+    """Another invocation has checkpointed the same review first."""
+
+
+def list_fullscan_files(project, file_list):
     """
-    Processes changes in a commit and sends tasks to SQS.
+    Lists the files of a full scan: file_list when given, otherwise every
+    blob of the repository tree.
+
+    Returns:
+    list: Work list entries {"file_name": ...} with a whitelisted extension.
+    """
+    if file_list == []:
+        items = project.repository_tree(path="", all=True, recursive=True)
+        file_paths = [item["path"] for item in items if item["type"] == "blob"]
+    else:
+        file_paths = file_list
+    ui_print(f"file numbers: {len(file_paths)}")
+    return [
+        {"file_name": file_path}
+        for file_path in file_paths
+        if check_extension(file_path, CODE_REVIEW_WHITE_LIST)
+    ]
+
+
+def list_diff_files(project, commit_id, file_list):
+    """
+    Lists the changed files of a commit, limited to file_list when given.
+
+    Returns:
+    list: Work list entries {"file_name": ..., "diff": ...} with a whitelisted extension.
+    """
+    commit = project.commits.get(commit_id)
+    changes = commit.diff(get_all=True, all=True)
+    return [
+        {"file_name": change["new_path"], "diff": change["diff"]}
+        for change in changes
+        if (file_list == [] or change["new_path"] in file_list)
+        and check_extension(change["new_path"], CODE_REVIEW_WHITE_LIST)
+    ]
+
+
+def partition_work(work):
+    """
+    Cuts the work list into shards for parallel split_task workers. Paths are
+    sorted so that each shard holds whole directories where possible, and
+    shards get at least SPLIT_SHARD_MIN_FILES files (a smaller work list is
+    one shard).
 
     Parameters:
-    project: The GitLab project object.
-    commit_id (str): The ID of the commit.
-    file_list(list): The list of the files.
+    work (list): The work list built by list_fullscan_files or list_diff_files.
 
     Returns:
-    int: The number of files processed.
+    list: Between 1 and SPLIT_SHARDS work lists.
     """
+    shard_num = max(1, min(SPLIT_SHARDS, len(work) // SPLIT_SHARD_MIN_FILES))
+    work = sorted(work, key=lambda entry: entry["file_name"])
+    # 均分: 各分片相差最多一个文件, 因此都不少于 SPLIT_SHARD_MIN_FILES
+    size, extra = divmod(len(work), shard_num)
+    bounds = [i * size + min(i, extra) for i in range(shard_num + 1)]
+    return [work[bounds[i] : bounds[i + 1]] for i in range(shard_num)]
 
-    # 用于存储文件路径的数组
-    file_paths = []
 
-    # 递归函数，用于遍历目录并收集文件路径
-    def list_files(project, path=""):
-        items = project.repository_tree(path=path, all=True, recursive=True)
-        # ui_print(items)
-        for item in items:
-            if item["type"] == "blob":  # 如果是文件
-                file_paths.append(item["path"])
+def get_work_list_key(review_id, shard):
+    return f"split/{review_id}/{shard}.json"
 
-    file_num = 0
-    if file_list == []:
-        list_files(project, path="")
-    else:
-        file_paths = file_list
-        
-    ui_print(f"file numbers: {len(file_paths)}")
-    for file_path in file_paths:
-        ui_print(file_path)
-        if file_num >= FILE_NUM_LIMIT:
-            ui_print(f"Processed {FILE_NUM_LIMIT} messages, stopping.")
-            break
-        if check_extension(file_path, CODE_REVIEW_WHITE_LIST):
-            file_content = get_file_content(project, file_path, branch, FILE_SIZE_LIMIT)
-            if file_content == GET_FILE_ERROR:
-                continue
+
+def put_work_list(review_id, shard, work):
+    S3.put_object(
+        Bucket=BUCKET_NAME,
+        Key=get_work_list_key(review_id, shard),
+        Body=json.dumps(work).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def get_work_list(review_id, shard):
+    response = S3.get_object(Bucket=BUCKET_NAME, Key=get_work_list_key(review_id, shard))
+    return json.loads(response["Body"].read())
+
+
+def delete_work_list(review_id, shard):
+    try:
+        S3.delete_object(Bucket=BUCKET_NAME, Key=get_work_list_key(review_id, shard))
+    except Exception as e:
+        ui_print(f"An error occurred: {e}")
+
+
+@traced(group="dynamodb")
+def get_split_checkpoint(review_id):
+    """
+    Reads the split progress of a review.
+
+    Returns:
+    dict: {"task_status", "created_at", "split_sealed", "split_shards"},
+    split_shards maps the shard number to its {"cursor", "enqueued", "done"}
+    and is None until the shards are created. None when the review does not
+    exist.
+    """
+    item = REPO_CODE_REVIEW_TABLE.get_item(
+        Key={"review_id": review_id},
+        ProjectionExpression="task_status, created_at, split_sealed, split_shards",
+        ConsistentRead=True,
+    ).get("Item")
+    if item is None:
+        return None
+    shards = None
+    if "split_shards" in item:
+        shards = {
+            int(shard): {
+                "cursor": int(state["cursor"]),
+                "enqueued": int(state["enqueued"]),
+                "done": state["done"],
+            }
+            for shard, state in item["split_shards"].items()
+        }
+    return {
+        "task_status": item.get("task_status"),
+        "created_at": item.get("created_at", ""),
+        "split_sealed": item.get("split_sealed", False),
+        "split_shards": shards,
+    }
+
+
+def update_split_item(review_id, expression, condition, names, values, return_values="NONE"):
+    kwargs = {"ExpressionAttributeNames": names} if names else {}
+    try:
+        return REPO_CODE_REVIEW_TABLE.update_item(
+            Key={"review_id": review_id},
+            UpdateExpression=expression,
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ReturnValues=return_values,
+            **kwargs,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise SplitConflict(review_id)
+        raise
+
+
+@traced(group="dynamodb")
+def create_split_shards(review_id, shard_num):
+    """
+    Stores the initial progress of every shard and clears split_sealed, which
+    keeps code_review from merging while files are still being enqueued. Only
+    the first coordinator of a review succeeds, a duplicated one raises
+    SplitConflict.
+    """
+    shards = {
+        str(shard): {"cursor": 0, "enqueued": 0, "done": False} for shard in range(shard_num)
+    }
+    update_split_item(
+        review_id,
+        "set split_shards = :m, split_pending = :n, split_enqueued = :z, split_sealed = :f, "
+        "update_at = :t",
+        "attribute_not_exists(split_shards)",
+        None,
+        {":m": shards, ":n": shard_num, ":z": 0, ":f": False, ":t": str(datetime.now())},
+    )
+
+
+@traced(group="dynamodb")
+def mark_reviewing(review_id):
+    # 第一批文件入队后即进入 LLM 审查阶段, 重复设置时忽略
+    try:
+        update_split_item(
+            review_id,
+            "set task_status = :l, update_at = :t",
+            "task_status = :i",
+            None,
+            {":l": LLM_STATUS, ":i": PROGRESS_STATUS, ":t": str(datetime.now())},
+        )
+    except SplitConflict:
+        pass
+
+
+@traced(group="dynamodb")
+def save_split_checkpoint(review_id, shard, progress, cursor, enqueued):
+    """
+    Stores the progress of one shard and adds the files enqueued since the
+    last checkpoint to file_num. The update only applies while the stored
+    cursor is still progress["cursor"], so a duplicated invocation of the
+    shard raises SplitConflict instead of counting the same files twice. A
+    cancelled review raises SplitConflict as well and the shard stops.
+
+    Parameters:
+    progress (dict): The last stored {"cursor", "enqueued"} of the shard, updated in place.
+    cursor (int): The position in the work list of the shard.
+    enqueued (int): The messages the shard sent so far.
+    """
+    update_split_item(
+        review_id,
+        "set split_shards.#s.#c = :c, split_shards.#s.#e = :e, update_at = :t add file_num :a",
+        "split_shards.#s.#c = :p and task_status <> :x",
+        {"#s": str(shard), "#c": "cursor", "#e": "enqueued"},
+        {
+            ":c": cursor,
+            ":e": enqueued,
+            ":a": enqueued - progress["enqueued"],
+            ":p": progress["cursor"],
+            ":x": CANCELLED_STATUS,
+            ":t": str(datetime.now()),
+        },
+    )
+    progress.update({"cursor": cursor, "enqueued": enqueued})
+
+
+@traced(group="dynamodb")
+def finish_split_shard(review_id, shard, progress, cursor, enqueued):
+    """
+    Stores the last checkpoint of a shard and marks it as done. The last
+    shard to finish seals the split: file_num is final from then on and
+    code_review may merge once file_done reaches it.
+
+    Returns:
+    dict: The review item after sealing, None while other shards are running.
+    """
+    response = update_split_item(
+        review_id,
+        "set split_shards.#s.#c = :c, split_shards.#s.#e = :e, split_shards.#s.#d = :d, "
+        "update_at = :t add split_pending :m, split_enqueued :e, file_num :a",
+        "split_shards.#s.#c = :p and split_shards.#s.#d = :f and task_status <> :x",
+        {"#s": str(shard), "#c": "cursor", "#e": "enqueued", "#d": "done"},
+        {
+            ":c": cursor,
+            ":e": enqueued,
+            ":a": enqueued - progress["enqueued"],
+            ":d": True,
+            ":f": False,
+            ":m": -1,
+            ":p": progress["cursor"],
+            ":x": CANCELLED_STATUS,
+            ":t": str(datetime.now()),
+        },
+        return_values="ALL_NEW",
+    )
+    if int(response["Attributes"]["split_pending"]) > 0:
+        return None
+    expression = "set split_sealed = :d, update_at = :t"
+    values = {":d": True, ":f": False, ":t": str(datetime.now())}
+    if int(response["Attributes"]["split_enqueued"]) == 0:
+        # 没有需要审查的文件时, 不会有 code_review 消息来结束任务
+        expression += ", task_status = :s"
+        values[":s"] = COMPLETED_STATUS
+    response = update_split_item(
+        review_id, expression, "split_sealed = :f", None, values, return_values="ALL_NEW"
+    )
+    item = response["Attributes"]
+    if int(item["split_enqueued"]) > 0 and int(item["file_num"]) == 0:
+        # 封口前所有文件都已最终失败, code_review 不会再结束该任务
+        fail_review_without_files(review_id)
+    return item
+
+
+def fail_review_without_files(review_id):
+    # 与 code_review 的 fail_review_without_files 一致
+    try:
+        update_split_item(
+            review_id,
+            "set task_status = :s, error_message = :e, update_at = :t",
+            "file_num = :z AND task_status IN (:p, :l)",
+            None,
+            {
+                ":s": FAILED_STATUS,
+                ":e": ALL_FILES_FAILED,
+                ":t": str(datetime.now()),
+                ":z": 0,
+                ":p": PROGRESS_STATUS,
+                ":l": LLM_STATUS,
+            },
+        )
+    except SplitConflict:
+        pass
+
+
+def send_merge_check(item, scan_scope):
+    """
+    All files were reviewed before the split was sealed, so no file review
+    will trigger the merge: ask review_merge to check it.
+    """
+    message = {
+        "review_id": item["review_id"],
+        "project": item["project"],
+        "branch": item["branch"],
+        "commit_id": item["commit_id"],
+        "file_list": item["file_list"],
+        "file_name": "merge-check",
+        "file_content": "",
+        "scan_scope": scan_scope,
+        "msg_type": MERGE_CHECK,
+    }
+    if item.get("created_at"):
+        message["run_id"] = item["created_at"]
+    return send_message(message)
+
+
+def out_of_time(context, processed):
+    if processed >= SPLIT_FILES_PER_INVOCATION:
+        return True
+    return context is not None and context.get_remaining_time_in_millis() < SPLIT_TIME_RESERVE_MS
+
+
+def send_files_to_sqs(
+    review_id, project, project_idorpath, commit_id, file_list, branch, scan_scope, work,
+    shard, progress, context=None, run_id="",
+):
+    """
+    Sends the work list of one shard from cursor on to SQS and checkpoints
+    every SPLIT_CHECKPOINT_FILES files, until the list is done or the
+    invocation runs out of time.
+
+    Parameters:
+    work (list): The work list of the shard.
+    shard (int): The shard number.
+    progress (dict): The stored {"cursor", "enqueued"} of the shard to start from.
+    run_id (str): created_at of the review item, code_review keeps the file
+    records of each run apart.
+
+    Returns:
+    tuple: (cursor, enqueued, done)
+    """
+    start = cursor = progress["cursor"]
+    enqueued = progress["enqueued"]
+    while cursor < len(work):
+        if out_of_time(context, cursor - start):
+            return cursor, enqueued, False
+        entry = work[cursor]
+        file_content = get_file_content(project, entry["file_name"], branch, FILE_SIZE_LIMIT)
+        if file_content != GET_FILE_ERROR:
             item = {
                 "review_id": review_id,
                 "project": project_idorpath,
                 "branch": branch,
                 "commit_id": commit_id,
                 "file_list": file_list,
-                "file_name": file_path,
+                "file_name": entry["file_name"],
                 "file_content": file_content,
-                "scan_scope": "ALL",
+                "scan_scope": scan_scope,
                 "msg_type": "file review",
             }
-            status = send_message(json.dumps(item))
-            if status is True:
-                file_num += 1
-            else:
-                continue
-    return file_num
-    
-    
-def check_changes_files(changes):
-    files = []
-    for change in changes:
-        files.append(change["new_path"])
-    return files
-
-
-def send_task_to_sqs(review_id, project, project_idorpath, commit_id, file_list, branch="main"):
+            if "diff" in entry:
+                item["diff"] = entry["diff"]
+            if run_id:
+                item["run_id"] = run_id
+            if send_message(item) is True:
+                enqueued += 1
+        cursor += 1
+        if cursor - progress["cursor"] >= SPLIT_CHECKPOINT_FILES and cursor < len(work):
+            save_split_checkpoint(review_id, shard, progress, cursor, enqueued)
+    return cursor, enqueued, True
+
+
+def update_dynamodb_failed(review_id, error_message, run_id=""):
     """
-    Processes changes in a commit and sends tasks to SQS.
+    Marks a review as failed when its repository or diff cannot be read,
+    getReviewResult returns error_message to the caller. Only a review of
+    the same run that is still being split is marked: a finished, cancelled
+    or fully enqueued (split_sealed) review, or a newer run after force, is
+    left as it is.
 
     Parameters:
-    project: The GitLab project object.
-    commit_id (str): The ID of the commit.
-    file_list(list): The list of files need to be reviewed
+    review_id (str): The ID of the review.
+    error_message (str): The reason of the failure.
+    run_id (str): created_at of the review item the invocation belongs to.
+    """
+    condition = "task_status IN (:p, :l) AND (attribute_not_exists(split_sealed) OR split_sealed = :f)"
+    values = {
+        ":f": False,
+        ":s": FAILED_STATUS,
+        ":t": str(datetime.now()),
+        ":e": error_message,
+        ":p": PROGRESS_STATUS,
+        ":l": LLM_STATUS,
+    }
+    if run_id:
+        condition += " AND created_at = :r"
+        values[":r"] = run_id
+    try:
+        update_split_item(
+            review_id,
+            "set task_status = :s, update_at = :t, error_message = :e",
+            condition,
+            None,
+            values,
+        )
+    except SplitConflict:
+        ui_print(f"review {review_id} is no longer in progress, keep its status")
 
-    Returns:
-    int: The number of files processed.
-    """
-    file_num = 0
-    if commit_id != "00000000" and file_list != []:
-        commit = project.commits.get(commit_id)
-        changes = commit.diff(get_all=True, all=True)
-        change_files = list(set(check_changes_files(changes)) & set(file_list))
-    elif commit_id != "00000000" and file_list == []:
-        commit = project.commits.get(commit_id)
-        changes = commit.diff(get_all=True, all=True)
-        change_files = check_changes_files(changes)
-                    
-    for change in changes:
-        if change["new_path"] in change_files:
-            if file_num >= FILE_NUM_LIMIT:
-                ui_print(f"Processed {FILE_NUM_LIMIT} messages, stopping.")
-                break
-            if check_extension(change["new_path"], CODE_REVIEW_WHITE_LIST):
-                file_content = get_file_content(project, change["new_path"], branch)
-                if file_content == GET_FILE_ERROR:
-                    continue
-    
-                item = {
-                    "review_id": review_id,
-                    "project": project_idorpath,
-                    "branch": branch,
-                    "commit_id": commit_id,
-                    "file_list": file_list,
-                    "file_name": change["new_path"],
-                    "diff": change["diff"],
-                    "file_content": file_content,
-                    "scan_scope": "DIFF",
-                    "msg_type": "file review",
-                }
-                status = send_message(json.dumps(item))
-                if status is True:
-                    file_num += 1
-                else:
-                    continue
-    return file_num
-
-
-def update_dynamodb_status(review_id, status, file_num):
-    """
-    Updates the status of a commit in DynamoDB.
 
-    Parameters:
-    commit_id (str): The ID of the commit.
-    status (str): The new status.
-    file_num (int): The number of files processed.
-    """
-    REPO_CODE_REVIEW_TABLE.update_item(
-        Key={"review_id": review_id},
-        UpdateExpression="set task_status = :s, update_at = :t, file_num = file_num + :m",
-        ExpressionAttributeValues={
-            ":s": status,
-            ":t": str(datetime.now()),
-            ":m": file_num,
-        },
-        ReturnValues="ALL_NEW",
+def reinvoke(event, context):
+    # 异步调用自身: 启动分片 worker, 或在超时前从检查点继续拆分
+    function_name = context.function_name if context is not None else SPLIT_TASK_LAMBDA_NAME
+    LAMBDA_CLIENT.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps(event),
     )
 
 
+def start_split(event, context, review_id, project, commit_id, file_list, scan_scope):
+    """
+    Coordinator: lists the files once, stores the work list of every shard
+    and invokes a split_task worker for each shard but the first one, which
+    the coordinator works itself.
+
+    Returns:
+    list: The work list of shard 0.
+    """
+    if scan_scope == "ALL":
+        work = list_fullscan_files(project, file_list)
+    else:
+        work = list_diff_files(project, commit_id, file_list)
+    if len(work) > FILE_NUM_LIMIT:
+        ui_print(f"Processed {FILE_NUM_LIMIT} messages, stopping.")
+        work = work[:FILE_NUM_LIMIT]
+    shards = partition_work(work)
+    for shard, shard_work in enumerate(shards):
+        put_work_list(review_id, shard, shard_work)
+    create_split_shards(review_id, len(shards))
+    for shard in range(1, len(shards)):
+        reinvoke(dict(event, shard=shard), context)
+    ui_print(f"split {len(work)} files into {len(shards)} shards")
+    return shards[0]
+
+
 def lambda_handler(event, context):
     """
-    The main function to handle the lambda event.
+    The main function to handle the lambda event. The invocation from
+    api_post_code_review coordinates the split: it shards the files and
+    starts one worker invocation per shard. Each shard keeps its work list
+    in S3 and its progress in the review item, resumes from the stored
+    checkpoint and re-invokes itself before the timeout.
 
     Parameters:
-    event: The event triggering the lambda.
+    event: The event triggering the lambda, with "shard" for worker invocations.
     context: The context in which the lambda is executed.
 
     Returns:
@@ -280,28 +620,107 @@ def lambda_handler(event, context):
     file_list = event["file_list"]
     scan_scope = event["scan_scope"]
     branch = event["branch"]
+    shard = event.get("shard")
+    run_id = event.get("run_id", "")
     current_time = datetime.now()
-
-    # Get diff and insert into SQS
-    if not repo_url:
-        gl = gitlab.Gitlab(private_token=private_token)
-    else:
-        gl = gitlab.Gitlab(repo_url, private_token=private_token)
-    project = gl.projects.get(project_idorpath)
-    if scan_scope == "ALL":
-        file_num = send_fullscan_task_to_sqs(
-            review_id, project, project_idorpath, commit_id, file_list, branch
-        )
-    else:
-        file_num = send_task_to_sqs(
-            review_id, project, project_idorpath, commit_id, file_list, branch
-        )
-    # Update DynamoDB - request
-    update_dynamodb_status(review_id, LLM_STATUS, file_num)
+    trace_reset(Stage="split", Project=project_idorpath)
+    TRACE["properties"].update({"ReviewId": review_id, "Shard": shard or 0})
     result = {
         "status": "Success",
         "error_message": "",
         "review_id": review_id,
         "timestamp": str(current_time),
     }
+
+    # Get diff and insert into SQS
+    with trace_span("invocation"):
+        try:
+            checkpoint = get_split_checkpoint(review_id)
+            if (
+                checkpoint is None
+                or checkpoint["split_sealed"]
+                or checkpoint["task_status"] in [FAILED_STATUS, CANCELLED_STATUS]
+                or (run_id and checkpoint["created_at"] != run_id)
+            ):
+                # 重复的调用, 任务已拆分完成、已失败、已取消, 或属于 force 重跑之前的一次运行
+                raise SplitConflict(review_id)
+            # python-gitlab 导入较慢, 重复调用在这之前就已返回
+            import gitlab
+
+            if not repo_url:
+                gl = gitlab.Gitlab(private_token=private_token)
+            else:
+                gl = gitlab.Gitlab(repo_url, private_token=private_token)
+            project = gl.projects.get(project_idorpath)
+            shards = checkpoint["split_shards"]
+            if shards is None:
+                work = start_split(
+                    event, context, review_id, project, commit_id, file_list, scan_scope
+                )
+                shard, progress = 0, {"cursor": 0, "enqueued": 0}
+            else:
+                if shard is None:
+                    # 协调调用被重试: 重新启动还没有检查点的分片
+                    shard = 0
+                    for other, state in shards.items():
+                        if other != 0 and state["cursor"] == 0 and not state["done"]:
+                            reinvoke(dict(event, shard=other), context)
+                if shards[shard]["done"]:
+                    raise SplitConflict(review_id)
+                work = get_work_list(review_id, shard)
+                progress = {"cursor": shards[shard]["cursor"], "enqueued": shards[shard]["enqueued"]}
+            if progress["cursor"] < len(work):
+                mark_reviewing(review_id)
+            started = progress["enqueued"]
+            cursor, enqueued, done = send_files_to_sqs(
+                review_id,
+                project,
+                project_idorpath,
+                commit_id,
+                file_list,
+                branch,
+                "ALL" if scan_scope == "ALL" else "DIFF",
+                work,
+                shard,
+                progress,
+                context,
+                run_id,
+            )
+            trace_count("files_enqueued", enqueued - started)
+            if done:
+                # Update DynamoDB - request
+                item = finish_split_shard(review_id, shard, progress, cursor, enqueued)
+                delete_work_list(review_id, shard)
+                ui_print(f"split shard {shard} of {review_id} done, sealed: {item is not None}")
+                if (
+                    item is not None
+                    and file_list == []
+                    and 0 < int(item["file_num"]) <= int(item["file_done"])
+                ):
+                    send_merge_check(item, "ALL" if scan_scope == "ALL" else "DIFF")
+            else:
+                save_split_checkpoint(review_id, shard, progress, cursor, enqueued)
+                reinvoke(dict(event, shard=shard), context)
+                result["status"] = "Continued"
+        except SplitConflict:
+            checkpoint = get_split_checkpoint(review_id)
+            if (
+                shard is not None
+                and checkpoint
+                and checkpoint["task_status"] == CANCELLED_STATUS
+                and (not run_id or checkpoint["created_at"] == run_id)
+            ):
+                # 任务已取消, 该分片不会再继续, 清理文件列表
+                delete_work_list(review_id, shard)
+            ui_print(f"split task {review_id} is handled by another invocation, skip")
+            result["status"] = "Skipped"
+            return {"statusCode": 200, "body": json.dumps(result)}
+        except Exception as e:
+            # 异步调用没有调用方可以接收异常, 把错误写回任务记录
+            ui_print(f"split task {review_id} failed: {e}")
+            update_dynamodb_failed(review_id, str(e), run_id)
+            trace_emit()
+            result.update({"status": "failure", "error_message": str(e)})
+            return {"statusCode": 200, "body": json.dumps(result)}
+    trace_emit()
     return {"statusCode": 200, "body": json.dumps(result)}
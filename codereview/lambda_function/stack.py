@@ -1,3 +1,5 @@
+import json
+
 from aws_cdk import (
     Duration,
     aws_lambda,
@@ -9,6 +11,34 @@ from aws_cdk import aws_ecr_assets as ecr_assets
 from constructs import Construct
 
 
+# 各函数的默认内存 (MB)、架构与超时 (秒), 可按函数通过 lambda_config 上下文覆盖:
+# cdk.json 的 "context" 或 cdk deploy -c lambda_config='{"api_get_result": {"memory_size": 512}}'
+# 推荐值见 python -m benchmark.rightsizing
+FUNCTION_CONFIG = {
+    # 只做参数校验和任务写入, GitLab 由 split_task 访问
+    "api_post_code_review": {"memory_size": 4096, "architecture": "x86_64", "timeout": 30},
+    "split_task": {"memory_size": 4096, "architecture": "x86_64", "timeout": 900},
+    "api_get_result": {"memory_size": 4096, "architecture": "x86_64", "timeout": 40},
+    "code_review": {"memory_size": 1024, "architecture": "x86_64", "timeout": 900},
+    "review_merge": {"memory_size": 4096, "architecture": "x86_64", "timeout": 900},
+    "review_summary": {"memory_size": 1024, "architecture": "x86_64", "timeout": 900},
+    "codereview_get_score_file": {"memory_size": 4096, "architecture": "x86_64", "timeout": 900},
+    "modify_dynamodb": {"memory_size": 4096, "architecture": "x86_64", "timeout": 900},
+    "record_counter": {"memory_size": 256, "architecture": "x86_64", "timeout": 60},
+    "review_cache_invalidator": {"memory_size": 256, "architecture": "x86_64", "timeout": 60},
+    "review_notifier": {"memory_size": 256, "architecture": "x86_64", "timeout": 120},
+    "review_dlq": {"memory_size": 256, "architecture": "x86_64", "timeout": 900},
+}
+ARCHITECTURES = {
+    "x86_64": aws_lambda.Architecture.X86_64,
+    "arm64": aws_lambda.Architecture.ARM_64,
+}
+# SQS 触发的函数超时不能超过队列的可见性超时 (20 分钟), Lambda 上限为 900 秒
+MAX_TIMEOUT = 900
+MIN_MEMORY_SIZE = 128
+MAX_MEMORY_SIZE = 10240
+
+
 class Lambda(Construct):
     def __init__(
         self, scope: Construct, construct_id: str, env_name_string: str, **kwargs
@@ -54,20 +84,29 @@ class Lambda(Construct):
             compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_11],
             layer_version_name="pygmentspython_layer_{}".format(env_name_string),
         )
+
+        # helpers shared by the functions (boto3 client factory, tracing, response cache)
+
+        common_layer = aws_lambda.LayerVersion(
+            self,
+            "commonpython_layer",
+            code=aws_lambda.Code.from_asset("codereview/lambda_common"),
+            compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_11],
+            layer_version_name="commonpython_layer_{}".format(env_name_string),
+        )
         # code review post lambda function
 
         self.api_post_codereview = aws_lambda.Function(
             self,
             "api_post_code_review",
             runtime=aws_lambda.Runtime.PYTHON_3_11,
-            timeout=Duration.seconds(900),
-            memory_size=4096,
+            **self.function_config("api_post_code_review"),
             code=aws_lambda.Code.from_asset(
                 "codereview/lambda_function/api_post_code_review"
             ),
             handler="lambda_function.lambda_handler",
             function_name="code_review_post_{}".format(env_name_string),
-            layers=[gitlabpython_layer],
+            layers=[common_layer],
         )
 
         # split task lambda function
@@ -76,12 +115,11 @@ class Lambda(Construct):
             self,
             "split_task",
             runtime=aws_lambda.Runtime.PYTHON_3_11,
-            timeout=Duration.seconds(900),
-            memory_size=4096,
+            **self.function_config("split_task"),
             code=aws_lambda.Code.from_asset("codereview/lambda_function/split_task"),
             handler="lambda_function.lambda_handler",
             function_name="split_task_{}".format(env_name_string),
-            layers=[gitlabpython_layer],
+            layers=[gitlabpython_layer, common_layer],
         )
 
         # get result lambda function
@@ -90,28 +128,55 @@ class Lambda(Construct):
             self,
             "api_get_result",
             runtime=aws_lambda.Runtime.PYTHON_3_11,
-            timeout=Duration.seconds(40),
-            memory_size=4096,
+            **self.function_config("api_get_result"),
             code=aws_lambda.Code.from_asset(
                 "codereview/lambda_function/api_get_result"
             ),
             handler="lambda_function.lambda_handler",
             function_name="get_result_{}".format(env_name_string),
-            layers=[],
+            layers=[common_layer],
         )
 
-        # code review lambda function
+        # code review lambda function, per-file reviews mostly wait on Bedrock
+        # 报告相关的层保留, 部署前已入队的合并与汇总消息仍可在此处理
 
         self.code_review = aws_lambda.Function(
             self,
             "code_review",
             runtime=aws_lambda.Runtime.PYTHON_3_11,
-            timeout=Duration.seconds(900),
-            memory_size=4096,
+            **self.function_config("code_review"),
             code=aws_lambda.Code.from_asset("codereview/lambda_function/code_review"),
             handler="lambda_function.lambda_handler",
             function_name="code_review_{}".format(env_name_string),
-            layers=[boto3python_layer, jinja2python_layer, pygmentspython_layer],
+            layers=[boto3python_layer, jinja2python_layer, pygmentspython_layer, common_layer],
+        )
+
+        # review merge lambda function, same code as code_review: downloads the
+        # per-file results and renders the HTML report, CPU and memory bound
+
+        self.review_merge = aws_lambda.Function(
+            self,
+            "review_merge",
+            runtime=aws_lambda.Runtime.PYTHON_3_11,
+            **self.function_config("review_merge"),
+            code=aws_lambda.Code.from_asset("codereview/lambda_function/code_review"),
+            handler="lambda_function.lambda_handler",
+            function_name="review_merge_{}".format(env_name_string),
+            layers=[boto3python_layer, jinja2python_layer, pygmentspython_layer, common_layer],
+        )
+
+        # review summary lambda function, same code as code_review: one Bedrock
+        # call over the merged results and a small HTML page
+
+        self.review_summary = aws_lambda.Function(
+            self,
+            "review_summary",
+            runtime=aws_lambda.Runtime.PYTHON_3_11,
+            **self.function_config("review_summary"),
+            code=aws_lambda.Code.from_asset("codereview/lambda_function/code_review"),
+            handler="lambda_function.lambda_handler",
+            function_name="review_summary_{}".format(env_name_string),
+            layers=[boto3python_layer, jinja2python_layer, common_layer],
         )
 
         # Project Score lambda function
@@ -120,12 +185,11 @@ class Lambda(Construct):
             self,
             "codereview_get_score_file",
             runtime=aws_lambda.Runtime.PYTHON_3_11,
-            timeout=Duration.seconds(900),
-            memory_size=4096,
+            **self.function_config("codereview_get_score_file"),
             code=aws_lambda.Code.from_asset("codereview/lambda_function/codereview_get_score_file"),
             handler="lambda_function.lambda_handler",
             function_name="codereview_get_score_file_{}".format(env_name_string),
-            layers=[boto3python_layer, jinja2python_layer, pygmentspython_layer],
+            layers=[boto3python_layer, jinja2python_layer, pygmentspython_layer, common_layer],
         )
 
         # Modify dynamodb records function
@@ -134,9 +198,91 @@ class Lambda(Construct):
             self,
             "modify_dynamodb",
             runtime=aws_lambda.Runtime.PYTHON_3_11,
-            timeout=Duration.seconds(900),
-            memory_size=4096,
+            **self.function_config("modify_dynamodb"),
             code=aws_lambda.Code.from_asset("codereview/lambda_function/modify_dynamodb"),
             handler="lambda_function.lambda_handler",
             function_name="modify_dynamodb_{}".format(env_name_string),
         )
+
+        # Record counter function, consumes the request table stream
+
+        self.record_counter = aws_lambda.Function(
+            self,
+            "record_counter",
+            runtime=aws_lambda.Runtime.PYTHON_3_11,
+            **self.function_config("record_counter"),
+            code=aws_lambda.Code.from_asset("codereview/lambda_function/record_counter"),
+            handler="lambda_function.lambda_handler",
+            function_name="record_counter_{}".format(env_name_string),
+        )
+
+        # Response cache invalidation function, consumes the request table stream
+
+        self.review_cache_invalidator = aws_lambda.Function(
+            self,
+            "review_cache_invalidator",
+            runtime=aws_lambda.Runtime.PYTHON_3_11,
+            **self.function_config("review_cache_invalidator"),
+            code=aws_lambda.Code.from_asset("codereview/lambda_function/review_cache_invalidator"),
+            handler="lambda_function.lambda_handler",
+            function_name="review_cache_invalidator_{}".format(env_name_string),
+        )
+
+        # Completion callback function, consumes the request table stream
+
+        self.review_notifier = aws_lambda.Function(
+            self,
+            "review_notifier",
+            runtime=aws_lambda.Runtime.PYTHON_3_11,
+            **self.function_config("review_notifier"),
+            code=aws_lambda.Code.from_asset("codereview/lambda_function/review_notifier"),
+            handler="lambda_function.lambda_handler",
+            function_name="review_notifier_{}".format(env_name_string),
+            layers=[common_layer],
+        )
+
+        # Dead-letter triage and replay function, invoked manually
+
+        self.review_dlq = aws_lambda.Function(
+            self,
+            "review_dlq",
+            runtime=aws_lambda.Runtime.PYTHON_3_11,
+            **self.function_config("review_dlq"),
+            code=aws_lambda.Code.from_asset("codereview/lambda_function/review_dlq"),
+            handler="lambda_function.lambda_handler",
+            function_name="review_dlq_{}".format(env_name_string),
+        )
+
+    def function_config(self, name):
+        """
+        Returns the memory_size, architecture and timeout arguments of a
+        function: FUNCTION_CONFIG overridden by the lambda_config context.
+
+        Parameters:
+        name (str): The construct id of the function.
+
+        Returns:
+        dict: Keyword arguments for aws_lambda.Function.
+        """
+        overrides = self.node.try_get_context("lambda_config") or {}
+        if isinstance(overrides, str):
+            overrides = json.loads(overrides)
+        unknown = set(overrides) - set(FUNCTION_CONFIG)
+        if unknown:
+            raise ValueError(f"lambda_config has unknown functions: {sorted(unknown)}")
+        config = dict(FUNCTION_CONFIG[name], **overrides.get(name, {}))
+        memory_size = int(config["memory_size"])
+        timeout = int(config["timeout"])
+        if not MIN_MEMORY_SIZE <= memory_size <= MAX_MEMORY_SIZE:
+            raise ValueError(
+                f"{name}: memory_size should be between {MIN_MEMORY_SIZE} and {MAX_MEMORY_SIZE} MB"
+            )
+        if not 1 <= timeout <= MAX_TIMEOUT:
+            raise ValueError(f"{name}: timeout should be between 1 and {MAX_TIMEOUT} seconds")
+        if config["architecture"] not in ARCHITECTURES:
+            raise ValueError(f"{name}: architecture should be one of {sorted(ARCHITECTURES)}")
+        return {
+            "memory_size": memory_size,
+            "architecture": ARCHITECTURES[config["architecture"]],
+            "timeout": Duration.seconds(timeout),
+        }
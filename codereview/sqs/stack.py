@@ -4,13 +4,87 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+# 一条消息最多处理的次数, 之后由 redrive policy 移入死信队列
+MAX_RECEIVE_COUNT = 7
+
 class SQS(Construct):
     def __init__(self, scope: Construct, construct_id: str, env_name_string: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        self.max_receive_count = MAX_RECEIVE_COUNT
+
+        self.codereview_task_dlq = sqs.Queue(
+            self, "codereview_task_dlq",
+            queue_name="codereview_task_dlq_{}".format(env_name_string),
+            retention_period=Duration.days(14),
+            encryption=sqs.QueueEncryption.KMS_MANAGED,
+            )
+
+        # 可见性超时不能小于 code_review 的超时; 处理中的消息由 code_review 的心跳续期
         self.codereview_task_queue = sqs.Queue(
             self, "codereview_task_queue",
             queue_name="codereview_task_queue_{}".format(env_name_string),
             visibility_timeout=Duration.minutes(20),
             encryption=sqs.QueueEncryption.KMS_MANAGED,
-            )
\ No newline at end of file
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=MAX_RECEIVE_COUNT,
+                queue=self.codereview_task_dlq,
+            ),
+            )
+
+        self.codereview_interactive_dlq = sqs.Queue(
+            self, "codereview_interactive_dlq",
+            queue_name="codereview_interactive_dlq_{}".format(env_name_string),
+            retention_period=Duration.days(14),
+            encryption=sqs.QueueEncryption.KMS_MANAGED,
+            )
+
+        # DIFF 文件审查的低延迟队列, codereview_task_queue 只承载全量扫描的文件审查
+        self.codereview_interactive_queue = sqs.Queue(
+            self, "codereview_interactive_queue",
+            queue_name="codereview_interactive_queue_{}".format(env_name_string),
+            visibility_timeout=Duration.minutes(20),
+            encryption=sqs.QueueEncryption.KMS_MANAGED,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=MAX_RECEIVE_COUNT,
+                queue=self.codereview_interactive_dlq,
+            ),
+            )
+
+        self.codereview_merge_dlq = sqs.Queue(
+            self, "codereview_merge_dlq",
+            queue_name="codereview_merge_dlq_{}".format(env_name_string),
+            retention_period=Duration.days(14),
+            encryption=sqs.QueueEncryption.KMS_MANAGED,
+            )
+
+        # 合并检查由 review_merge 消费, 大型报告的合并不占用文件审查的并发
+        self.codereview_merge_queue = sqs.Queue(
+            self, "codereview_merge_queue",
+            queue_name="codereview_merge_queue_{}".format(env_name_string),
+            visibility_timeout=Duration.minutes(20),
+            encryption=sqs.QueueEncryption.KMS_MANAGED,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=MAX_RECEIVE_COUNT,
+                queue=self.codereview_merge_dlq,
+            ),
+            )
+
+        self.codereview_summary_dlq = sqs.Queue(
+            self, "codereview_summary_dlq",
+            queue_name="codereview_summary_dlq_{}".format(env_name_string),
+            retention_period=Duration.days(14),
+            encryption=sqs.QueueEncryption.KMS_MANAGED,
+            )
+
+        # 全量扫描的汇总消息, 由 review_summary 消费
+        self.codereview_summary_queue = sqs.Queue(
+            self, "codereview_summary_queue",
+            queue_name="codereview_summary_queue_{}".format(env_name_string),
+            visibility_timeout=Duration.minutes(20),
+            encryption=sqs.QueueEncryption.KMS_MANAGED,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=MAX_RECEIVE_COUNT,
+                queue=self.codereview_summary_dlq,
+            ),
+            )